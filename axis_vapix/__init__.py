@@ -1 +1,25 @@
 from .axis_camera import *
+from .capture import SyncCapture, CaptureSet, CapturedFrame
+from .restream import MjpegRestreamer, RestreamServer, Subscription, Frame
+from .recorder import SegmentRecorder, SegmentReader
+from .decode import DecodePool, DecodedFrame
+from .gating import ChangeGate
+from .adaptive import QualityController, LinkBudget
+from .cache import CapabilityCache
+from .logs import LogTailer, LogRecord, parse_log_line
+from .accesslog import AccessLog, AccessLogParser
+from .reports import ReportCollector
+from .clock import ClockSync, ClockEstimate, ClockSample
+from .overlay import OverlayUpdater, OverlayHub
+from .users import UserProvisioner, UserSpec, UserTable, ProvisionReport
+from .profiles import ProfileManager, ProfileCatalog, StreamProfile
+from .backup import FleetBackup, BackupReport, RestoreReport, load_backup, save_backup
+from .health import HealthMonitor, HealthEvent
+from .discovery import Discovery, Device, load_inventory, save_inventory
+from .encoder import Encoder, ChannelResult
+from .calibration import PTZCalibration
+from .latency import LatencyProfiler, LatencyProfile, MoveResult
+from .ptzstate import PTZState
+from .telemetry import TelemetryStore
+from .traffic import record, replay, read_traffic, Exchange, TrafficWriter
+from .loadgen import LoadGenerator, WorkloadReport, format_report
@@ -0,0 +1,383 @@
+"""
+Columnar parsing and analysis of camera access logs.
+
+Access log bodies are parsed in large chunks with one regular expression pass per chunk, and the
+fields go straight into NumPy columns: timestamps as float64, status codes as uint16 and client
+address, user, method and CGI path dictionary-encoded as int32 codes into small vocabularies. The
+regular expression pass yields a tuple of fields per line, but only for the chunk being parsed;
+nothing is kept per line, so tens of millions of lines from a whole fleet fit in a few hundred
+megabytes, and the aggregations (top clients, 401 rates, per CGI request counts over time) are
+single ``bincount`` calls over the windows that have requests.
+
+Requires ``numpy`` (``pip install axis_vapix[analytics]``).
+"""
+import re
+import logging
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+_log = logging.getLogger(__name__)
+
+_ACCESS_LOG_PATH = '/axis-cgi/accesslog.cgi'
+
+_TIMESTAMP = (rb'(?:(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(?:\.(\d+))?(Z|[+-]\d\d:?\d\d)?'
+              rb'|([A-Z][a-z]{2})\s+(\d{1,2})\s(\d\d:\d\d:\d\d))')
+_CLIENT = rb'(\d{1,3}(?:\.\d{1,3}){3}|[0-9a-fA-F]*:[0-9a-fA-F:.]+)'
+# One pass for both request formats, anchored on the syslog header so that nothing is scanned:
+#   <timestamp> <host> [ <level> ] httpd[123]: 10.0.0.2 - root [01/Mar/2024:10:00:01 +0100]
+#       "GET /axis-cgi/x.cgi?a=b HTTP/1.1" 200
+#   <timestamp> <host> httpd[123]: 10.0.0.2 root GET /axis-cgi/x.cgi?a=b 200
+_ACCESS_LINE = re.compile(
+    rb'^' + _TIMESTAMP + rb'\s+\S+\s+(?:\[[^\]\n]*\]\s+)?[^\s:]+:\s+' + _CLIENT + rb'\s+'
+    rb'(?:\S+\s+(\S+)\s+\[[^\]\n]*\]\s+"([A-Z]+)\s+([^\s?"]+)[^"\n]*"'
+    rb'|(\S+)\s+([A-Z]+)\s+([^\s?]+)\S*)\s+(\d{3})\b', re.MULTILINE)
+
+_MONTHS = {name.encode(): number for number, name in enumerate(
+    ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'), 1)}
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError('access log analysis requires numpy, '
+                          'install it with "pip install axis_vapix[analytics]"')
+
+
+def _tz_seconds(text: bytes) -> int:
+    if not text or text == b'Z':
+        return 0
+    text = text.replace(b':', b'')
+    sign = -1 if text[:1] == b'-' else 1
+    return sign * (int(text[1:3]) * 3600 + int(text[3:5]) * 60)
+
+
+class _Vocabulary:
+    """
+    Dictionary encoding of one categorical column.
+    """
+
+    def __init__(self):
+        self.values = []
+        self._codes = {}
+        self._lock = threading.Lock()
+
+    def encode(self, column: list):
+        uniques, inverse = np.unique(np.array(column, dtype=bytes), return_inverse=True)
+        with self._lock:
+            lut = np.empty(len(uniques), dtype=np.int32)
+            for i, value in enumerate(uniques):
+                code = self._codes.get(value)
+                if code is None:
+                    code = self._codes[value] = len(self.values)
+                    self.values.append(value.decode('utf-8', 'replace'))
+                lut[i] = code
+        return lut[inverse.reshape(-1)]
+
+
+class AccessLog:
+    """
+    Columnar access log records of one or many cameras.
+
+    Every attribute below is an array with one entry per request, ``camera``, ``client``,
+    ``user``, ``method`` and ``path`` being codes into the matching ``*_values`` list.
+
+    Attributes:
+        time: float64 seconds since the epoch
+        status: uint16 HTTP status
+        camera, client, user, method, path: int32 codes
+    """
+
+    _CATEGORIES = ('camera', 'client', 'user', 'method', 'path')
+
+    def __init__(self, time, status, codes: dict, vocabularies: dict):
+        self.time = time
+        self.status = status
+        for name in self._CATEGORIES:
+            setattr(self, name, codes[name])
+            setattr(self, name + '_values', vocabularies[name])
+
+    def __len__(self):
+        return len(self.time)
+
+    def _select(self, mask):
+        return AccessLog(self.time[mask], self.status[mask],
+                         {name: getattr(self, name)[mask] for name in self._CATEGORIES},
+                         {name: getattr(self, name + '_values') for name in self._CATEGORIES})
+
+    def between(self, start: float = None, end: float = None):
+        """
+        Returns:
+            The records with ``start <= time < end``.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if start is not None:
+            mask &= self.time >= start
+        if end is not None:
+            mask &= self.time < end
+        return self._select(mask)
+
+    def where(self, **criteria):
+        """
+        Filter on categorical values or status, e.g. ``where(camera='10.0.0.5', status=401)``.
+
+        Returns:
+            The matching records.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for name, value in criteria.items():
+            if name == 'status':
+                mask &= self.status == value
+            elif name in self._CATEGORIES:
+                values = getattr(self, name + '_values')
+                mask &= getattr(self, name) == (values.index(value) if value in values else -1)
+            else:
+                raise ValueError(f'unknown column {name!r}')
+        return self._select(mask)
+
+    def _top(self, name: str, count: int, mask=None) -> list:
+        codes = getattr(self, name) if mask is None else getattr(self, name)[mask]
+        counts = np.bincount(codes, minlength=len(getattr(self, name + '_values')))
+        order = np.argsort(counts)[::-1][:count]
+        values = getattr(self, name + '_values')
+        return [(values[i], int(counts[i])) for i in order if counts[i]]
+
+    def top_clients(self, count: int = 10, status: int = None) -> list:
+        """
+        Args:
+            count: number of clients returned
+            status: only count requests answered with this status, e.g. 401
+
+        Returns:
+            List of (client address, request count), busiest first.
+        """
+        return self._top('client', count, None if status is None else self.status == status)
+
+    def top(self, column: str, count: int = 10, status: int = None) -> list:
+        """
+        Most frequent values of any categorical column ('camera', 'client', 'user', 'method',
+        'path').
+        """
+        if column not in self._CATEGORIES:
+            raise ValueError(f'unknown column {column!r}')
+        return self._top(column, count, None if status is None else self.status == status)
+
+    def _windows(self, window: float):
+        """
+        Sparse windows: the start times of the windows holding requests, and the index of the
+        window of every request. A stray line dated 1970 costs one window, not millions.
+        """
+        windows, inverse = np.unique(self.time // window, return_inverse=True)
+        return windows * window, inverse.reshape(-1)
+
+    def status_rate(self, status: int = 401, window: float = 3600.0) -> tuple:
+        """
+        Share of requests answered with ``status`` per time window.
+
+        Args:
+            status: HTTP status counted
+            window: window length in seconds
+
+        Returns:
+            (window start times, request counts, ``status`` counts, rates) as arrays, for the
+            windows holding requests only.
+        """
+        starts, bins = self._windows(window)
+        size = len(starts)
+        totals = np.bincount(bins, minlength=size)
+        hits = np.bincount(bins, weights=self.status == status, minlength=size).astype(np.int64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rates = np.where(totals > 0, hits / np.maximum(totals, 1), 0.0)
+        return starts, totals, hits, rates
+
+    def unauthorized_rate(self, window: float = 3600.0) -> tuple:
+        """
+        :meth:`status_rate` for 401, the brute force and misconfigured client indicator.
+        """
+        return self.status_rate(401, window)
+
+    def requests_per_path(self, window: float = 3600.0) -> tuple:
+        """
+        Request count of every CGI path per time window.
+
+        Returns:
+            (window start times, path values, counts) where counts is a windows x paths matrix,
+            for the windows holding requests only.
+        """
+        starts, bins = self._windows(window)
+        size, paths = len(starts), len(self.path_values)
+        counts = np.bincount(bins * paths + self.path, minlength=size * paths)
+        return starts, list(self.path_values), counts.reshape(size, paths)
+
+
+class AccessLogParser:
+    """
+    Builder of an :class:`AccessLog` from access log bodies of many cameras.
+
+    Lines are matched per chunk of about ``chunk_size`` bytes and converted to arrays at once.
+    Lines in an unknown format are skipped and counted in ``skipped``.
+
+    Args:
+        chunk_size: bytes parsed per regular expression pass
+
+    Example:
+        parser = AccessLogParser()
+        parser.collect(cameras)
+        log = parser.result()
+        print(log.top_clients(10, status=401))
+    """
+
+    def __init__(self, chunk_size: int = 8 * 1024 * 1024):
+        _require_numpy()
+        self.chunk_size = chunk_size
+        self._vocabularies = {name: _Vocabulary() for name in AccessLog._CATEGORIES}
+        self._chunks = []
+        self._lock = threading.Lock()
+        self.lines = 0
+        self.skipped = 0
+        self._local_offset = datetime.datetime.now().astimezone().utcoffset().total_seconds()
+
+    def _times(self, columns: list):
+        iso, fraction, zone, month, day, clock = columns[:6]
+        iso = np.array(iso, dtype='S19')
+        times = np.zeros(len(iso), dtype=np.float64)
+        is_iso = iso != b''
+
+        if is_iso.any():
+            stamp = iso[is_iso].astype('datetime64[s]').astype(np.int64).astype(np.float64)
+            fraction = np.char.ljust(np.array(fraction, dtype='S6')[is_iso], 6, b'0')
+            stamp += fraction.astype(np.int64) / 1e6
+            zones, inverse = np.unique(np.array(zone, dtype='S6')[is_iso], return_inverse=True)
+            offsets = np.array([_tz_seconds(value) for value in zones], dtype=np.float64)
+            times[is_iso] = stamp - offsets[inverse.reshape(-1)]
+
+        if not is_iso.all():
+            # syslog style lines have no year and no zone: current year, local time
+            other = ~is_iso
+            months, inverse = np.unique(np.array(month, dtype='S3')[other], return_inverse=True)
+            numbers = np.array([_MONTHS.get(value, 1) for value in months])[inverse.reshape(-1)]
+            date = np.char.add(np.char.add(
+                np.char.zfill(numbers.astype('S2'), 2), b'-'),
+                np.char.add(np.char.zfill(np.array(day, dtype='S2')[other], 2),
+                            np.char.add(b'T', np.array(clock, dtype='S8')[other])))
+            now = datetime.datetime.now()
+            stamps = self._syslog_times(date, now.year)
+            # more than a day in the future: the line is from last year, as in logs.py
+            future = stamps > now.timestamp() + 86400
+            if future.any():
+                stamps[future] = self._syslog_times(date[future], now.year - 1)
+            times[other] = stamps
+        return times
+
+    def _syslog_times(self, date, year: int):
+        text = np.char.add(f'{year}-'.encode(), date)
+        return text.astype('datetime64[s]').astype(np.int64) - self._local_offset
+
+    def _parse_chunk(self, camera: str, chunk: bytes):
+        lines = chunk.count(b'\n') + (0 if chunk.endswith(b'\n') else 1)
+        rows = _ACCESS_LINE.findall(chunk)
+        parsed = len(rows)
+        arrays = None
+        if rows:
+            columns = list(zip(*rows))
+            del rows
+            # the two request formats fill different groups
+            user, method, path = (np.where(np.array(long) != b'', np.array(long), np.array(short))
+                                  for long, short in zip(columns[7:10], columns[10:13]))
+            arrays = {
+                'time': self._times(columns),
+                'status': np.array(columns[13], dtype='S3').astype(np.uint16),
+                'camera': np.full(parsed, self._vocabularies['camera'].encode([camera])[0],
+                                  dtype=np.int32),
+                'client': self._vocabularies['client'].encode(columns[6]),
+                'user': self._vocabularies['user'].encode(user),
+                'method': self._vocabularies['method'].encode(method),
+                'path': self._vocabularies['path'].encode(path),
+            }
+        with self._lock:
+            if arrays is not None:
+                self._chunks.append(arrays)
+            self.lines += lines
+            self.skipped += lines - parsed
+
+    def feed(self, camera: str, body):
+        """
+        Parse a complete access log body.
+
+        Args:
+            camera: camera identifier, usually its address
+            body: log text (str or bytes)
+        """
+        if isinstance(body, str):
+            body = body.encode('utf-8', 'replace')
+        self.feed_stream(camera, [body])
+
+    def feed_stream(self, camera: str, chunks):
+        """
+        Parse an access log delivered in arbitrary chunks, e.g. ``resp.iter_content()``.
+
+        Args:
+            camera: camera identifier, usually its address
+            chunks: iterable of bytes
+        """
+        pending = bytearray()
+        for data in chunks:
+            pending += data
+            if len(pending) >= self.chunk_size:
+                end = pending.rfind(b'\n') + 1
+                if end:
+                    self._parse_chunk(camera, bytes(pending[:end]))
+                    del pending[:end]
+        if pending.strip():
+            self._parse_chunk(camera, bytes(pending))
+
+    def collect(self, cameras, workers: int = 16, timeout: float = 60.0) -> dict:
+        """
+        Download and parse the access logs of many cameras concurrently, streaming each body.
+
+        Args:
+            cameras: list of :class:`axis_vapix.Camera`
+            workers: concurrent downloads
+            timeout: timeout of every request, in seconds
+
+        Returns:
+            Dictionary camera -> None on success or the error message.
+        """
+        def collect(camera):
+            try:
+                resp = camera._session.get(camera.cam_url + _ACCESS_LOG_PATH, stream=True,
+                                           timeout=timeout)
+                with resp:
+                    if resp.status_code != 200:
+                        return f'{resp.status_code} {resp.reason}'
+                    self.feed_stream(camera.ip, resp.iter_content(1024 * 1024))
+            except requests.RequestException as err:
+                _log.warning('Could not read the access log of %s: %s', camera.ip, err)
+                return str(err)
+            return None
+
+        with ThreadPoolExecutor(workers) as executor:
+            return dict(zip(cameras, executor.map(collect, cameras)))
+
+    def result(self) -> AccessLog:
+        """
+        Returns:
+            The :class:`AccessLog` of everything fed so far, ordered by time.
+        """
+        with self._lock:
+            chunks = list(self._chunks)
+        names = ('time', 'status') + AccessLog._CATEGORIES
+        dtypes = {'time': np.float64, 'status': np.uint16}
+        columns = {name: np.concatenate([chunk[name] for chunk in chunks]) if chunks
+                   else np.empty(0, dtype=dtypes.get(name, np.int32)) for name in names}
+        order = np.argsort(columns['time'], kind='stable')
+        columns = {name: column[order] for name, column in columns.items()}
+        return AccessLog(columns.pop('time'), columns.pop('status'), columns,
+                         {name: list(self._vocabularies[name].values)
+                          for name in AccessLog._CATEGORIES})
@@ -0,0 +1,416 @@
+"""
+Bandwidth-adaptive snapshot and MJPEG quality control.
+
+A :class:`QualityController` measures the bytes per frame, the frame interval and the request
+latency of one camera, smoothed with an exponential moving average, and adjusts the
+``compression``, ``resolution`` and ``fps`` arguments that :meth:`axis_vapix.Camera.get_jpeg_request`
+and ``mjpg/video.cgi`` accept so that the stream stays inside a bandwidth budget.
+
+Oscillation is avoided three ways: a dead band around the budget, a number of samples to settle
+after every change, and an upgrade is only made when the predicted rate of the better setting,
+learned from earlier samples at that setting, still fits in the budget.
+
+A :class:`LinkBudget` splits the capacity of a link shared by several cameras between their
+controllers, handing the bandwidth that capped cameras cannot use to the others.
+"""
+import time
+import logging
+import threading
+
+import requests
+
+_log = logging.getLogger(__name__)
+
+_JPEG_PATH = '/axis-cgi/jpg/image.cgi'
+
+# relative change of the demand of a capped camera that makes its link recompute the split
+_DEMAND_CHANGE = 0.05
+
+RESOLUTIONS = ['1920x1080', '1280x720', '800x450', '640x360', '480x270', '320x180']
+
+
+def _pixels(resolution: str) -> int:
+    width, _, height = resolution.partition('x')
+    return int(width) * int(height)
+
+
+class LinkBudget:
+    """
+    Bandwidth of a link shared by several cameras.
+
+    The capacity is split by weight, max-min fair: a camera already at its best quality and using
+    less than its share keeps what it uses, and the rest is split among the other cameras.
+
+    Args:
+        total_bps: capacity of the link allotted to the cameras, in bytes per second
+    """
+
+    def __init__(self, total_bps: float):
+        self.total_bps = total_bps
+        self._controllers = []
+        self._allocations = None
+        self._lock = threading.Lock()
+
+    def register(self, controller):
+        with self._lock:
+            if controller not in self._controllers:
+                self._controllers.append(controller)
+            self._allocations = None
+
+    def unregister(self, controller):
+        with self._lock:
+            if controller in self._controllers:
+                self._controllers.remove(controller)
+            self._allocations = None
+
+    def invalidate(self):
+        """
+        Recompute the split on the next request, after the demand of a camera changed.
+        """
+        self._allocations = None
+
+    def allocations(self) -> dict:
+        """
+        Returns:
+            Dictionary controller -> allotted bytes per second.
+        """
+        with self._lock:
+            if self._allocations is None:
+                self._allocations = self._split(list(self._controllers))
+            return self._allocations
+
+    def _split(self, active: list) -> dict:
+        result = {}
+        remaining = self.total_bps
+        while active:
+            weights = sum(controller.weight for controller in active)
+            fair = {controller: remaining * controller.weight / weights for controller in active}
+            capped = [controller for controller in active
+                      if controller.at_best_quality and controller.demand_bps is not None
+                      and controller.demand_bps < fair[controller]]
+            if not capped:
+                result.update(fair)
+                break
+            for controller in capped:
+                result[controller] = controller.demand_bps
+                remaining -= controller.demand_bps
+                active.remove(controller)
+        return result
+
+    def allocation(self, controller) -> float:
+        return self.allocations().get(controller, 0.0)
+
+
+class QualityController:
+    """
+    Keeps the snapshots or the MJPEG stream of one camera inside a bandwidth budget.
+
+    Args:
+        camera: :class:`axis_vapix.Camera`
+        budget_bps: budget in bytes per second, ignored when ``link`` is given
+        link: :class:`LinkBudget` the camera shares with others
+        weight: share of the camera on the link relative to the other cameras
+        resolutions: resolutions allowed, from best to worst
+        compression: (best, worst) compression levels allowed, 0 … 100
+        fps: (lowest, highest) frame rates allowed
+        compression_step: compression change of one control step
+        max_latency: a request latency above this many seconds is treated like an over-budget
+            rate, as it means the link is queueing
+        smoothing: weight of a new sample in the moving averages, 0 … 1
+        dead_band: relative distance to the budget within which nothing is changed
+        settle: samples to wait after a change before the next one
+        timeout: timeout of the snapshot requests, in seconds
+
+    Example:
+        link = LinkBudget(total_bps=250_000)
+        controllers = [QualityController(camera, link=link) for camera in cameras]
+        for jpeg in controllers[0].frames():
+            upload(jpeg)
+    """
+
+    def __init__(self, camera, *, budget_bps: float = None, link: LinkBudget = None,
+                 weight: float = 1.0, resolutions: list = None, compression: tuple = (20, 80),
+                 fps: tuple = (1, 10), compression_step: int = 10, max_latency: float = 2.0,
+                 smoothing: float = 0.3, dead_band: float = 0.15, settle: int = 5,
+                 timeout: float = 10.0):
+        if budget_bps is None and link is None:
+            raise ValueError('either budget_bps or link must be given')
+        self.camera = camera
+        self.budget_bps = budget_bps
+        self.link = link
+        self.weight = weight
+        self.resolutions = list(resolutions or RESOLUTIONS)
+        self.min_compression, self.max_compression = compression
+        self.min_fps, self.max_fps = fps
+        self.compression_step = compression_step
+        self.max_latency = max_latency
+        self.smoothing = smoothing
+        self.dead_band = dead_band
+        self.settle = settle
+        self.timeout = timeout
+
+        # start in the middle of the ladder and let the controller find its way
+        self.resolution_index = len(self.resolutions) // 2
+        self.compression = (self.min_compression + self.max_compression) // 2
+        self.fps = self.min_fps
+
+        self.bytes_per_frame = None
+        self.interval = None
+        self.latency = None
+        self._last_sample = None
+        self._since_change = 0
+        self._learned = {}
+        self._reported = (None, False)
+        self._lock = threading.Lock()
+        self.changes = 0
+        self.errors = 0
+
+        if link is not None:
+            link.register(self)
+
+    @property
+    def resolution(self) -> str:
+        return self.resolutions[self.resolution_index]
+
+    @property
+    def budget(self) -> float:
+        """
+        Bytes per second currently allotted to the camera.
+        """
+        if self.link is not None:
+            return self.link.allocation(self)
+        return self.budget_bps
+
+    @property
+    def achieved_bps(self):
+        """
+        Measured bytes per second, None before two samples.
+        """
+        if self.bytes_per_frame is None or not self.interval:
+            return None
+        return self.bytes_per_frame / self.interval
+
+    @property
+    def demand_bps(self):
+        """
+        Bytes per second the current setting needs at the requested frame rate.
+        """
+        if self.bytes_per_frame is None:
+            return None
+        return self.bytes_per_frame * self.fps
+
+    @property
+    def at_best_quality(self) -> bool:
+        return self.fps >= self.max_fps and self.resolution_index == 0 and \
+            self.compression <= self.min_compression
+
+    def params(self) -> dict:
+        """
+        Returns:
+            Current arguments for ``jpg/image.cgi`` or ``mjpg/video.cgi``.
+        """
+        return {'resolution': self.resolution, 'compression': self.compression, 'fps': self.fps}
+
+    def stats(self) -> dict:
+        return {
+            'budget_bps': self.budget,
+            'achieved_bps': self.achieved_bps,
+            'demand_bps': self.demand_bps,
+            'latency': self.latency,
+            'changes': self.changes,
+            'errors': self.errors,
+            **self.params(),
+        }
+
+    def _average(self, old, new):
+        return new if old is None else old + self.smoothing * (new - old)
+
+    def observe(self, nbytes: int, latency: float = None, timestamp: float = None):
+        """
+        Feed the size of one received frame, and adjust the setting if needed.
+
+        Args:
+            nbytes: size of the frame
+            latency: duration of the request, for snapshots
+            timestamp: reception time, defaults to now
+        """
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        with self._lock:
+            self.bytes_per_frame = self._average(self.bytes_per_frame, nbytes)
+            if latency is not None:
+                self.latency = self._average(self.latency, latency)
+            if self._last_sample is not None and timestamp > self._last_sample:
+                self.interval = self._average(self.interval, timestamp - self._last_sample)
+            self._last_sample = timestamp
+            self._learned[(self.resolution, self.compression)] = self.bytes_per_frame
+
+            self._report()
+            self._since_change += 1
+            if self._since_change >= self.settle:
+                self._adjust()
+
+    def _report(self):
+        """
+        Tell the link when this camera leaves or enters the capped state, or its demand there
+        moved noticeably, the only changes that move the split.
+        """
+        if self.link is None:
+            return
+        demand, capped = self._reported
+        now_capped = self.at_best_quality and self.demand_bps is not None
+        if now_capped != capped or now_capped and \
+                abs(self.demand_bps - demand) > _DEMAND_CHANGE * demand:
+            self._reported = (self.demand_bps, now_capped)
+            self.link.invalidate()
+
+    def _predict(self, resolution_index: int, compression: int) -> float:
+        """
+        Bytes per frame expected at a setting: learned if it was used before, else scaled from
+        the current one by pixel count and about 20% per compression step.
+        """
+        key = (self.resolutions[resolution_index], compression)
+        if key in self._learned:
+            return self._learned[key]
+        ratio = _pixels(self.resolutions[resolution_index]) / _pixels(self.resolution)
+        steps = (self.compression - compression) / self.compression_step
+        return self.bytes_per_frame * ratio * 1.25 ** steps
+
+    def _adjust(self):
+        budget = self.budget
+        demand = self.demand_bps
+        if not budget or demand is None:
+            return
+        high = budget * (1 + self.dead_band)
+        low = budget * (1 - self.dead_band)
+        congested = self.latency is not None and self.latency > self.max_latency
+
+        if demand > high or congested:
+            changed = self._degrade()
+        elif demand < low:
+            changed = self._upgrade(low)
+        else:
+            changed = False
+
+        if changed:
+            self.changes += 1
+            self._since_change = 0
+            # the averages describe the old setting, start over from the learned value if any
+            self.bytes_per_frame = self._learned.get((self.resolution, self.compression),
+                                                     self.bytes_per_frame)
+            self._report()
+            _log.debug('%s: %s for %.0f B/s (demand %.0f B/s)',
+                       getattr(self.camera, 'ip', '?'), self.params(), budget, demand)
+
+    def _degrade(self) -> bool:
+        if self.compression < self.max_compression:
+            self.compression = min(self.max_compression, self.compression + self.compression_step)
+        elif self.resolution_index < len(self.resolutions) - 1:
+            self.resolution_index += 1
+        elif self.fps > self.min_fps:
+            self.fps = max(self.min_fps, self.fps - 1)
+        else:
+            return False
+        return True
+
+    def _upgrade(self, low: float) -> bool:
+        if self.fps < self.max_fps and \
+                self._predict(self.resolution_index, self.compression) * (self.fps + 1) < low:
+            self.fps += 1
+        elif self.resolution_index > 0 and \
+                self._predict(self.resolution_index - 1, self.compression) * self.fps < low:
+            self.resolution_index -= 1
+        elif self.compression > self.min_compression:
+            compression = max(self.min_compression, self.compression - self.compression_step)
+            if self._predict(self.resolution_index, compression) * self.fps >= low:
+                return False
+            self.compression = compression
+        else:
+            return False
+        return True
+
+    def fetch(self):
+        """
+        Request one snapshot with the current setting and account for it.
+
+        A request that fails without answer, usually a timeout on a saturated link, steps the
+        quality down.
+
+        Returns:
+            The JPEG bytes, or None if the request failed.
+        """
+        params = self.params()
+        del params['fps']
+        start = time.monotonic()
+        try:
+            resp = self.camera._session.get(self.camera.cam_url + _JPEG_PATH, params=params,
+                                            timeout=self.timeout)
+        except requests.RequestException as err:
+            _log.warning('Snapshot of %s failed: %s', self.camera.cam_url, err)
+            with self._lock:
+                self.errors += 1
+                self._last_sample = None
+                if self._degrade():
+                    self.changes += 1
+                    self._since_change = 0
+                    self._report()
+            return None
+        end = time.monotonic()
+        if resp.status_code != 200:
+            _log.error('Snapshot of %s failed: %s', self.camera.cam_url, resp.status_code)
+            return None
+        self.observe(len(resp.content), end - start, end)
+        return resp.content
+
+    def frames(self, count: int = None):
+        """
+        Fetch snapshots paced at the current frame rate.
+
+        Args:
+            count: number of snapshots, None for endless
+
+        Returns:
+            Iterator of JPEG bytes.
+        """
+        fetched = 0
+        while count is None or fetched < count:
+            start = time.monotonic()
+            data = self.fetch()
+            if data is not None:
+                yield data
+            fetched += 1
+            delay = 1.0 / self.fps - (time.monotonic() - start)
+            if delay > 0:
+                time.sleep(delay)
+
+    def control(self, restreamer, stop: threading.Event = None):
+        """
+        Adjust a :class:`axis_vapix.MjpegRestreamer` of the camera from the frames it receives,
+        reopening its upstream connection whenever the setting changes. Blocks until ``stop`` is
+        set or the restreamer is stopped, run it in a thread.
+
+        Args:
+            restreamer: restreamer of the camera
+            stop: event ending the control loop
+        """
+        restreamer.update_params(**self.params())
+        with restreamer.subscribe(maxsize=1) as subscription:
+            while stop is None or not stop.is_set():
+                frame = subscription.get(timeout=1.0)
+                if frame is None:
+                    if subscription.closed:
+                        return
+                    continue
+                before = self.params()
+                self.observe(len(frame.data))
+                after = self.params()
+                if after != before:
+                    # the frame interval of the old setting is meaningless for the new one
+                    self._last_sample = None
+                    restreamer.update_params(**after)
+
+    def close(self):
+        """
+        Leave the shared link.
+        """
+        if self.link is not None:
+            self.link.unregister(self)
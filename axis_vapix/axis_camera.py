@@ -5,10 +5,13 @@ import logging
 
 import urllib3
 import urllib.parse
-import requests
-from requests.auth import HTTPDigestAuth
 from bs4 import BeautifulSoup
 
+from .cache import CapabilityCache
+from . import transport
+from . import backup as _backup
+from .ptzstate import suppressed_response
+
 # pylint: disable=R0904
 # pylint: disable=R0914
 
@@ -18,12 +21,46 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 # Logger
 _log = logging.getLogger(__name__)
 
+# Parameter groups that identify a device, served from the capability cache
+_IDENTITY_GROUPS = ('Brand.ProdFullName', 'Brand.ProdType', 'Properties.System.SerialNumber',
+                    'Properties.Firmware.Version')
+
 class Camera:
-    def __init__(self, ip, user, password):
+    def __init__(self, ip, user, password, *, cache=None, scheme='http', port=None,
+                 base_path='', verify=False, fingerprint=None, timeout=30.0, ptz_state=None):
         self.__cam_ip = ip
         self.__cam_user = user
         self.__cam_password = password
-        self.cam_url = 'http://' + self.__cam_ip
+        # Every request starts with this base URL, see transport.base_url
+        self.cam_url = transport.base_url(scheme, ip, port, base_path)
+
+        # Keep one authenticated session per camera so the TCP connection, the digest nonce and,
+        # over HTTPS, the TLS session are reused between commands instead of renegotiated on
+        # every request. verify takes False, True or a CA bundle path; fingerprint pins the
+        # SHA-256 fingerprint of the camera certificate.
+        self._session = transport.make_session(self.__cam_user, self.__cam_password,
+                                               verify=verify, fingerprint=fingerprint)
+        # Seconds to wait for the camera to connect and for each read, so that a dead camera
+        # fails a command quickly instead of hanging; None waits forever
+        self.timeout = timeout
+        # Optional PTZState: PTZ commands that would not change anything are not sent
+        self.ptz_state = ptz_state
+
+        # Identity and capabilities, loaded from the capability cache (a CapabilityCache or the
+        # path of its file) and revalidated in the background
+        if isinstance(cache, str):
+            cache = CapabilityCache.open(cache)
+        self._cache = cache
+        self._capabilities = {}
+        if cache is not None:
+            self._capabilities = cache.attach(self)
+
+    @property
+    def ip(self):
+        """
+        Address of the camera, as given to the constructor.
+        """
+        return self.__cam_ip
 
     def get_info(self):
         text = 'Camera Info:\n'
@@ -64,6 +101,49 @@ class Camera:
             result.update(dictionary)
         return result
 
+    def _remember(self, name: str, value):
+        """
+        Keep a capability of the device in the capability cache, if the camera has one. Without
+        a cache every request goes to the camera, as before.
+
+        Args:
+            name: capability name
+            value: capability value
+
+        Returns:
+            The value
+        """
+        if self._cache is not None:
+            self._cache.store(self, name, value)
+        return value
+
+    def _forget(self, updates: dict):
+        """
+        Drop the cached answers a parameter update may change: the image sizes, and the cached
+        parameter groups overlapping the updated parameters.
+
+        Args:
+            updates: parameters updated, with or without the root. prefix
+        """
+        names = [name.replace('root.', '', 1) for name in updates if name != 'action']
+        stale = [key for key in self._capabilities if key.startswith('image_size') or
+                 key.startswith('param.') and any(name.startswith(key[6:]) or
+                                                  key[6:].startswith(name) for name in names)]
+        if stale and self._cache is not None:
+            self._cache.forget(self, stale)
+
+    def discover(self):
+        """
+        Request the identity and capabilities kept by the capability cache: product name and
+        type, serial number, firmware version, PTZ commands, image size and number of channels.
+        """
+        for group in _IDENTITY_GROUPS:
+            self.get_parameters(group)
+        self.get_camera_info()
+        self.info_ptz_comands()
+        self.get_image_size()
+        self.get_channels()
+
     def _command(self, url: str, payload: dict = None):
         """
         Function used to send commands to the camera
@@ -75,8 +155,11 @@ class Camera:
             Returns the response from the device to the command sent
 
         """
-        resp = requests.get(url, auth=HTTPDigestAuth(self.__cam_user, self.__cam_password),
-                            params=payload, verify=False)
+        resp = self._session.get(url, params=payload, timeout=self.timeout)
+
+        if resp.status_code == 200 and payload and payload.get('action') == 'update' and \
+                '/param.cgi' in url:
+            self._forget(payload)
 
         if (resp.status_code != 200) and (resp.status_code != 204):
             soup = BeautifulSoup(resp.text, features="lxml")
@@ -98,22 +181,27 @@ class Camera:
             dict: parameters
 
         """
-        url = 'http://' + self.__cam_ip + '/axis-cgi/param.cgi?action=list'
-        if group is not None:
-            url += '&group=' + group
+        text = self._capabilities.get('param.' + group) if group in _IDENTITY_GROUPS else None
+        if text is None:
+            url = self.cam_url + '/axis-cgi/param.cgi?action=list'
+            if group is not None:
+                url += '&group=' + group
 
-        resp = self._command(url)
+            resp = self._command(url)
 
-        if resp.status_code == 200:
-            if only_value:
-                try:
-                    return resp.text.split('=')[1].replace('\r', '')
-                except IndexError:
-                    return resp.text
-            else:
-                return resp.text
+            if resp.status_code != 200:
+                return str(resp) + str(resp.text)
+            text = resp.text
+            if group in _IDENTITY_GROUPS:
+                self._remember('param.' + group, text)
+
+        if only_value:
+            try:
+                return text.split('=')[1].replace('\r', '')
+            except IndexError:
+                return text
         else:
-            return str(resp) + str(resp.text)
+            return text
 
     def get_camera_info(self):
         """
@@ -123,15 +211,46 @@ class Camera:
             return type camera, Network camera or ptz camera
 
         """
-        url = 'http://' + self.__cam_ip + '/axis-cgi/param.cgi?action=list&group=Brand.ProdType'
+        if 'prod_type' in self._capabilities:
+            return self._capabilities['prod_type']
+
+        url = self.cam_url + '/axis-cgi/param.cgi?action=list&group=Brand.ProdType'
         resp = self._command(url)
 
         if resp.status_code == 200:
             vector = resp.text.split('=')
-            return vector[1].replace('\r', '')
+            return self._remember('prod_type', vector[1].replace('\r', ''))
         else:
             return str(resp) + str(resp.text)
 
+    def backup(self, path: str = None, *, timeout: float = 30.0):  # 0
+        """
+        Capture the parameter tree, users (without passwords), stream profiles and PTZ presets.
+
+        Args:
+            path: file to write the backup to, None only returns it
+            timeout: timeout of every request, in seconds
+
+        Returns:
+            The backup document.
+
+        """
+        return _backup.backup(self, path, timeout=timeout)
+
+    def restore(self, backup, **options):  # 0
+        """
+        Restore a backup with as few batched param.cgi updates as possible.
+
+        Args:
+            backup: backup document or path of a backup file
+            **options: include_network, passwords, batch, dry_run, move_timeout, timeout
+
+        Returns:
+            RestoreReport with changed, unchanged, failed and skipped parameters.
+
+        """
+        return _backup.restore(self, backup, **options)
+
     def factory_reset_default(self):  # 5.1.3
         """
         Reload factory default. All parameters except Network.BootProto, Network.IPAddress,
@@ -142,7 +261,7 @@ class Camera:
             Success (OK) or Failure (Settings or syntax are probably incorrect).
 
         """
-        url = 'http://' + self.__cam_ip + '/axis-cgi/factorydefault.cgi'
+        url = self.cam_url + '/axis-cgi/factorydefault.cgi'
         resp = self._command(url)
 
         if resp.status_code == 200:
@@ -158,7 +277,7 @@ class Camera:
             Success (OK) or Failure (error and description).
 
         """
-        url = 'http://' + self.__cam_ip + '/axis-cgi/hardfactorydefault.cgi'
+        url = self.cam_url + '/axis-cgi/hardfactorydefault.cgi'
         resp = self._command(url)
 
         if resp.status_code == 200:
@@ -174,7 +293,7 @@ class Camera:
             Success (OK) or Failure (error and description).
 
         """
-        url = 'http://' + self.__cam_ip + '/axis-cgi/restart.cgi'
+        url = self.cam_url + '/axis-cgi/restart.cgi'
         resp = self._command(url)
 
         if resp.status_code == 200:
@@ -192,7 +311,7 @@ class Camera:
             Success (OK and server report content text) or Failure (error and description).
 
         """
-        url = 'http://' + self.__cam_ip + '/axis-cgi/serverreport.cgi'
+        url = self.cam_url + '/axis-cgi/serverreport.cgi'
         resp = self._command(url)
 
         if resp.status_code == 200:
@@ -209,7 +328,7 @@ class Camera:
             Success (OK and system log content text) or Failure (error and description).
 
         """
-        url = 'http://' + self.__cam_ip + '/axis-cgi/systemlog.cgi'
+        url = self.cam_url + '/axis-cgi/systemlog.cgi'
         resp = self._command(url)
 
         if resp.status_code == 200:
@@ -226,7 +345,7 @@ class Camera:
             Success (OK and access log content text) or Failure (error and description).
 
         """
-        url = 'http://' + self.__cam_ip + '/axis-cgi/accesslog.cgi'
+        url = self.cam_url + '/axis-cgi/accesslog.cgi'
         resp = self._command(url)
 
         if resp.status_code == 200:
@@ -244,7 +363,7 @@ class Camera:
                 Error example: Request failed: <error message>
 
         """
-        url = 'http://' + self.__cam_ip + '/axis-cgi/date.cgi?action=get'
+        url = self.cam_url + '/axis-cgi/date.cgi?action=get'
         resp = self._command(url)
 
         if resp.status_code == 200:
@@ -273,7 +392,7 @@ class Camera:
             'day': day_date
         }
 
-        url = 'http://' + self.__cam_ip + '/axis-cgi/date.cgi'
+        url = self.cam_url + '/axis-cgi/date.cgi'
         resp = self._command(url, payload)
 
         if resp.status_code == 200:
@@ -306,7 +425,7 @@ class Camera:
             'timezone': timezone
         }
 
-        url = 'http://' + self.__cam_ip + '/axis-cgi/date.cgi'
+        url = self.cam_url + '/axis-cgi/date.cgi'
         resp = self._command(url, payload)
 
         if resp.status_code == 200:
@@ -314,26 +433,56 @@ class Camera:
         else:
             return str(resp) + str(resp.text)
 
-    def get_image_size(self):  # 5.2.1
+    def get_image_size(self, camera: int = 1):  # 5.2.1
         """
         Retrieve the actual image size with default image settings or with given parameters.
 
+        Args:
+            camera: video channel, for video encoders. (default: 1)
+
         Returns:
             Success (OK and image size content text) or Failure (Error and description).
                 example:
                     image width = <value>
                     image height = <value>
         """
-        url = 'http://' + self.__cam_ip + '/axis-cgi/imagesize.cgi?camera=1'
-        resp = self._command(url)
+        name = 'image_size' if camera == 1 else f'image_size.{camera}'
+        if name in self._capabilities:
+            return self._capabilities[name]
+
+        url = self.cam_url + '/axis-cgi/imagesize.cgi'
+        resp = self._command(url, {'camera': camera})
 
         if resp.status_code == 200:
             # vector = resp.text.split()
             # print(vector[3], 'x', vector[7])
-            return resp.text
+            return self._remember(name, resp.text)
         else:
             return str(resp) + str(resp.text)
 
+    def get_channels(self):  # 0
+        """
+        Number of video channels: the video inputs of a video encoder, 1 for a camera. Requested
+        once, then kept by the capability cache.
+
+        Returns:
+            Number of channels, numbered from 1 in the camera argument of the requests.
+        """
+        if 'channels' in self._capabilities:
+            return self._capabilities['channels']
+
+        url = self.cam_url + '/axis-cgi/param.cgi?action=list&group=ImageSource.NbrOfSources'
+        resp = self._command(url)
+
+        if resp.status_code != 200:
+            return 1
+        try:
+            channels = int(resp.text.split('=')[1])
+        except (IndexError, ValueError):
+            # no such parameter, a single source
+            channels = 1
+        return self._remember('channels', max(1, channels))
+
     def get_video_status(self, camera_status: int = None):  # 5.2.2
         """
         Video encoders only. Check the status of one or more video sources.
@@ -349,7 +498,7 @@ class Camera:
         payload = {
             'status': camera_status
         }
-        url = 'http://' + self.__cam_ip + '/axis-cgi/videostatus.cgi?'
+        url = self.cam_url + '/axis-cgi/videostatus.cgi?'
         resp = self._command(url, payload)
 
         if resp.status_code == 200:
@@ -378,7 +527,7 @@ class Camera:
             'camera': camera,
             'square_pixel': square_pixel
         }
-        url = 'http://' + self.__cam_ip + '/axis-cgi/bitmap/image.bmp'
+        url = self.cam_url + '/axis-cgi/bitmap/image.bmp'
         resp = self._command(url, payload)
 
         if resp.status_code == 200:
@@ -395,7 +544,7 @@ class Camera:
                          text_string: str = None, text_color: str = None,
                          text_background_color: str = None, rotation: int = None,
                          text_position: str = None, overlay_image: int = None,
-                         overlay_position: str = None):  # 5.2.4.1
+                         overlay_position: str = None, *, gate=None):  # 5.2.4.1
         """
         The requests specified in the JPEG/MJPG section are supported by those video products
         that use JPEG and MJPG encoding.
@@ -417,10 +566,12 @@ class Camera:
             overlay_image: Enable/disable overlay image.(0 = disable, 1 = enable)
             overlay_position:The x and y coordinates defining the position of the overlay image.
             (<int>x<int>)
+            gate: optional ChangeGate, the image is not saved when it did not change enough since
+            the last saved one.
 
         Returns:
-            Success ('image save' and save the image in the file folder) or Failure (Error and
-            description).
+            Success ('image save' and save the image in the file folder, or 'Image unchanged' when
+            dropped by the gate) or Failure (Error and description).
 
         """
         payload = {
@@ -439,10 +590,12 @@ class Camera:
             'overlay_image': overlay_image,
             'overlay_position': overlay_position
         }
-        url = 'http://' + self.__cam_ip + '/axis-cgi/jpg/image.cgi'
+        url = self.cam_url + '/axis-cgi/jpg/image.cgi'
         resp = self._command(url, payload)
 
         if resp.status_code == 200:
+            if gate is not None and not gate.accept(self.__cam_ip, resp.content):
+                return str('Image unchanged')
             now = datetime.datetime.now()
             with open(str(now.strftime("%d-%m-%Y_%Hh%Mm%Ss")) + ".jpg", 'wb') as var:
                 var.write(resp.content)
@@ -458,7 +611,7 @@ class Camera:
             Success (dynamic text overlay) or Failure (Error and description).
 
         """
-        url = 'http://' + self.__cam_ip + '/axis-cgi/dynamicoverlay.cgi?action=gettext'
+        url = self.cam_url + '/axis-cgi/dynamicoverlay.cgi?action=gettext'
         resp = self._command(url)
 
         if resp.status_code == 200:
@@ -484,7 +637,7 @@ class Camera:
             'camera': camera
         }
 
-        url = 'http://' + self.__cam_ip + '/axis-cgi/dynamicoverlay.cgi'
+        url = self.cam_url + '/axis-cgi/dynamicoverlay.cgi'
         resp = self._command(url, payload)
 
         if resp.status_code == 200:
@@ -509,7 +662,7 @@ class Camera:
             'group': 'root.StreamProfile'
         }
 
-        url = 'http://' + self.__cam_ip + '/axis-cgi/param.cgi'
+        url = self.cam_url + '/axis-cgi/param.cgi'
         resp = self._command(url, payload)
 
         text2 = resp.text.split('\n')
@@ -569,7 +722,7 @@ class Camera:
             'StreamProfile.S.Parameters': text_params
         }
 
-        url = 'http://' + self.__cam_ip + '/axis-cgi/param.cgi'
+        url = self.cam_url + '/axis-cgi/param.cgi'
         resp = self._command(url, payload)
 
         soup = BeautifulSoup(resp.text, features="lxml")
@@ -613,7 +766,7 @@ class Camera:
             'comment': comment
         }
 
-        url = 'http://' + self.__cam_ip + '/axis-cgi/pwdgrp.cgi'
+        url = self.cam_url + '/axis-cgi/pwdgrp.cgi'
         resp = self._command(url, payload)
 
         soup = BeautifulSoup(resp.text, features="lxml")
@@ -656,7 +809,7 @@ class Camera:
             'sgrp': sgroup,
             'comment': comment
         }
-        url = 'http://' + self.__cam_ip + '/axis-cgi/pwdgrp.cgi'
+        url = self.cam_url + '/axis-cgi/pwdgrp.cgi'
         resp = self._command(url, payload)
 
         soup = BeautifulSoup(resp.text, features="lxml")
@@ -682,7 +835,7 @@ class Camera:
             'user': user
         }
 
-        url = 'http://' + self.__cam_ip + '/axis-cgi/pwdgrp.cgi'
+        url = self.cam_url + '/axis-cgi/pwdgrp.cgi'
         resp = self._command(url, payload)
 
         soup = BeautifulSoup(resp.text, features="lxml")
@@ -703,7 +856,7 @@ class Camera:
         payload = {
             'action': 'get'
         }
-        url = 'http://' + self.__cam_ip + '/axis-cgi/pwdgrp.cgi'
+        url = self.cam_url + '/axis-cgi/pwdgrp.cgi'
         resp = self._command(url, payload)
 
         if resp.status_code == 200:
@@ -739,7 +892,7 @@ class Camera:
             'Network.VolatileHostName.ObtainFromDHCP': set_dhcp
         }
 
-        url = 'http://' + self.__cam_ip + '/axis-cgi/param.cgi'
+        url = self.cam_url + '/axis-cgi/param.cgi'
         resp = self._command(url, payload)
 
         if resp.status_code == 200:
@@ -766,7 +919,7 @@ class Camera:
             'ImageSource.I0.Sensor.StabilizerMargin': stabilizer_margin  # 0 a 200
         }
 
-        url = 'http://' + self.__cam_ip + '/axis-cgi/param.cgi'
+        url = self.cam_url + '/axis-cgi/param.cgi'
         resp = self._command(url, payload)
 
         if resp.status_code == 200:
@@ -790,7 +943,7 @@ class Camera:
             'action': 'update',
             'ImageSource.I0.Sensor': capture_mode
         }
-        url = 'http://' + self.__cam_ip + '/axis-cgi/param.cgi'
+        url = self.cam_url + '/axis-cgi/param.cgi'
         resp = self._command(url, payload)
 
         if resp.status_code == 200:
@@ -817,7 +970,7 @@ class Camera:
             'ImageSource.I0.Sensor.LocalContrast': contrast
         }
 
-        url = 'http://' + self.__cam_ip + '/axis-cgi/param.cgi'
+        url = self.cam_url + '/axis-cgi/param.cgi'
         resp = self._command(url, payload)
 
         if resp.status_code == 200:
@@ -849,7 +1002,7 @@ class Camera:
             'ImageSource.I0.Sensor.Contrast': contrast
         }
 
-        url = 'http://' + self.__cam_ip + '/axis-cgi/param.cgi'
+        url = self.cam_url + '/axis-cgi/param.cgi'
         resp = self._command(url, payload)
 
         if resp.status_code == 200:
@@ -878,8 +1031,8 @@ class Camera:
             'ImageSource.I0.DayNight.ShiftLevel': shift_level
         }
 
-        url = 'http://' + self.__cam_ip + '/axis-cgi/param.cgi'
-        resp = requests.get(url, auth=HTTPDigestAuth(self.__cam_user, self.__cam_password), params=payload)
+        url = self.cam_url + '/axis-cgi/param.cgi'
+        resp = self._command(url, payload)
 
         if resp.status_code == 200:
             return resp.text
@@ -922,7 +1075,7 @@ class Camera:
             'ImageSource.I0.Sensor.ExposureValue': exposure_value  # nivel de exposição
         }
 
-        url = 'http://' + self.__cam_ip + '/axis-cgi/param.cgi'
+        url = self.cam_url + '/axis-cgi/param.cgi'
         resp = self._command(url, payload)
 
         if resp.status_code == 200:
@@ -954,7 +1107,7 @@ class Camera:
             'ImageSource.I0.Sensor.CustomExposureWindow.C0.Right': right
         }
 
-        url = 'http://' + self.__cam_ip + '/axis-cgi/param.cgi'
+        url = self.cam_url + '/axis-cgi/param.cgi'
         resp = self._command(url, payload)
 
         if resp.status_code == 200:
@@ -980,7 +1133,7 @@ class Camera:
 
         }
 
-        url = 'http://' + self.__cam_ip + '/axis-cgi/param.cgi'
+        url = self.cam_url + '/axis-cgi/param.cgi'
         resp = self._command(url, payload)
 
         if resp.status_code == 200:
@@ -1007,7 +1160,7 @@ class Camera:
 
         }
 
-        url = 'http://' + self.__cam_ip + '/axis-cgi/param.cgi'
+        url = self.cam_url + '/axis-cgi/param.cgi'
         resp = self._command(url, payload)
 
         if resp.status_code == 200:
@@ -1039,7 +1192,7 @@ class Camera:
             'PTZ.UserAdv.U1.ImageFreeze': image_freeze_ptz
         }
 
-        url = 'http://' + self.__cam_ip + '/axis-cgi/param.cgi'
+        url = self.cam_url + '/axis-cgi/param.cgi'
         resp = self._command(url, payload)
 
         if resp.status_code == 200:
@@ -1062,7 +1215,7 @@ class Camera:
             'Time.NTP.Server': ntp_server,
         }
 
-        url = 'http://' + self.__cam_ip + '/axis-cgi/param.cgi'
+        url = self.cam_url + '/axis-cgi/param.cgi'
         resp = self._command(url, payload)
 
         if resp.status_code == 200:
@@ -1090,7 +1243,7 @@ class Camera:
             'PTZ.Various.V1.TiltEnabled': tilt_enable,
             'PTZ.Various.V1.ZoomEnabled': zoom_enable
         }
-        url = 'http://' + self.__cam_ip + '/axis-cgi/param.cgi'
+        url = self.cam_url + '/axis-cgi/param.cgi'
         resp = self._command(url, payload)
 
         if resp.status_code == 200:
@@ -1109,12 +1262,7 @@ class Camera:
             Success (OK) or Failure (Error and description).
 
         """
-        payload = {
-            'autofocus': focus
-        }
-
-        url = 'http://' + self.__cam_ip + '/axis-cgi/com/ptz.cgi'
-        resp = self._command(url, payload)
+        resp = self._ptz_command({'autofocus': focus})
 
         if resp.status_code == 200:
             return resp.text
@@ -1132,12 +1280,7 @@ class Camera:
             Success (OK) or Failure (Error and description).
 
         """
-        payload = {
-            'autoiris': iris
-        }
-
-        url = 'http://' + self.__cam_ip + '/axis-cgi/com/ptz.cgi'
-        resp = self._command(url, payload)
+        resp = self._ptz_command({'autoiris': iris})
 
         if resp.status_code == 200:
             return resp.text
@@ -1145,11 +1288,12 @@ class Camera:
             return str(resp) + str(resp.text)
 
     # CAMERA CONTROL #
-    def _ptz_command(self, payload: dict):
+    def _ptz_command(self, payload: dict, camera: int = 1):
         """
         Function used to send ptz commands to the camera
         Args:
             payload: argument dictionary for camera control
+            camera: video channel the PTZ head is connected to, for video encoders
 
         Returns:
             Returns the response from the device to the command sent
@@ -1158,15 +1302,22 @@ class Camera:
         logging.info('camera_command(%s)', payload)
 
         base_q_args = {
-            'camera': 1,
+            'camera': camera,
             'html': 'no',
             'timestamp': int(time.time())
         }
 
-        merged_args = self.__merge_dicts(payload, base_q_args)
-        url = 'http://' + self.__cam_ip + '/axis-cgi/com/ptz.cgi'
+        url = self.cam_url + '/axis-cgi/com/ptz.cgi'
+        if self.ptz_state is not None:
+            payload = self.ptz_state.filter(payload, camera)
+            if payload is None:
+                return suppressed_response(url)
 
-        return self._command(url, merged_args)
+        merged_args = self.__merge_dicts(payload, base_q_args)
+        resp = self._command(url, merged_args)
+        if self.ptz_state is not None and resp.status_code in (200, 204):
+            self.ptz_state.sent_command(payload, camera)
+        return resp
 
     def absolute_move(self, pan: float = None, tilt: float = None, zoom: int = None,
                       speed: int = None):
@@ -1292,16 +1443,19 @@ class Camera:
         """
         return self._ptz_command({'move': 'home', 'speed': speed})
 
-    def get_status(self):
+    def get_status(self, camera: int = 1):
         """
         Operation to request camera status.
 
+        Args:
+            camera: video channel, for video encoders. (default: 1)
+
         Returns:
             Returns a tuple with the current camera values (pan, tilt, zoom, iris, focus, brightness, ...),
             whatever is available.
 
         """
-        resp = self._ptz_command({'query': 'position'})
+        resp = self._ptz_command({'query': 'position'}, camera)
         if resp.status_code == 200:
             # create a dictionary with the camera values
             cam_values = {}
@@ -1310,6 +1464,8 @@ class Camera:
                     key = line.split('=')[0]
                     value = line.split('=')[1]
                     cam_values[key] = value
+            if self.ptz_state is not None:
+                self.ptz_state.update(cam_values, camera)
         else:
             _log.error('Error getting camera status: %s', resp.status_code)
             cam_values = None
@@ -1439,31 +1595,38 @@ class Camera:
 
         return presets
 
-    def set_speed(self, speed: int = None):
+    def set_speed(self, speed: int = None, camera: int = 1):
         """
         Sets the head speed of the device that is connected to the specified camera.
         Args:
             speed: speed value.
+            camera: video channel, for video encoders. (default: 1)
 
         Returns:
             Returns the response from the device to the command sent.
 
         """
-        return self._ptz_command({'speed': speed})
+        return self._ptz_command({'speed': speed}, camera)
 
-    def get_speed(self):
+    def get_speed(self, camera: int = 1):
         """
         Requests the camera's speed of movement.
 
+        Args:
+            camera: video channel, for video encoders. (default: 1)
+
         Returns:
             Returns the camera's move value.
 
         """
-        resp = self._ptz_command({'query': 'speed'})
+        resp = self._ptz_command({'query': 'speed'}, camera)
         # check if the response is OK and does not contain an Error
         if resp.status_code == 200 and 'Error' not in resp.text:
             # return the speed value
-            return int(resp.text.split()[0].split('=')[1])
+            speed = int(resp.text.split()[0].split('=')[1])
+            if self.ptz_state is not None:
+                self.ptz_state.update({'speed': speed}, camera)
+            return speed
         else:
             _log.error('Error getting camera speed: Status Code: %s, Response: %s', resp.status_code, resp.text)
             return None
@@ -1476,26 +1639,10 @@ class Camera:
             Success (OK and system log content text) or Failure (error and description).
 
         """
+        if 'ptz_info' in self._capabilities:
+            return self._capabilities['ptz_info']
+
         resp = self._ptz_command({'info': '1'})
+        if resp.status_code == 200:
+            return self._remember('ptz_info', resp.text)
         return resp.text
-
-
-if __name__ == '__main__':
-    ip = '10.0.220.152'
-    usr = 'root'
-    pwd = 'fruitsalad5671'
-
-    # create camera object
-    cam = Camera(ip, usr, pwd)
-
-    # get camera info
-    print(cam.get_info())
-
-    # get camera available camera commands
-    print(cam.info_ptz_comands())
-
-    while True:
-        print(f'Pan: {cam.get_ptz()[0]}, Tilt: {cam.get_ptz()[1]}, Zoom: {cam.get_ptz()[2]}, Focus: {cam.get_focus()}')
-        time.sleep(.1)
-
-    # cam.continuous_move(zoom=100)
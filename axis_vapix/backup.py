@@ -0,0 +1,412 @@
+"""
+Configuration backup and batched restore.
+
+A backup is one gzip compressed JSON document holding the whole parameter tree of a camera, its
+users with their roles (never passwords, which cannot be read anyway), its stream profiles and its
+PTZ presets, with a format version so that later versions can still read old files.
+
+A restore reads the current tree once and sends only the parameters that differ, many per
+``param.cgi`` update. Stream profiles and users are restored by name through
+:class:`axis_vapix.ProfileManager` and :class:`axis_vapix.UserProvisioner`; presets missing on the
+camera are created again by moving to their stored position and saving it. Parameters of other
+groups the camera no longer has cannot be created by an update and are reported as skipped.
+"""
+import os
+import gzip
+import json
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional
+
+import requests
+
+from .profiles import ProfileCatalog, ProfileManager, StreamProfile
+from .users import UserTable, UserProvisioner, UserSpec
+
+_log = logging.getLogger(__name__)
+
+FORMAT = 'axis-vapix-backup'
+FORMAT_VERSION = 1
+
+_PARAM_PATH = '/axis-cgi/param.cgi'
+# never written back: identity, read-only properties, and groups restored by name instead
+_READ_ONLY = ('Brand.', 'Properties.', 'StreamProfile.', 'PTZ.Preset.')
+_NETWORK = ('Network.',)
+
+
+def _strip_root(name: str) -> str:
+    return name[5:] if name.startswith('root.') else name
+
+
+def parse_parameters(text: str) -> dict:
+    """
+    Parse the answer of ``param.cgi?action=list`` into a dictionary name -> value, with the
+    ``root.`` prefix removed.
+    """
+    parameters = {}
+    for line in text.splitlines():
+        name, sep, value = line.partition('=')
+        if sep and not name.startswith('#'):
+            parameters[_strip_root(name.strip())] = value.rstrip('\r')
+    return parameters
+
+
+def _presets(parameters: dict) -> list:
+    """
+    Presets from ``PTZ.Preset.P<n>.Position.P<m>.Name`` and ``.Data`` parameters, where the data
+    reads like ``pan=10.5:tilt=-3.0:zoom=1``.
+    """
+    groups = {}
+    for name, value in parameters.items():
+        parts = name.split('.')
+        if len(parts) == 6 and parts[:2] == ['PTZ', 'Preset'] and parts[3] == 'Position':
+            groups.setdefault('.'.join(parts[:5]), {})[parts[5]] = value
+    presets = []
+    for group, values in sorted(groups.items()):
+        if not values.get('Name'):
+            continue
+        position = {}
+        for item in values.get('Data', '').split(':'):
+            key, _, value = item.partition('=')
+            try:
+                position[key] = float(value)
+            except ValueError:
+                continue
+        presets.append({'group': group, 'name': values['Name'], 'data': values.get('Data', ''),
+                        'position': position})
+    return presets
+
+
+def save_backup(snapshot: dict, path: str):
+    """
+    Write a backup atomically.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = path + '.tmp'
+    with gzip.open(tmp, 'wt', encoding='utf-8') as var:
+        json.dump(snapshot, var, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
+def load_backup(path: str) -> dict:
+    """
+    Read a backup, checking its format and version.
+    """
+    with gzip.open(path, 'rt', encoding='utf-8') as var:
+        snapshot = json.load(var)
+    if snapshot.get('format') != FORMAT:
+        raise ValueError(f'{path} is not a camera backup')
+    if snapshot.get('version', 0) > FORMAT_VERSION:
+        raise ValueError(f'{path} has format version {snapshot["version"]}, this version reads '
+                         f'up to {FORMAT_VERSION}')
+    return snapshot
+
+
+def _list_parameters(camera, timeout: float) -> dict:
+    resp = camera._session.get(camera.cam_url + _PARAM_PATH, params={'action': 'list'},
+                               timeout=timeout)
+    if resp.status_code != 200:
+        raise requests.HTTPError(f'{resp.status_code} {resp.reason}', response=resp)
+    return parse_parameters(resp.text)
+
+
+def backup(camera, path: str = None, *, timeout: float = 30.0) -> dict:
+    """
+    Capture the configuration of a camera.
+
+    Args:
+        camera: :class:`axis_vapix.Camera`
+        path: file to write the backup to, None only returns it
+        timeout: timeout of every request, in seconds
+
+    Returns:
+        The backup document.
+    """
+    parameters = _list_parameters(camera, timeout)
+    table = UserTable.fetch(camera, timeout)
+    catalog = ProfileCatalog.fetch(camera, timeout)
+    snapshot = {
+        'format': FORMAT,
+        'version': FORMAT_VERSION,
+        'created': time.time(),
+        'camera': camera.ip,
+        'identity': {key: parameters.get(name) for key, name in (
+            ('model', 'Brand.ProdFullName'), ('serial', 'Properties.System.SerialNumber'),
+            ('firmware', 'Properties.Firmware.Version'))},
+        'parameters': parameters,
+        'users': {name: table.role(name) for name in sorted(table.users)
+                  if table.role(name) is not None},
+        'profiles': [{'name': profile.name, 'description': profile.description,
+                      'parameters': profile.parameters} for profile in catalog],
+        'presets': _presets(parameters),
+    }
+    if path is not None:
+        save_backup(snapshot, path)
+    return snapshot
+
+
+class RestoreReport(NamedTuple):
+    """
+    Result of restoring one camera. ``failed`` lists (parameter, message), ``skipped`` the
+    parameters, users and presets that could not be restored.
+    """
+    camera: str
+    changed: int
+    unchanged: int
+    failed: list
+    skipped: list
+    profiles: object
+    users: object
+    presets: list
+    requests: int
+    duration: float
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and not self.failed
+
+
+class _Restore:
+    """
+    State of one restore, counting requests.
+    """
+
+    def __init__(self, camera, snapshot: dict, timeout: float, batch: int, dry_run: bool):
+        self.camera = camera
+        self.snapshot = snapshot
+        self.timeout = timeout
+        self.batch = batch
+        self.dry_run = dry_run
+        self.requests = 0
+        self.failed = []
+        self.skipped = []
+
+    def _update(self, updates: dict) -> Optional[str]:
+        self.requests += 1
+        resp = self.camera._session.post(self.camera.cam_url + _PARAM_PATH,
+                                         data={'action': 'update', **updates},
+                                         timeout=self.timeout)
+        if resp.status_code != 200:
+            return f'{resp.status_code} {resp.reason}'
+        self.camera._forget(updates)
+        if 'error' in resp.text.lower():
+            return resp.text.strip()
+        return None
+
+    def update(self, updates: dict):
+        """
+        Send updates in batches; a rejected batch is retried one parameter at a time so that
+        one bad value does not cost the others.
+        """
+        if self.dry_run:
+            return
+        names = list(updates)
+        for start in range(0, len(names), self.batch):
+            chunk = {'root.' + name: updates[name] for name in names[start:start + self.batch]}
+            error = self._update(chunk)
+            if error is None:
+                continue
+            if len(chunk) == 1:
+                self.failed.append((names[start], error))
+                continue
+            for name, value in chunk.items():
+                error = self._update({name: value})
+                if error is not None:
+                    self.failed.append((_strip_root(name), error))
+
+    def presets(self, current: dict, move_timeout: float) -> tuple:
+        """
+        Returns:
+            Updates for the presets that exist with another position, and the names of the
+            presets created again.
+        """
+        existing = {preset['name']: preset for preset in _presets(current)}
+        updates, created = {}, []
+        for preset in self.snapshot.get('presets', []):
+            have = existing.get(preset['name'])
+            if have is not None:
+                if have['data'] != preset['data']:
+                    updates[have['group'] + '.Data'] = preset['data']
+                continue
+            position = preset['position']
+            if not {'pan', 'tilt'} <= set(position):
+                self.skipped.append('preset:' + preset['name'])
+                continue
+            created.append(preset['name'])
+            if self.dry_run:
+                continue
+            self.requests += 1
+            self.camera.absolute_move(position['pan'], position['tilt'], position.get('zoom'))
+            deadline = time.monotonic() + move_timeout
+            while time.monotonic() < deadline:
+                self.requests += 1
+                pan, tilt, _ = self.camera.get_ptz()
+                try:
+                    if abs(float(pan) - position['pan']) < 0.5 and \
+                            abs(float(tilt) - position['tilt']) < 0.5:
+                        break
+                except (TypeError, ValueError):
+                    break
+                time.sleep(0.2)
+            self.requests += 1
+            self.camera._ptz_command({'setserverpresetname': preset['name']})
+        return updates, created
+
+
+def restore(camera, snapshot, *, include_network: bool = False, passwords: dict = None,
+            batch: int = 100, dry_run: bool = False, move_timeout: float = 15.0,
+            timeout: float = 30.0) -> RestoreReport:
+    """
+    Bring a camera back to a backup with as few requests as possible.
+
+    Args:
+        camera: :class:`axis_vapix.Camera`
+        snapshot: backup document or path of a backup file
+        include_network: also restore the ``Network`` group, which may change the address of the
+            camera
+        passwords: dictionary user -> password for the users the camera no longer has, which
+            cannot be created without one
+        batch: parameters per ``param.cgi`` update
+        dry_run: only count what would change
+        move_timeout: longest wait for the camera to reach a preset being created, in seconds
+        timeout: timeout of every request, in seconds
+
+    Returns:
+        :class:`RestoreReport`
+    """
+    start = time.monotonic()
+    if isinstance(snapshot, str):
+        snapshot = load_backup(snapshot)
+    excluded = _READ_ONLY if include_network else _READ_ONLY + _NETWORK
+    state = _Restore(camera, snapshot, timeout, batch, dry_run)
+    try:
+        current = _list_parameters(camera, timeout)
+        state.requests += 1
+        updates, unchanged = {}, 0
+        for name, value in snapshot['parameters'].items():
+            if name.startswith(excluded):
+                continue
+            if name not in current:
+                state.skipped.append(name)
+            elif current[name] != value:
+                updates[name] = value
+            else:
+                unchanged += 1
+
+        preset_updates, presets = state.presets(current, move_timeout)
+        updates.update(preset_updates)
+        state.update(updates)
+
+        profiles = ProfileManager(
+            [StreamProfile(item['name'], item['parameters'], item.get('description', ''))
+             for item in snapshot.get('profiles', [])], timeout=timeout
+        ).apply(camera, dry_run=dry_run)
+
+        passwords = passwords or {}
+        table = UserTable.fetch(camera, timeout)
+        specs = []
+        for name, role in snapshot.get('users', {}).items():
+            if name in table or name in passwords:
+                specs.append(UserSpec(name, role, passwords.get(name)))
+            else:
+                state.skipped.append('user:' + name)
+        users = UserProvisioner(specs, timeout=timeout).apply(camera, dry_run=dry_run,
+                                                              table=table)
+    except requests.RequestException as err:
+        _log.warning('Could not restore %s: %s', camera.ip, err)
+        return RestoreReport(camera.ip, 0, 0, state.failed, state.skipped, None, None, [],
+                             state.requests, time.monotonic() - start, str(err))
+
+    return RestoreReport(camera.ip, len(updates) - len(state.failed), unchanged, state.failed,
+                         state.skipped, profiles, users, presets, state.requests,
+                         time.monotonic() - start)
+
+
+class BackupReport(NamedTuple):
+    """
+    Result of backing up one camera.
+    """
+    camera: str
+    path: Optional[str]
+    parameters: int
+    size: int
+    duration: float
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class FleetBackup:
+    """
+    Backs up and restores many cameras concurrently, one file per camera in a directory.
+
+    Args:
+        directory: folder of the backup files, named after the camera addresses
+        workers: cameras handled at the same time
+        timeout: timeout of every request, in seconds
+
+    Example:
+        fleet = FleetBackup('/srv/backups/2024-03-01', workers=32)
+        fleet.backup(cameras, progress=print)
+        ...
+        fleet.restore(cameras, passwords={'vms': vms_password}, progress=print)
+    """
+
+    def __init__(self, directory: str, *, workers: int = 16, timeout: float = 30.0):
+        self.directory = directory
+        self.workers = workers
+        self.timeout = timeout
+
+    def path(self, camera) -> str:
+        return os.path.join(self.directory, camera.ip.replace(':', '_') + '.json.gz')
+
+    def _backup(self, camera) -> BackupReport:
+        start = time.monotonic()
+        path = self.path(camera)
+        try:
+            snapshot = backup(camera, path, timeout=self.timeout)
+        except (requests.RequestException, OSError) as err:
+            _log.warning('Could not back up %s: %s', camera.ip, err)
+            return BackupReport(camera.ip, None, 0, 0, time.monotonic() - start, str(err))
+        return BackupReport(camera.ip, path, len(snapshot['parameters']), os.path.getsize(path),
+                            time.monotonic() - start)
+
+    def _map(self, function, cameras, progress) -> dict:
+        def run(camera):
+            report = function(camera)
+            if progress is not None:
+                progress(report)
+            return report
+
+        with ThreadPoolExecutor(self.workers) as executor:
+            return {report.camera: report for report in executor.map(run, cameras)}
+
+    def backup(self, cameras, *, progress=None) -> dict:
+        """
+        Returns:
+            Dictionary camera address -> :class:`BackupReport`.
+        """
+        return self._map(self._backup, cameras, progress)
+
+    def restore(self, cameras, *, progress=None, **options) -> dict:
+        """
+        Restore every camera from its own file. ``options`` are passed to :func:`restore`,
+        ``timeout`` defaults to the one of the fleet.
+
+        Returns:
+            Dictionary camera address -> :class:`RestoreReport`.
+        """
+        options.setdefault('timeout', self.timeout)
+
+        def run(camera):
+            try:
+                snapshot = load_backup(self.path(camera))
+            except (OSError, ValueError) as err:
+                return RestoreReport(camera.ip, 0, 0, [], [], None, None, [], 0, 0.0, str(err))
+            return restore(camera, snapshot, **options)
+
+        return self._map(run, cameras, progress)
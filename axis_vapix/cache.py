@@ -0,0 +1,204 @@
+"""
+Persistent cache of camera identity and capabilities for fast fleet startup.
+
+The answers of the discovery requests (product type and name, serial, firmware, PTZ command
+description, image size) are stored per device, keyed by serial number and firmware version, in a
+single gzip compressed JSON file. A :class:`axis_vapix.Camera` created with the cache serves those
+requests from it at once and revalidates in the background with one ``param.cgi`` request reading
+serial and firmware. Only a replaced or upgraded device is discovered again.
+"""
+import os
+import json
+import gzip
+import time
+import atexit
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+_log = logging.getLogger(__name__)
+
+_FORMAT_VERSION = 1
+_SERIAL = 'Properties.System.SerialNumber'
+_FIRMWARE = 'Properties.Firmware.Version'
+
+
+class CapabilityCache:
+    """
+    Capability cache shared by many cameras.
+
+    Use :meth:`open` to get the instance of a file, so that all cameras of a process share it.
+    Changes are written back by :meth:`save`, which also runs at interpreter exit.
+
+    Args:
+        path: cache file
+        workers: concurrent background revalidation requests
+        timeout: timeout of the revalidation requests, in seconds
+
+    Example:
+        cache = CapabilityCache.open('/var/cache/axis/capabilities.json.gz')
+        cameras = [Camera(ip, user, password, cache=cache) for ip in ips]
+        cache.wait()   # optional, block until every camera was revalidated
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, path: str, *, workers: int = 16, timeout: float = 5.0):
+        self.path = path
+        self.timeout = timeout
+        self._entries = {}
+        self._hosts = {}
+        self._lock = threading.RLock()
+        self._dirty = False
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='capability-cache')
+        self._pending = []
+        self.load()
+        atexit.register(self.save)
+
+    @classmethod
+    def open(cls, path: str, **kwargs):
+        """
+        Returns:
+            The cache instance of ``path``, created on first use.
+        """
+        path = os.path.abspath(path)
+        with cls._instances_lock:
+            if path not in cls._instances:
+                cls._instances[path] = cls(path, **kwargs)
+            return cls._instances[path]
+
+    def load(self):
+        """
+        Read the cache file. A missing or unreadable file gives an empty cache.
+        """
+        try:
+            with gzip.open(self.path, 'rt', encoding='utf-8') as var:
+                content = json.load(var)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as err:
+            _log.warning('Ignoring unreadable capability cache %s: %s', self.path, err)
+            return
+        if content.get('version') != _FORMAT_VERSION:
+            _log.info('Ignoring capability cache %s of another format version', self.path)
+            return
+        with self._lock:
+            self._entries = content.get('entries', {})
+            self._hosts = content.get('hosts', {})
+
+    def save(self):
+        """
+        Write the cache file if anything changed, atomically.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            content = {'version': _FORMAT_VERSION, 'entries': self._entries, 'hosts': self._hosts}
+            tmp = self.path + '.tmp'
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with gzip.open(tmp, 'wt', encoding='utf-8') as var:
+                json.dump(content, var, separators=(',', ':'))
+            os.replace(tmp, self.path)
+            self._dirty = False
+
+    def __len__(self):
+        return len(self._entries)
+
+    def attach(self, camera, revalidate: bool = True) -> dict:
+        """
+        Give a camera its cached capabilities. Called by :class:`axis_vapix.Camera`.
+
+        Args:
+            camera: camera being constructed
+            revalidate: check serial and firmware of the device in the background
+
+        Returns:
+            The capabilities of the camera, the camera fills it as it learns more.
+        """
+        with self._lock:
+            key = self._hosts.get(camera.ip)
+            capabilities = self._entries.get(key) if key else None
+            if capabilities is None:
+                capabilities = {}
+        if revalidate:
+            with self._lock:
+                # keep only the revalidations still running, for wait()
+                self._pending = [future for future in self._pending if not future.done()]
+                self._pending.append(self._executor.submit(self._revalidate, camera))
+        return capabilities
+
+    def store(self, camera, name: str, value):
+        """
+        Record one capability learned by a camera.
+        """
+        with self._lock:
+            camera._capabilities[name] = value
+            key = self._hosts.get(camera.ip)
+            if key is not None and self._entries.get(key) is camera._capabilities:
+                self._dirty = True
+
+    def forget(self, camera, names):
+        """
+        Drop capabilities of a camera that a change on the device made stale.
+        """
+        with self._lock:
+            for name in names:
+                camera._capabilities.pop(name, None)
+            key = self._hosts.get(camera.ip)
+            if key is not None and self._entries.get(key) is camera._capabilities:
+                self._dirty = True
+
+    def _revalidate(self, camera):
+        try:
+            resp = camera._session.get(camera.cam_url + '/axis-cgi/param.cgi',
+                                       params={'action': 'list', 'group': f'{_SERIAL},{_FIRMWARE}'},
+                                       timeout=self.timeout)
+        except requests.RequestException as err:
+            _log.warning('Could not revalidate %s, keeping cached capabilities: %s', camera.ip, err)
+            return False
+        if resp.status_code != 200:
+            _log.warning('Could not revalidate %s: %s', camera.ip, resp.status_code)
+            return False
+
+        values = {}
+        for line in resp.text.splitlines():
+            name, _, value = line.partition('=')
+            values[name.replace('root.', '', 1)] = value.strip()
+        serial, firmware = values.get(_SERIAL), values.get(_FIRMWARE)
+        if not serial or not firmware:
+            _log.warning('No serial or firmware in the answer of %s', camera.ip)
+            return False
+
+        key = f'{serial}/{firmware}'
+        with self._lock:
+            capabilities = self._entries.get(key)
+            known = capabilities is not None
+            if not known:
+                # new device, moved device keeps its entry, replaced or upgraded starts over
+                capabilities = self._entries[key] = {}
+                if camera.ip not in self._hosts:
+                    # what the camera learned before this answer is about this very device
+                    capabilities.update(camera._capabilities)
+            if self._hosts.get(camera.ip) != key:
+                self._hosts[camera.ip] = key
+                self._dirty = True
+            capabilities['validated'] = time.time()
+            camera._capabilities = capabilities
+
+        if not known:
+            _log.info('Discovering capabilities of %s (%s)', camera.ip, key)
+            camera.discover()
+        return True
+
+    def wait(self):
+        """
+        Block until the background revalidations started so far are done, then save.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for future in pending:
+            future.exception()
+        self.save()
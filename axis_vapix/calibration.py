@@ -0,0 +1,303 @@
+"""
+Pixel to pan/tilt calibration of PTZ cameras.
+
+``center_move`` and ``area_zoom`` leave the geometry to the camera, one request per point, and
+tell nothing in advance. :class:`PTZCalibration` models the field of view of a camera as a
+function of zoom, so that pixel coordinates convert to absolute pan and tilt locally, for many
+points at once, and a tracker can aim with a single ``absolute_move``.
+
+The model is fitted once per camera by :meth:`PTZCalibration.calibrate`: at zoom levels across the
+zoom range the camera is asked to center a known pixel with ``center_move``, and the pan and tilt
+read back with ``get_status`` before and after give the angle of that pixel. With a pinhole
+camera the tangent of the half field of view follows. Zoom levels are sampled evenly on a
+logarithmic scale, and between them the logarithm of the tangent is interpolated linearly over
+the logarithm of the zoom position, which follows the optics closely. The model is kept in the capability cache of the camera, so
+it survives restarts and is fitted again only for another device or firmware.
+
+Conversions use the full pan/tilt geometry, not a flat approximation, so they stay right near
+the horizon and looking steeply down alike.
+
+Requires ``numpy`` (``pip install axis_vapix[analytics]``).
+"""
+import re
+import time
+import logging
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+_log = logging.getLogger(__name__)
+
+_CAPABILITY = 'ptz_calibration'
+_IMAGE_SIZE = re.compile(r'image\s+(width|height)\s*=\s*(\d+)')
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError('PTZ calibration requires numpy, '
+                          'install it with "pip install axis_vapix[analytics]"')
+
+
+def _axes(pan, tilt):
+    """
+    Forward, right and down unit vectors of a camera looking at pan/tilt, in degrees. World
+    coordinates: x to the right of pan 0, y down, z forward at pan 0 and tilt 0.
+    """
+    pan, tilt = np.radians(pan), np.radians(tilt)
+    forward = np.stack([np.cos(tilt) * np.sin(pan), -np.sin(tilt), np.cos(tilt) * np.cos(pan)])
+    right = np.stack([np.cos(pan), np.zeros_like(pan), -np.sin(pan)])
+    down = np.stack([np.sin(tilt) * np.sin(pan), np.cos(tilt), np.sin(tilt) * np.cos(pan)])
+    return forward, right, down
+
+
+def _angles(direction):
+    x, y, z = direction
+    pan = np.degrees(np.arctan2(x, z))
+    tilt = np.degrees(np.arctan2(-y, np.hypot(x, z)))
+    return pan, tilt
+
+
+class PTZCalibration:
+    """
+    Field of view of a PTZ camera as a function of zoom, and the conversions it allows.
+
+    Args:
+        zooms: sampled zoom positions, in the zoom units of ``get_status``
+        tan_h: tangent of the half horizontal field of view at each zoom
+        tan_v: tangent of the half vertical field of view at each zoom
+        image_size: (width, height) of the image the pixel coordinates refer to
+
+    Example:
+        calibration = PTZCalibration.for_camera(camera)
+        pan, tilt = calibration.pixel_to_ptz(xs, ys, pan=10.0, tilt=-20.0, zoom=2500)
+        camera.absolute_move(pan[0], tilt[0])
+    """
+
+    def __init__(self, zooms, tan_h, tan_v, image_size):
+        _require_numpy()
+        order = np.argsort(np.asarray(zooms, dtype=np.float64))
+        self.zooms = np.asarray(zooms, dtype=np.float64)[order]
+        self.tan_h = np.asarray(tan_h, dtype=np.float64)[order]
+        self.tan_v = np.asarray(tan_v, dtype=np.float64)[order]
+        self.image_size = (int(image_size[0]), int(image_size[1]))
+
+    def tangents(self, zoom):
+        """
+        Tangents of the half horizontal and vertical field of view at zoom positions.
+        """
+        zoom = np.log(np.maximum(np.asarray(zoom, dtype=np.float64), 1))
+        zooms = np.log(np.maximum(self.zooms, 1))
+        return (np.exp(np.interp(zoom, zooms, np.log(self.tan_h))),
+                np.exp(np.interp(zoom, zooms, np.log(self.tan_v))))
+
+    def fov(self, zoom):
+        """
+        Horizontal and vertical field of view at zoom positions, in degrees.
+        """
+        tan_h, tan_v = self.tangents(zoom)
+        return np.degrees(2 * np.arctan(tan_h)), np.degrees(2 * np.arctan(tan_v))
+
+    def zoom_for_fov(self, hfov):
+        """
+        Zoom position giving a horizontal field of view, in degrees, clipped to the sampled range.
+        """
+        tan_h = np.log(np.tan(np.radians(np.asarray(hfov, dtype=np.float64)) / 2))
+        # the field of view narrows as the zoom grows, np.interp needs rising x values
+        return np.exp(np.interp(tan_h, np.log(self.tan_h)[::-1],
+                                np.log(np.maximum(self.zooms, 1))[::-1]))
+
+    def _normalized(self, x, y, size):
+        width, height = size or self.image_size
+        return ((np.asarray(x, dtype=np.float64) - width / 2) / (width / 2),
+                (np.asarray(y, dtype=np.float64) - height / 2) / (height / 2))
+
+    def pixel_to_ptz(self, x, y, pan: float, tilt: float, zoom: float, size=None):
+        """
+        Absolute pan and tilt that center pixels of the current image.
+
+        Args:
+            x: pixel column, number or array
+            y: pixel row, number or array
+            pan: pan of the camera when the image was taken, in degrees
+            tilt: tilt of the camera when the image was taken, in degrees
+            zoom: zoom of the camera when the image was taken
+            size: (width, height) of the image, when other than the calibrated one
+
+        Returns:
+            Arrays of pan in [-180, 180) and tilt, in degrees.
+        """
+        u, v = self._normalized(x, y, size)
+        tan_h, tan_v = self.tangents(zoom)
+        forward, right, down = _axes(np.float64(pan), np.float64(tilt))
+        direction = (forward[:, None] + right[:, None] * (u * tan_h).ravel() +
+                     down[:, None] * (v * tan_v).ravel())
+        pans, tilts = _angles(direction)
+        pans = (pans + 180) % 360 - 180
+        return pans.reshape(u.shape), tilts.reshape(u.shape)
+
+    def ptz_to_pixel(self, pan, tilt, camera_pan: float, camera_tilt: float, zoom: float,
+                     size=None):
+        """
+        Pixels at which directions appear in the image of a camera, the inverse of
+        :meth:`pixel_to_ptz`. Directions behind the camera give NaN.
+
+        Args:
+            pan: pan of the directions, number or array, in degrees
+            tilt: tilt of the directions, number or array, in degrees
+            camera_pan: pan of the camera, in degrees
+            camera_tilt: tilt of the camera, in degrees
+            zoom: zoom of the camera
+            size: (width, height) of the image, when other than the calibrated one
+
+        Returns:
+            Arrays of pixel column and row.
+        """
+        width, height = size or self.image_size
+        pan, tilt = np.broadcast_arrays(np.asarray(pan, dtype=np.float64),
+                                        np.asarray(tilt, dtype=np.float64))
+        direction = _axes(pan.ravel(), tilt.ravel())[0]
+        forward, right, down = _axes(np.float64(camera_pan), np.float64(camera_tilt))
+        depth = forward @ direction
+        depth = np.where(depth > 1e-9, depth, np.nan)
+        tan_h, tan_v = self.tangents(zoom)
+        u = (right @ direction) / depth / tan_h
+        v = (down @ direction) / depth / tan_v
+        return ((u * width / 2 + width / 2).reshape(pan.shape),
+                (v * height / 2 + height / 2).reshape(pan.shape))
+
+    def to_dict(self) -> dict:
+        return {'zooms': self.zooms.tolist(), 'tan_h': self.tan_h.tolist(),
+                'tan_v': self.tan_v.tolist(), 'image_size': list(self.image_size)}
+
+    @classmethod
+    def from_dict(cls, content: dict):
+        return cls(content['zooms'], content['tan_h'], content['tan_v'], content['image_size'])
+
+    @classmethod
+    def fit(cls, samples, image_size):
+        """
+        Fit the model to center_move observations.
+
+        Args:
+            samples: iterable of (zoom, x, y, pan0, tilt0, pan1, tilt1): the camera at pan0/tilt0
+                and zoom centered pixel x/y and arrived at pan1/tilt1
+            image_size: (width, height) of the image of the pixel coordinates
+
+        Returns:
+            :class:`PTZCalibration` with one point per distinct zoom, estimates averaged.
+        """
+        _require_numpy()
+        samples = np.asarray(list(samples), dtype=np.float64)
+        if samples.size == 0:
+            raise ValueError('no calibration samples')
+        zoom, x, y, pan0, tilt0, pan1, tilt1 = samples.T
+        width, height = image_size
+        u, v = (x - width / 2) / (width / 2), (y - height / 2) / (height / 2)
+        forward, right, down = _axes(pan0, tilt0)
+        direction = _axes(pan1, tilt1)[0]
+        depth = np.sum(forward * direction, axis=0)
+        tan_h = np.sum(right * direction, axis=0) / depth / u
+        tan_v = np.sum(down * direction, axis=0) / depth / v
+
+        zooms = np.unique(zoom)
+        fitted_h, fitted_v = [], []
+        for level in zooms:
+            chosen = zoom == level
+            fitted_h.append(np.median(tan_h[chosen]))
+            fitted_v.append(np.median(tan_v[chosen]))
+        return cls(zooms, fitted_h, fitted_v, image_size)
+
+    @classmethod
+    def calibrate(cls, camera, *, levels: int = 8, zoom_range=(1, 9999), offset: float = 0.5,
+                  tilt: float = -20.0, settle_timeout: float = 15.0, poll: float = 0.2):
+        """
+        Fit the model of a camera by moving it. The camera returns to its position afterwards.
+
+        Args:
+            camera: :class:`axis_vapix.Camera` with PTZ
+            levels: zoom positions sampled across ``zoom_range``
+            zoom_range: lowest and highest zoom position of the camera
+            offset: distance of the centered pixels from the image center, as a fraction of half
+                the image; larger is more precise until the move hits the tilt limits
+            tilt: tilt to calibrate at, away from the limits where center_move is cut short
+            settle_timeout: longest wait for a move to end, in seconds
+            poll: interval of the position readings while waiting, in seconds
+
+        Returns:
+            :class:`PTZCalibration`
+        """
+        _require_numpy()
+        values = dict(_IMAGE_SIZE.findall(camera.get_image_size()))
+        if 'width' not in values or 'height' not in values:
+            raise RuntimeError(f'no image size from {camera.ip}')
+        width, height = int(values['width']), int(values['height'])
+        start = _position(camera)
+        if start is None:
+            raise RuntimeError(f'no PTZ position from {camera.ip}')
+
+        samples = []
+        try:
+            for level in np.unique(np.geomspace(zoom_range[0], zoom_range[1], levels).round()):
+                camera.absolute_move(start[0], tilt, int(level))
+                before = _settle(camera, settle_timeout, poll, start)
+                # to one side and back, two estimates per zoom level
+                for sign in (1, -1):
+                    x = round(width / 2 + sign * offset * width / 2)
+                    y = round(height / 2 + sign * offset * height / 2)
+                    camera.center_move(x, y)
+                    after = _settle(camera, settle_timeout, poll, before)
+                    if before is None or after is None:
+                        break
+                    if abs(after[0] - before[0]) > 1e-3 and abs(after[1] - before[1]) > 1e-3:
+                        samples.append((before[2], x, y, before[0], before[1], after[0], after[1]))
+                    before = after
+        finally:
+            camera.absolute_move(*start[:3])
+
+        if not samples:
+            raise RuntimeError(f'{camera.ip} did not move for the calibration')
+        calibration = cls.fit(samples, (width, height))
+        _log.info('Calibrated %s: field of view %.1f to %.1f degrees', camera.ip,
+                  *calibration.fov(calibration.zooms[[0, -1]])[0])
+        return calibration
+
+    @classmethod
+    def for_camera(cls, camera, refit: bool = False, **options):
+        """
+        The calibration of a camera from its capability cache, fitted with :meth:`calibrate` and
+        stored there when missing. A camera without capability cache is calibrated on every call.
+        """
+        content = camera._capabilities.get(_CAPABILITY)
+        if content is not None and not refit:
+            return cls.from_dict(content)
+        calibration = cls.calibrate(camera, **options)
+        camera._remember(_CAPABILITY, calibration.to_dict())
+        return calibration
+
+
+def _position(camera):
+    status = camera.get_status()
+    try:
+        return float(status['pan']), float(status['tilt']), float(status['zoom'])
+    except (TypeError, KeyError, ValueError):
+        return None
+
+
+def _settle(camera, timeout: float, poll: float, origin=None, start_delay: float = 1.0):
+    """
+    Wait until two position readings in a row are equal, and return the position. Readings
+    still at ``origin`` only count after ``start_delay``, the camera may not have started yet.
+    """
+    begin = time.monotonic()
+    last = _position(camera)
+    while time.monotonic() - begin < timeout:
+        time.sleep(poll)
+        position = _position(camera)
+        if position is not None and position == last and \
+                (position != origin or time.monotonic() - begin > start_delay):
+            return position
+        last = position
+    _log.warning('%s did not settle within %.1f s', camera.ip, timeout)
+    return last
@@ -0,0 +1,334 @@
+"""
+Synchronized snapshot capture across several cameras.
+
+Each camera gets a dedicated worker thread that keeps an authenticated keep-alive connection
+warm. On capture every worker prepares its ``jpg/image.cgi`` request up front, waits on a common
+barrier and sends at the same instant, so the spread between cameras is bounded by thread
+wake-up jitter rather than by the latency of the previous camera.
+"""
+import os
+import time
+import queue
+import logging
+import datetime
+import threading
+from concurrent.futures import Future, wait
+from typing import NamedTuple, Optional
+
+import requests
+
+_log = logging.getLogger(__name__)
+
+_JPEG_PATH = '/axis-cgi/jpg/image.cgi'
+_WARM_UP_PATH = '/axis-cgi/param.cgi?action=list&group=Brand.ProdType'
+
+
+class CapturedFrame(NamedTuple):
+    """
+    One still captured by :class:`SyncCapture`.
+
+    ``sent`` and ``received`` are wall clock timestamps (seconds since the epoch) taken right
+    before the request was handed to the socket and right after the body was fully read.
+    """
+    camera: object
+    status_code: Optional[int]
+    content: bytes
+    sent: Optional[float]
+    received: Optional[float]
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.status_code == 200
+
+    @property
+    def latency(self) -> Optional[float]:
+        if self.sent is None or self.received is None:
+            return None
+        return self.received - self.sent
+
+
+class CaptureSet:
+    """
+    Result of one synchronized capture.
+
+    Args:
+        frames: captured frames, in the order of the cameras given to :class:`SyncCapture`
+        timestamp: wall clock time at which the requests were released
+    """
+
+    def __init__(self, frames: list, timestamp: float):
+        self.frames = frames
+        self.timestamp = timestamp
+
+    def __iter__(self):
+        return iter(self.frames)
+
+    def __len__(self):
+        return len(self.frames)
+
+    @property
+    def succeeded(self) -> list:
+        return [frame for frame in self.frames if frame.ok]
+
+    @property
+    def failed(self) -> list:
+        return [frame for frame in self.frames if not frame.ok]
+
+    @property
+    def send_skew(self) -> Optional[float]:
+        """
+        Seconds between the first and the last request sent, over the successful frames.
+        """
+        sent = [frame.sent for frame in self.succeeded]
+        return max(sent) - min(sent) if sent else None
+
+    @property
+    def receive_skew(self) -> Optional[float]:
+        """
+        Seconds between the first and the last response received, over the successful frames.
+        """
+        received = [frame.received for frame in self.succeeded]
+        return max(received) - min(received) if received else None
+
+    @property
+    def window(self) -> Optional[tuple]:
+        """
+        (first send, last receive) of the successful frames. The true exposure of every frame lies
+        inside this interval.
+        """
+        frames = self.succeeded
+        if not frames:
+            return None
+        return min(frame.sent for frame in frames), max(frame.received for frame in frames)
+
+    def summary(self) -> dict:
+        """
+        Returns:
+            Capture statistics of the set as a dictionary.
+        """
+        latencies = [frame.latency for frame in self.succeeded]
+        window = self.window
+        return {
+            'cameras': len(self.frames),
+            'succeeded': len(latencies),
+            'failed': len(self.frames) - len(latencies),
+            'send_skew': self.send_skew,
+            'receive_skew': self.receive_skew,
+            'window': None if window is None else window[1] - window[0],
+            'min_latency': min(latencies) if latencies else None,
+            'max_latency': max(latencies) if latencies else None,
+        }
+
+    def save(self, directory: str = '.') -> list:
+        """
+        Write the successful frames to ``directory``. File names carry the capture timestamp of
+        the set and the camera address, so frames of one set never overwrite each other.
+
+        Args:
+            directory: destination folder, created if missing
+
+        Returns:
+            List of written file paths.
+        """
+        os.makedirs(directory, exist_ok=True)
+        stamp = datetime.datetime.fromtimestamp(self.timestamp).strftime('%d-%m-%Y_%Hh%Mm%S.%fs')
+        paths = []
+        for index, frame in enumerate(self.frames):
+            if not frame.ok:
+                continue
+            name = str(getattr(frame.camera, 'ip', index)).replace(':', '_')
+            path = os.path.join(directory, f'{stamp}_{name}.jpg')
+            with open(path, 'wb') as var:
+                var.write(frame.content)
+            paths.append(path)
+        return paths
+
+
+class _Clock:
+    """
+    Shared release time of one capture, set by the barrier action.
+    """
+
+    def __init__(self, guard: float):
+        self.guard = guard
+        self.fire_at = None
+
+    def release(self):
+        self.fire_at = time.perf_counter() + self.guard
+
+
+class _CaptureWorker(threading.Thread):
+    """
+    Thread owning the connection to one camera. The digest nonce negotiated by
+    ``HTTPDigestAuth`` is thread local, so warming up and capturing must happen on the same
+    thread for the capture request to go out pre-authenticated.
+    """
+
+    def __init__(self, camera, timeout: float, idle_timeout: float):
+        super().__init__(daemon=True, name=f'capture-{getattr(camera, "ip", "?")}')
+        self.camera = camera
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self._jobs = queue.Queue()
+        self._last_used = None
+
+    def run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            func, args, future = job
+            try:
+                future.set_result(func(*args))
+            except Exception as err:  # pylint: disable=W0703
+                future.set_exception(err)
+
+    def submit(self, func, *args) -> Future:
+        future = Future()
+        self._jobs.put((func, args, future))
+        return future
+
+    def stop(self):
+        self._jobs.put(None)
+
+    def warm_up(self) -> bool:
+        resp = self.camera._session.get(self.camera.cam_url + _WARM_UP_PATH, timeout=self.timeout)
+        if resp.status_code != 200:
+            raise requests.HTTPError(f'warm-up returned {resp.status_code}', response=resp)
+        self._last_used = time.perf_counter()
+        return True
+
+    def fire(self, params: dict, barrier: threading.Barrier, clock: _Clock, anchor: tuple):
+        session = self.camera._session
+        error = None
+        prepared = None
+        try:
+            if self._last_used is None or time.perf_counter() - self._last_used > self.idle_timeout:
+                self.warm_up()
+            prepared = session.prepare_request(
+                requests.Request('GET', self.camera.cam_url + _JPEG_PATH, params=params))
+        except Exception as err:  # pylint: disable=W0703
+            error = f'warm-up failed: {err}'
+
+        # Every worker has to reach the barrier, even a failed one, or the others would wait for
+        # the full timeout.
+        try:
+            barrier.wait()
+        except threading.BrokenBarrierError:
+            error = error or 'capture aborted: not all cameras were ready in time'
+        if error is not None:
+            return CapturedFrame(self.camera, None, b'', None, None, error)
+
+        # sleep rather than spin: spinning threads would fight over the GIL and delay each other
+        remaining = clock.fire_at - time.perf_counter()
+        if remaining > 0:
+            time.sleep(remaining)
+
+        wall0, perf0 = anchor
+        sent = time.perf_counter()
+        try:
+            resp = session.send(prepared, timeout=self.timeout)
+        except requests.RequestException as err:
+            self._last_used = None
+            return CapturedFrame(self.camera, None, b'', wall0 + sent - perf0, None, str(err))
+        received = time.perf_counter()
+        self._last_used = received
+
+        error = None if resp.status_code == 200 else resp.text
+        return CapturedFrame(self.camera, resp.status_code, resp.content,
+                             wall0 + sent - perf0, wall0 + received - perf0, error)
+
+
+class SyncCapture:
+    """
+    Near-simultaneous JPEG capture from several cameras.
+
+    Args:
+        cameras: list of :class:`axis_vapix.Camera`
+        timeout: timeout of every HTTP request, in seconds
+        idle_timeout: connections idle for longer than this are warmed up again before the
+            capture, since cameras drop idle keep-alive connections
+        guard: delay between the last worker becoming ready and the release of all requests,
+            it gives every worker thread time to be scheduled before the send instant
+
+    Example:
+        with SyncCapture(cameras) as sync:
+            sync.warm_up()
+            frames = sync.capture(resolution='1280x720', compression=30)
+            print(frames.summary())
+    """
+
+    def __init__(self, cameras, *, timeout: float = 5.0, idle_timeout: float = 10.0,
+                 guard: float = 0.005):
+        self.cameras = list(cameras)
+        self.timeout = timeout
+        self.guard = guard
+        self._workers = [_CaptureWorker(camera, timeout, idle_timeout) for camera in self.cameras]
+        for worker in self._workers:
+            worker.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+        Stop the worker threads.
+        """
+        for worker in self._workers:
+            worker.stop()
+
+    def warm_up(self) -> dict:
+        """
+        Open and authenticate the connection to every camera.
+
+        Returns:
+            Dictionary camera -> None if the camera is ready, else the error message.
+        """
+        futures = [worker.submit(worker.warm_up) for worker in self._workers]
+        wait(futures)
+        result = {}
+        for camera, future in zip(self.cameras, futures):
+            err = future.exception()
+            if err is not None:
+                _log.warning('Warm-up of %s failed: %s', camera.cam_url, err)
+            result[camera] = None if err is None else str(err)
+        return result
+
+    def capture(self, **params) -> CaptureSet:
+        """
+        Capture one JPEG from every camera at the same instant.
+
+        Args:
+            **params: arguments of ``jpg/image.cgi``, same names as in
+                :meth:`axis_vapix.Camera.get_jpeg_request` (resolution, compression, camera ...)
+
+        Returns:
+            A :class:`CaptureSet` with the frames in memory and their send/receive timestamps.
+        """
+        params = {key: value for (key, value) in params.items() if value is not None}
+        clock = _Clock(self.guard)
+        # workers that need a warm-up spend up to one timeout before reaching the barrier
+        barrier = threading.Barrier(len(self._workers), action=clock.release,
+                                    timeout=self.timeout * 2)
+        anchor = (time.time(), time.perf_counter())
+
+        futures = [worker.submit(worker.fire, params, barrier, clock, anchor)
+                   for worker in self._workers]
+        wait(futures)
+
+        frames = []
+        for camera, future in zip(self.cameras, futures):
+            err = future.exception()
+            if err is not None:
+                frames.append(CapturedFrame(camera, None, b'', None, None, str(err)))
+            else:
+                frames.append(future.result())
+
+        timestamp = anchor[0] + (clock.fire_at - anchor[1]) if clock.fire_at else anchor[0]
+        result = CaptureSet(frames, timestamp)
+        _log.info('Synchronized capture: %s', result.summary())
+        return result
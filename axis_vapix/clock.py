@@ -0,0 +1,271 @@
+"""
+Fleet clock-drift measurement and round-trip compensated time setting.
+
+``date.cgi`` answers with whole seconds, so one reading only places the camera clock within a
+second plus the request round trip. :class:`ClockSync` reads the clock several times and, like
+NTP, bounds the offset with every sample: a reading of ``S`` seconds taken between sending at
+``t0`` and receiving at ``t1`` means the offset lies between ``S - t1`` and ``S + 1 - t0``. The
+intersection of these bounds narrows the offset to a fraction of a second, the more so the
+shorter and the more varied the round trips.
+
+Correcting a clock sends the new time so that it arrives exactly on a second boundary, half the
+shortest measured round trip after sending, which is the best a second-resolution interface
+allows.
+"""
+import time
+import math
+import logging
+import calendar
+import datetime
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional
+
+import requests
+
+_log = logging.getLogger(__name__)
+
+_DATE_PATH = '/axis-cgi/date.cgi'
+_DATE_FORMAT = '%b %d, %Y %H:%M:%S'
+
+
+class ClockSample(NamedTuple):
+    """
+    One reading of a camera clock, all times in seconds since the epoch.
+    """
+    sent: float
+    received: float
+    reading: float
+
+    @property
+    def rtt(self) -> float:
+        return self.received - self.sent
+
+    @property
+    def bounds(self) -> tuple:
+        return self.reading - self.received, self.reading + 1 - self.sent
+
+
+class ClockEstimate(NamedTuple):
+    """
+    Estimated clock offset of one camera: camera clock minus local clock, in seconds. Positive
+    means the camera runs ahead. ``error`` is set and the numbers are None when the camera could
+    not be read.
+    """
+    camera: str
+    offset: Optional[float]
+    uncertainty: Optional[float]
+    rtt: Optional[float]
+    samples: int
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def _local_utc_offset() -> float:
+    return datetime.datetime.now().astimezone().utcoffset().total_seconds()
+
+
+class ClockSync:
+    """
+    Measures and corrects the clocks of many cameras against the local clock, which should itself
+    be NTP disciplined.
+
+    Args:
+        samples: readings per camera, the first one only warms up the connection
+        interval: pause between the readings of one camera, in seconds; a pause that is not a
+            multiple of a second spreads the readings over the second ticks
+        utc_offset: offset of the camera local time from UTC in seconds, as ``date.cgi`` works in
+            camera local time; None assumes the time zone of this machine
+        workers: cameras measured or corrected at the same time
+        timeout: timeout of every request, in seconds
+
+    Example:
+        sync = ClockSync()
+        estimates = sync.survey(cameras)
+        print(sync.distribution(estimates))
+        sync.sync(cameras, tolerance=0.5)
+    """
+
+    def __init__(self, *, samples: int = 8, interval: float = 0.137, utc_offset: float = None,
+                 workers: int = 32, timeout: float = 5.0):
+        if samples < 2:
+            raise ValueError('at least 2 samples are needed')
+        self.samples = samples
+        self.interval = interval
+        self.utc_offset = _local_utc_offset() if utc_offset is None else utc_offset
+        self.workers = workers
+        self.timeout = timeout
+
+    def _read(self, camera) -> ClockSample:
+        sent = time.time()
+        resp = camera._session.get(camera.cam_url + _DATE_PATH, params={'action': 'get'},
+                                   timeout=self.timeout)
+        received = time.time()
+        if resp.status_code != 200:
+            raise requests.HTTPError(f'{resp.status_code} {resp.reason}', response=resp)
+        local = datetime.datetime.strptime(resp.text.strip(), _DATE_FORMAT)
+        reading = calendar.timegm(local.timetuple()) - self.utc_offset
+        return ClockSample(sent, received, reading)
+
+    def sample(self, camera) -> list:
+        """
+        Returns:
+            List of :class:`ClockSample` of one camera, without the warm-up reading.
+        """
+        self._read(camera)
+        samples = []
+        for index in range(self.samples - 1):
+            if index:
+                time.sleep(self.interval)
+            samples.append(self._read(camera))
+        return samples
+
+    @staticmethod
+    def estimate(camera_ip: str, samples: list) -> ClockEstimate:
+        """
+        Combine the samples of one camera into an offset estimate.
+        """
+        low = max(sample.bounds[0] for sample in samples)
+        high = min(sample.bounds[1] for sample in samples)
+        rtt = min(sample.rtt for sample in samples)
+        if low <= high:
+            return ClockEstimate(camera_ip, (low + high) / 2, (high - low) / 2, rtt, len(samples))
+
+        # inconsistent bounds, the clock stepped while sampling or a reading was delayed
+        # inside the camera: take the median midpoint of the fastest half of the samples
+        fastest = sorted(samples, key=lambda sample: sample.rtt)[:max(1, len(samples) // 2)]
+        offset = statistics.median(sum(sample.bounds) / 2 for sample in fastest)
+        return ClockEstimate(camera_ip, offset, 0.5 + rtt / 2, rtt, len(samples))
+
+    def measure(self, camera) -> ClockEstimate:
+        """
+        Returns:
+            :class:`ClockEstimate` of one camera.
+        """
+        try:
+            return self.estimate(camera.ip, self.sample(camera))
+        except (requests.RequestException, ValueError) as err:
+            _log.warning('Could not read the clock of %s: %s', camera.ip, err)
+            return ClockEstimate(camera.ip, None, None, None, 0, str(err))
+
+    def survey(self, cameras) -> dict:
+        """
+        Measure many cameras concurrently.
+
+        Returns:
+            Dictionary camera address -> :class:`ClockEstimate`.
+        """
+        with ThreadPoolExecutor(self.workers) as executor:
+            return {estimate.camera: estimate for estimate in executor.map(self.measure, cameras)}
+
+    @staticmethod
+    def distribution(estimates: dict) -> dict:
+        """
+        Summarize the offsets of a survey.
+
+        Returns:
+            Dictionary with count, failed, min, max, mean, median, stdev, mad (median absolute
+            deviation from the median), p05 and p95 of the offsets, in seconds.
+        """
+        offsets = sorted(estimate.offset for estimate in estimates.values() if estimate.ok)
+        result = {'count': len(offsets), 'failed': len(estimates) - len(offsets)}
+        if not offsets:
+            return result
+
+        def percentile(fraction):
+            position = fraction * (len(offsets) - 1)
+            below = offsets[math.floor(position)]
+            above = offsets[math.ceil(position)]
+            return below + (above - below) * (position - math.floor(position))
+
+        median = statistics.median(offsets)
+        result.update(min=offsets[0], max=offsets[-1], mean=statistics.mean(offsets),
+                      median=median,
+                      stdev=statistics.stdev(offsets) if len(offsets) > 1 else 0.0,
+                      mad=statistics.median(abs(offset - median) for offset in offsets),
+                      p05=percentile(0.05), p95=percentile(0.95))
+        return result
+
+    @staticmethod
+    def outliers(estimates: dict, tolerance: float = 0.5, reference: float = 0.0) -> list:
+        """
+        Returns:
+            Addresses of the cameras whose offset from ``reference`` is beyond ``tolerance``
+            seconds, also counting the measurement uncertainty.
+        """
+        return [ip for ip, estimate in estimates.items()
+                if estimate.ok and abs(estimate.offset - reference) - estimate.uncertainty > tolerance]
+
+    def correct(self, camera, offset: float = 0.0) -> bool:
+        """
+        Set the clock of a camera to the local clock plus ``offset``, timing the request so that
+        it arrives on a second boundary.
+
+        Returns:
+            True if the camera accepted the new time.
+        """
+        try:
+            # the readings warm up the connection and the digest nonce of this thread
+            rtt = min(self._read(camera).rtt for _ in range(3))
+            delay = rtt / 2
+            second = math.ceil(time.time() + offset + delay + 0.2)
+            local = datetime.datetime.fromtimestamp(second + self.utc_offset,
+                                                    datetime.timezone.utc)
+            payload = {'action': 'set', 'year': local.year, 'month': local.month,
+                       'day': local.day, 'hour': local.hour, 'minute': local.minute,
+                       'second': local.second}
+            request = camera._session.prepare_request(
+                requests.Request('GET', camera.cam_url + _DATE_PATH, params=payload))
+            send_at = second - offset - delay
+            pause = send_at - time.time()
+            if pause > 0:
+                time.sleep(pause)
+            resp = camera._session.send(request, timeout=self.timeout)
+        except requests.RequestException as err:
+            _log.warning('Could not set the clock of %s: %s', camera.ip, err)
+            return False
+        if resp.status_code != 200:
+            _log.warning('Could not set the clock of %s: %s %s', camera.ip, resp.status_code,
+                         resp.text)
+            return False
+        return True
+
+    def sync(self, cameras, *, tolerance: float = 0.5, reference: str = 'local',
+             verify: bool = True) -> dict:
+        """
+        Survey the fleet and correct the clocks of the outliers only, concurrently.
+
+        Args:
+            cameras: list of :class:`axis_vapix.Camera`
+            tolerance: largest acceptable offset, in seconds
+            reference: 'local' aligns the outliers with the local clock, 'fleet' with the median
+                offset of the fleet, which keeps the cameras consistent with each other without
+                moving the majority
+            verify: measure the corrected cameras again
+
+        Returns:
+            Dictionary camera address -> (estimate before, estimate after) for the outliers; the
+            estimate after is None when the correction failed or ``verify`` is false.
+        """
+        if reference not in ('local', 'fleet'):
+            raise ValueError(f"reference must be 'local' or 'fleet', not {reference!r}")
+        before = self.survey(cameras)
+        target = 0.0
+        if reference == 'fleet':
+            target = self.distribution(before).get('median', 0.0)
+        selected = set(self.outliers(before, tolerance, target))
+        to_fix = [camera for camera in cameras if camera.ip in selected]
+        _log.info('Correcting %d of %d clocks', len(to_fix), len(cameras))
+
+        def fix(camera):
+            if not self.correct(camera, target):
+                return None
+            return self.measure(camera) if verify else None
+
+        with ThreadPoolExecutor(self.workers) as executor:
+            after = list(executor.map(fix, to_fix))
+        return {camera.ip: (before[camera.ip], estimate)
+                for camera, estimate in zip(to_fix, after)}
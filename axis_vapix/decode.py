@@ -0,0 +1,273 @@
+"""
+Optional JPEG decode stage producing NumPy frames.
+
+JPEGs are decoded by a pool of worker processes, so decoding scales with the number of cores
+instead of being serialized by the GIL. Workers write the pixels into preallocated shared memory
+slots and only the shape travels back, the consumer gets an ndarray view of the slot without any
+copy. Downscaling is done during decode through the JPEG DCT scaling of Pillow (``draft``), which
+is much cheaper than decoding at full size and resizing afterwards.
+
+Requires ``numpy`` and ``Pillow`` (``pip install axis_vapix[decode]``) and Python 3.8+.
+"""
+import io
+import os
+import queue
+import logging
+import collections
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy as np
+    from PIL import Image
+    from multiprocessing import shared_memory
+except ImportError:  # optional dependencies
+    np = None
+    Image = None
+    shared_memory = None
+
+_log = logging.getLogger(__name__)
+
+_worker_slots = None
+
+
+def _init_worker(names: list):
+    global _worker_slots  # pylint: disable=W0603
+    _worker_slots = [shared_memory.SharedMemory(name=name) for name in names]
+
+
+def _decode_into(slot: int, data: bytes, downscale: int, mode: str) -> tuple:
+    image = Image.open(io.BytesIO(data))
+    if downscale > 1:
+        target = (max(1, image.width // downscale), max(1, image.height // downscale))
+        # let libjpeg skip the DCT coefficients it does not need (1/2, 1/4 or 1/8 scale)
+        image.draft(mode, target)
+        image = image.convert(mode)
+        if image.size != target:
+            image = image.resize(target, Image.BILINEAR)
+    else:
+        image = image.convert(mode)
+
+    pixels = np.asarray(image)
+    shm = _worker_slots[slot]
+    if pixels.nbytes > shm.size:
+        raise ValueError(f'decoded frame of shape {pixels.shape} does not fit a slot of '
+                         f'{shm.size} bytes, raise max_shape or downscale')
+    out = np.ndarray(pixels.shape, dtype=pixels.dtype, buffer=shm.buf)
+    out[...] = pixels
+    del out
+    return pixels.shape, pixels.dtype.str
+
+
+class DecodedFrame:
+    """
+    Decoded frame backed by a shared memory slot of the :class:`DecodePool`.
+
+    ``array`` is a view of the slot: call :meth:`release` (or drop the frame) once done with it,
+    the slot is then reused and the view overwritten. Use :meth:`copy` to keep the pixels.
+    """
+
+    __slots__ = ('key', 'timestamp', 'array', '_pool', '_slot')
+
+    def __init__(self, key, timestamp, array, pool, slot):
+        self.key = key
+        self.timestamp = timestamp
+        self.array = array
+        self._pool = pool
+        self._slot = slot
+
+    def copy(self):
+        return self.array.copy()
+
+    def release(self):
+        if self._slot is not None:
+            self.array = None
+            self._pool._release_slot(self._slot)
+            self._slot = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def __del__(self):
+        self.release()
+
+
+class DecodePool:
+    """
+    Process pool decoding JPEGs into NumPy arrays through shared memory.
+
+    Args:
+        workers: number of decoder processes, defaults to the number of CPUs
+        slots: number of shared memory output slots, it bounds the frames in flight plus the
+            frames held by consumers. Defaults to twice the number of workers
+        max_shape: largest decoded (height, width, channels) a slot must hold
+        downscale: default integer reduction factor applied during decode
+        mode: Pillow mode of the decoded frames, 'RGB' or 'L' for grayscale
+        mp_context: multiprocessing context of the worker processes
+
+    Example:
+        with DecodePool(downscale=2) as pool:
+            for frame in pool.ordered(restreamer.subscribe(), key='entrance'):
+                analyze(frame.array)
+                frame.release()
+    """
+
+    def __init__(self, workers: int = None, *, slots: int = None,
+                 max_shape: tuple = (1080, 1920, 3), downscale: int = 1, mode: str = 'RGB',
+                 mp_context=None):
+        if np is None or shared_memory is None:
+            raise ImportError('DecodePool requires numpy, Pillow and Python 3.8+, '
+                              'install them with "pip install axis_vapix[decode]"')
+        self.workers = workers or os.cpu_count() or 1
+        self.downscale = downscale
+        self.mode = mode
+
+        slot_size = int(np.prod(max_shape))
+        self._shm = [shared_memory.SharedMemory(create=True, size=slot_size)
+                     for _ in range(slots or 2 * self.workers)]
+        self._free = queue.Queue()
+        for slot in range(len(self._shm)):
+            self._free.put(slot)
+
+        self._executor = ProcessPoolExecutor(self.workers, mp_context=mp_context,
+                                             initializer=_init_worker,
+                                             initargs=([shm.name for shm in self._shm],))
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def free_slots(self) -> int:
+        return self._free.qsize()
+
+    def _release_slot(self, slot: int):
+        self._free.put(slot)
+
+    def _wrap(self, future, slot: int, key, timestamp):
+        try:
+            shape, dtype = future.result()
+        except Exception:
+            self._release_slot(slot)
+            raise
+        array = np.ndarray(shape, dtype=dtype, buffer=self._shm[slot].buf)
+        return DecodedFrame(key, timestamp, array, self, slot)
+
+    def submit(self, data, *, key=None, timestamp: float = None, downscale: int = None,
+               block: bool = True, timeout: float = None):
+        """
+        Queue one JPEG for decoding.
+
+        Args:
+            data: encoded JPEG (bytes or memoryview)
+            key: camera identifier copied into the decoded frame
+            timestamp: capture time copied into the decoded frame
+            downscale: reduction factor, defaults to the one of the pool
+            block: wait for a free slot, else raise ``queue.Empty`` when none is available
+            timeout: seconds to wait for a free slot
+
+        Returns:
+            A pending frame, its ``result()`` waits for the decode and returns the
+            :class:`DecodedFrame` or raises the decoding error.
+        """
+        slot = self._free.get(block, timeout)
+        try:
+            future = self._executor.submit(_decode_into, slot, bytes(data),
+                                           downscale or self.downscale, self.mode)
+        except Exception:
+            self._release_slot(slot)
+            raise
+        return _PendingFrame(self, future, slot, key, timestamp)
+
+    def decode(self, data, **kwargs) -> DecodedFrame:
+        """
+        Decode one JPEG and wait for the result. Takes the arguments of :meth:`submit`.
+        """
+        return self.submit(data, **kwargs).result()
+
+    def ordered(self, frames, *, key=None, depth: int = 4, downscale: int = None):
+        """
+        Decode a stream of frames of one camera, keeping up to ``depth`` of them in flight, and
+        yield them in their original order. Frames that fail to decode are logged and skipped.
+
+        Args:
+            frames: iterable of :class:`axis_vapix.Frame` or of JPEG bytes
+            key: camera identifier copied into the decoded frames
+            depth: maximal number of frames of this stream being decoded at the same time
+            downscale: reduction factor, defaults to the one of the pool
+
+        Returns:
+            Iterator of :class:`DecodedFrame`.
+        """
+        pending = collections.deque()
+        for frame in frames:
+            data, timestamp = (frame.data, frame.timestamp) if hasattr(frame, 'data') else (frame, None)
+            while True:
+                try:
+                    pending.append(self.submit(data, key=key, timestamp=timestamp,
+                                               downscale=downscale, block=not pending))
+                    break
+                except queue.Empty:
+                    # every slot is taken: hand out our oldest frame so the consumer can free one
+                    # instead of waiting for a slot we may be holding ourselves
+                    decoded = pending.popleft().result_or_none()
+                    if decoded is not None:
+                        yield decoded
+            while pending and (len(pending) >= depth or pending[0].done()):
+                decoded = pending.popleft().result_or_none()
+                if decoded is not None:
+                    yield decoded
+        while pending:
+            decoded = pending.popleft().result_or_none()
+            if decoded is not None:
+                yield decoded
+
+    def close(self):
+        """
+        Stop the workers and free the shared memory.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._executor.shutdown()
+        for shm in self._shm:
+            try:
+                shm.close()
+            except BufferError:
+                _log.warning('Shared memory slot %s is still referenced by a frame', shm.name)
+            shm.unlink()
+
+
+class _PendingFrame:
+    """
+    Frame being decoded by the pool.
+    """
+
+    def __init__(self, pool: DecodePool, future, slot: int, key, timestamp):
+        self._pool = pool
+        self._future = future
+        self._slot = slot
+        self._key = key
+        self._timestamp = timestamp
+        self._frame = None
+
+    def done(self) -> bool:
+        return self._future.done()
+
+    def result(self, timeout: float = None) -> DecodedFrame:
+        if self._frame is None:
+            self._future.exception(timeout)
+            self._frame = self._pool._wrap(self._future, self._slot, self._key, self._timestamp)
+        return self._frame
+
+    def result_or_none(self):
+        try:
+            return self.result()
+        except Exception as err:  # pylint: disable=W0703
+            _log.warning('Could not decode frame of %s: %s', self._key, err)
+            return None
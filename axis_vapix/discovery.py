@@ -0,0 +1,353 @@
+"""
+Discovery of Axis devices in address ranges.
+
+:class:`Discovery` sweeps CIDR ranges on one asyncio event loop: a fixed number of workers take
+the addresses one by one, so memory stays flat for any range size and at most ``max_sockets``
+connections are open at the same time. An address costs one connection attempt with a short
+timeout; only addresses accepting it get the identification request, a single batched
+``param.cgi`` list of model, product type, serial number and firmware version. A device is taken
+as Axis when it answers that request with ``root.Brand`` parameters, or, without valid
+credentials, when its digest realm is the ``AXIS_<serial>`` realm of Axis devices.
+
+The result is written as inventory, JSON or CSV, from which the cameras are built again:
+
+    python -m axis_vapix.discovery 192.168.0.0/16 --user root --password pass -o inventory.json
+
+    cameras = [device.camera('root', 'pass') for device in load_inventory('inventory.json')]
+"""
+import os
+import re
+import ssl
+import csv
+import json
+import time
+import asyncio
+import logging
+import argparse
+import ipaddress
+from typing import NamedTuple, Optional
+
+from .health import _Digest, _read_response
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+_log = logging.getLogger(__name__)
+
+AXIS = 'axis'
+UNAUTHORIZED = 'unauthorized'
+
+_PARAMETERS = {
+    'model': 'root.Brand.ProdNbr',
+    'name': 'root.Brand.ProdFullName',
+    'product_type': 'root.Brand.ProdType',
+    'serial': 'root.Properties.System.SerialNumber',
+    'firmware': 'root.Properties.Firmware.Version',
+}
+_IDENTIFY_PATH = '/axis-cgi/param.cgi?action=list&group=' + ','.join(_PARAMETERS.values())
+_AXIS_REALM = re.compile(r'realm="AXIS_([0-9A-Fa-f]{12})?', re.IGNORECASE)
+_DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+class Device(NamedTuple):
+    """
+    An Axis device found by :class:`Discovery`. ``status`` is 'axis' when the identification
+    request was answered, 'unauthorized' when the credentials were refused; then only ``serial``
+    may be known, from the realm.
+    """
+    address: str
+    port: int
+    scheme: str
+    status: str
+    model: Optional[str] = None
+    name: Optional[str] = None
+    product_type: Optional[str] = None
+    serial: Optional[str] = None
+    firmware: Optional[str] = None
+    latency: Optional[float] = None
+
+    def camera(self, user: str, password: str, **kwargs):
+        """
+        Build the :class:`axis_vapix.Camera` of this device.
+        """
+        from .axis_camera import Camera
+        return Camera(self.address, user, password, scheme=self.scheme,
+                      port=None if self.port == _DEFAULT_PORTS[self.scheme] else self.port,
+                      **kwargs)
+
+
+def _edges(network) -> set:
+    """
+    The addresses of a range that are not hosts: network and broadcast address.
+    """
+    if network.num_addresses <= 2:
+        return set()
+    if network.version == 6:
+        return {network.network_address}
+    return {network.network_address, network.broadcast_address}
+
+
+def addresses(networks, exclude=()):
+    """
+    Iterate over the host addresses of networks without building a list of them.
+
+    Overlapping and adjacent ranges are merged first with ``ipaddress.collapse_addresses``, so
+    every address comes once and memory stays flat whatever the number of addresses.
+
+    Args:
+        networks: CIDR ranges or single addresses, like '10.0.0.0/16' or ['10.1.2.3']
+        exclude: addresses or ranges to leave out, like the gateway
+
+    Yields:
+        Addresses as strings.
+    """
+    networks = [networks] if isinstance(networks, str) else networks
+    networks = [ipaddress.ip_network(network, strict=False) for network in networks]
+    excluded = [ipaddress.ip_network(network, strict=False) for network in exclude]
+    # network and broadcast addresses of the given ranges, unless another range has them as host
+    edges = set()
+    for network in networks:
+        edges |= {address for address in _edges(network)
+                  if not any(address in other and address not in _edges(other)
+                             for other in networks)}
+    for version in (4, 6):
+        for network in ipaddress.collapse_addresses(
+                network for network in networks if network.version == version):
+            for address in network:
+                if address in edges or any(address in other for other in excluded):
+                    continue
+                yield str(address)
+
+
+def _max_sockets(wanted: int) -> int:
+    """
+    Limit the open sockets to the file descriptors the process may open.
+    """
+    if resource is None:
+        return wanted
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return wanted
+    return max(1, min(wanted, soft - 64))
+
+
+def save_inventory(devices, path: str):
+    """
+    Write devices to an inventory file, CSV when the name ends with '.csv', JSON otherwise.
+    The file is replaced at once, so a reader never sees half of it.
+    """
+    temporary = path + '.part'
+    with open(temporary, 'w', newline='') as file:
+        if path.endswith('.csv'):
+            writer = csv.writer(file)
+            writer.writerow(Device._fields)
+            writer.writerows(devices)
+        else:
+            json.dump([device._asdict() for device in devices], file, indent=1)
+    os.replace(temporary, path)
+
+
+def load_inventory(path: str) -> list:
+    """
+    Read an inventory file written by :func:`save_inventory`.
+
+    Returns:
+        List of :class:`Device`.
+    """
+    with open(path, newline='') as file:
+        if path.endswith('.csv'):
+            rows = [{key: value or None for key, value in row.items()}
+                    for row in csv.DictReader(file)]
+        else:
+            rows = json.load(file)
+    devices = []
+    for row in rows:
+        row['port'] = int(row['port'])
+        if row.get('latency') is not None:
+            row['latency'] = float(row['latency'])
+        devices.append(Device(**{key: row.get(key) for key in Device._fields}))
+    return devices
+
+
+class Discovery:
+    """
+    Finds the Axis devices in address ranges.
+
+    Args:
+        user: user name for the identification request; without it devices are only recognized
+            by their realm
+        password: password
+        schemes: schemes to try on every address, 'http' and/or 'https'
+        port: optional dictionary scheme -> port, for other ports than 80 and 443
+        connect_timeout: time allowed to open a connection, in seconds; on a local network a
+            device answers within milliseconds
+        timeout: time allowed for the identification request, in seconds
+        max_sockets: connections open at the same time, limited by the file descriptor limit
+
+    Example:
+        devices = Discovery('root', 'pass').run(['10.0.0.0/16', '10.1.4.0/24'])
+        save_inventory(devices, 'inventory.json')
+    """
+
+    def __init__(self, user: str = None, password: str = None, *, schemes=('http',),
+                 port: dict = None, connect_timeout: float = 0.5, timeout: float = 3.0,
+                 max_sockets: int = 512):
+        self.user = user
+        self.password = password
+        self.targets = [(scheme, (port or {}).get(scheme) or _DEFAULT_PORTS[scheme])
+                        for scheme in schemes]
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self.max_sockets = _max_sockets(max_sockets)
+        self._ssl_context = None
+        self.scanned = 0
+        self.reachable = 0
+        self.found = 0
+        self.elapsed = None
+
+    def _ssl(self):
+        if self._ssl_context is None:
+            # devices carry self-signed certificates, identification does not trust them
+            self._ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            self._ssl_context.check_hostname = False
+            self._ssl_context.verify_mode = ssl.CERT_NONE
+        return self._ssl_context
+
+    async def _connect(self, address: str, port: int, scheme: str):
+        return await asyncio.wait_for(asyncio.open_connection(
+            address, port, ssl=self._ssl() if scheme == 'https' else None,
+            server_hostname=address if scheme == 'https' else None), self.connect_timeout)
+
+    async def _get(self, address: str, port: int, scheme: str, digest: _Digest, connection=None):
+        reader, writer = connection or await self._connect(address, port, scheme)
+        try:
+            request = f'GET {_IDENTIFY_PATH} HTTP/1.1\r\nHost: {address}\r\nConnection: close\r\n'
+            authorization = digest.header('GET', _IDENTIFY_PATH) if digest else None
+            if authorization:
+                request += f'Authorization: {authorization}\r\n'
+            writer.write(request.encode('latin-1') + b'\r\n')
+            return await _read_response(reader)
+        finally:
+            writer.close()
+
+    async def probe(self, address: str, port: int = 80, scheme: str = 'http') -> Optional[Device]:
+        """
+        Identify the device at one address and port.
+
+        Returns:
+            :class:`Device`, or None when nothing answers or the answer is not from an Axis device.
+        """
+        try:
+            connection = await self._connect(address, port, scheme)
+        except (OSError, asyncio.TimeoutError):
+            return None
+        self.reachable += 1
+        digest = _Digest(self.user, self.password) if self.user is not None else None
+        start = time.monotonic()
+        try:
+            status, headers, body = await asyncio.wait_for(
+                self._get(address, port, scheme, digest, connection), self.timeout)
+            if status == 401 and digest is not None and 'www-authenticate' in headers:
+                realm = headers['www-authenticate']
+                digest.set_challenge(realm)
+                start = time.monotonic()
+                status, headers, body = await asyncio.wait_for(
+                    self._get(address, port, scheme, digest), self.timeout)
+                headers.setdefault('www-authenticate', realm)
+        except (OSError, asyncio.TimeoutError, ValueError, IndexError,
+                asyncio.IncompleteReadError) as err:
+            _log.debug('No identification from %s:%d: %s', address, port, err)
+            return None
+        latency = time.monotonic() - start
+
+        if status == 200:
+            values = dict(line.strip().split('=', 1)
+                          for line in body.decode('utf-8', 'replace').splitlines() if '=' in line)
+            if any(key.startswith('root.Brand.') for key in values):
+                return Device(address, port, scheme, AXIS, latency=latency,
+                              **{field: values.get(name) for field, name in _PARAMETERS.items()})
+        elif status == 401:
+            realm = _AXIS_REALM.search(headers.get('www-authenticate', ''))
+            if realm:
+                serial = realm.group(1).upper() if realm.group(1) else None
+                return Device(address, port, scheme, UNAUTHORIZED, serial=serial, latency=latency)
+        return None
+
+    async def scan(self, networks, *, exclude=(), progress=None) -> list:
+        """
+        Sweep address ranges.
+
+        Args:
+            networks: CIDR ranges or single addresses
+            exclude: addresses or ranges to leave out
+            progress: optional callable receiving every :class:`Device` as it is found
+
+        Returns:
+            List of :class:`Device`, sorted by address.
+        """
+        self.scanned = self.reachable = self.found = 0
+        start = time.monotonic()
+        pending = ((address, scheme, port) for address in addresses(networks, exclude)
+                   for scheme, port in self.targets)
+        devices = []
+
+        async def worker():
+            # the workers share one generator, each takes the next address when it is free
+            for address, scheme, port in pending:
+                self.scanned += 1
+                device = await self.probe(address, port, scheme)
+                if device is not None:
+                    self.found += 1
+                    devices.append(device)
+                    _log.info('Found %s at %s:%d', device.model or device.status, address, port)
+                    if progress is not None:
+                        progress(device)
+
+        await asyncio.gather(*(worker() for _ in range(self.max_sockets)))
+        self.elapsed = time.monotonic() - start
+        _log.info('Scanned %d addresses in %.1f s: %d open, %d Axis devices', self.scanned,
+                  self.elapsed, self.reachable, self.found)
+        return sorted(devices, key=lambda device: (ipaddress.ip_address(device.address),
+                                                   device.port))
+
+    def run(self, networks, *, exclude=(), progress=None) -> list:
+        """
+        Blocking version of :meth:`scan`.
+        """
+        return asyncio.run(self.scan(networks, exclude=exclude, progress=progress))
+
+    def stats(self) -> dict:
+        return {'scanned': self.scanned, 'reachable': self.reachable, 'found': self.found,
+                'elapsed': self.elapsed}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Find the Axis devices in address ranges')
+    parser.add_argument('networks', nargs='+', help='CIDR ranges or addresses')
+    parser.add_argument('--user')
+    parser.add_argument('--password')
+    parser.add_argument('--exclude', nargs='*', default=())
+    parser.add_argument('--schemes', default='http')
+    parser.add_argument('--http-port', type=int)
+    parser.add_argument('--https-port', type=int)
+    parser.add_argument('--connect-timeout', type=float, default=0.5)
+    parser.add_argument('--timeout', type=float, default=3.0)
+    parser.add_argument('--max-sockets', type=int, default=512)
+    parser.add_argument('-o', '--output', default='inventory.json')
+    args = parser.parse_args()
+
+    discovery = Discovery(args.user, args.password, schemes=args.schemes.split(','),
+                          port={'http': args.http_port, 'https': args.https_port},
+                          connect_timeout=args.connect_timeout, timeout=args.timeout,
+                          max_sockets=args.max_sockets)
+    found = discovery.run(args.networks, exclude=args.exclude,
+                          progress=lambda device: print(f'{device.address:15} {device.port:5} '
+                                                        f'{device.status:12} {device.model or ""} '
+                                                        f'{device.serial or ""} '
+                                                        f'{device.firmware or ""}'))
+    save_inventory(found, args.output)
+    stats = discovery.stats()
+    print(f'{stats["found"]} Axis devices, {stats["reachable"]} reachable of '
+          f'{stats["scanned"]} scanned in {stats["elapsed"]:.1f} s, written to {args.output}')
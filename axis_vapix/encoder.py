@@ -0,0 +1,191 @@
+"""
+Channel-aware access to multi-channel video encoders.
+
+An Axis video encoder serves each of its video inputs as a channel, selected by the ``camera``
+argument of the VAPIX requests. :class:`Encoder` learns the number of channels once, through
+:meth:`axis_vapix.Camera.get_channels` and the capability cache, and runs a request for all
+channels at the same time over the connection pool of the camera, grown so that every channel
+keeps its own connection open. A sweep of 16 channels then takes the wall time of one request
+instead of 16. The video status of all channels is a single request, ``videostatus.cgi`` takes
+a list of channels.
+"""
+import re
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional
+
+import requests
+
+from . import transport
+
+_log = logging.getLogger(__name__)
+
+_VIDEO_STATUS = re.compile(r'^Video\s+(\d+)\s*=\s*(.*?)\s*$', re.MULTILINE)
+_IMAGE_SIZE = re.compile(r'image\s+(width|height)\s*=\s*(\d+)')
+
+
+class ChannelResult(NamedTuple):
+    """
+    Result of one request on one channel. ``value`` is None when the request failed.
+    """
+    channel: int
+    value: object
+    latency: float
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class Encoder:
+    """
+    Runs requests on all channels of a video encoder concurrently.
+
+    Args:
+        camera: :class:`axis_vapix.Camera` of the encoder
+        channels: number of channels, requested from the encoder when None
+        timeout: timeout of every request, in seconds
+
+    Example:
+        encoder = Encoder(Camera('192.168.0.90', 'root', 'pass'))
+        encoder.video_status()                # {1: 'video', 2: 'no video', ...}
+        for result in encoder.snapshots(resolution='640x480').values():
+            if result.ok:
+                open(f'channel{result.channel}.jpg', 'wb').write(result.value)
+    """
+
+    def __init__(self, camera, *, channels: int = None, timeout: float = 10.0):
+        self.camera = camera
+        self.timeout = timeout
+        self.count = channels or camera.get_channels()
+        transport.resize_pool(camera._session, camera.cam_url, self.count)
+        self._executor = ThreadPoolExecutor(self.count, thread_name_prefix='encoder')
+
+    @property
+    def channels(self) -> list:
+        return list(range(1, self.count + 1))
+
+    def map(self, function, channels=None) -> dict:
+        """
+        Call ``function(channel)`` for channels concurrently.
+
+        Args:
+            function: callable taking the channel number
+            channels: channel numbers, all when None
+
+        Returns:
+            Dictionary channel -> :class:`ChannelResult`, in channel order.
+        """
+        def call(channel):
+            start = time.monotonic()
+            try:
+                value = function(channel)
+            except requests.RequestException as err:
+                _log.warning('Request on channel %d of %s failed: %s', channel, self.camera.ip,
+                             err)
+                return ChannelResult(channel, None, time.monotonic() - start, str(err))
+            return ChannelResult(channel, value, time.monotonic() - start)
+
+        channels = self.channels if channels is None else list(channels)
+        return {result.channel: result for result in self._executor.map(call, channels)}
+
+    def _get(self, path: str, payload: dict) -> requests.Response:
+        resp = self.camera._session.get(self.camera.cam_url + path, params=payload,
+                                        timeout=self.timeout)
+        if resp.status_code not in (200, 204):
+            raise requests.HTTPError(f'{resp.status_code} {resp.reason}', response=resp)
+        return resp
+
+    def video_status(self, channels=None) -> dict:
+        """
+        Video signal status of channels, in one request.
+
+        Returns:
+            Dictionary channel -> status text, like 'video' or 'no video'.
+        """
+        channels = self.channels if channels is None else list(channels)
+        resp = self._get('/axis-cgi/videostatus.cgi',
+                         {'status': ','.join(str(channel) for channel in channels)})
+        return {int(channel): status for channel, status in _VIDEO_STATUS.findall(resp.text)}
+
+    def image_sizes(self, channels=None) -> dict:
+        """
+        Image size of channels, kept by the capability cache like
+        :meth:`axis_vapix.Camera.get_image_size`.
+
+        Returns:
+            Dictionary channel -> :class:`ChannelResult` with (width, height).
+        """
+        def size(channel):
+            values = dict(_IMAGE_SIZE.findall(self.camera.get_image_size(channel)))
+            if 'width' not in values or 'height' not in values:
+                raise requests.RequestException('no image size in the answer')
+            return int(values['width']), int(values['height'])
+
+        return self.map(size, channels)
+
+    def snapshots(self, channels=None, **arguments) -> dict:
+        """
+        One JPEG image of every channel, taken at the same time.
+
+        Args:
+            channels: channel numbers, all when None
+            **arguments: arguments of ``jpg/image.cgi``, like resolution='640x480'
+
+        Returns:
+            Dictionary channel -> :class:`ChannelResult` with the JPEG bytes.
+        """
+        return self.map(lambda channel: self._get('/axis-cgi/jpg/image.cgi',
+                                                  {**arguments, 'camera': channel}).content,
+                        channels)
+
+    def set_text(self, texts) -> dict:
+        """
+        Set the dynamic text overlay of channels.
+
+        Args:
+            texts: one text for all channels, or dictionary channel -> text
+
+        Returns:
+            Dictionary channel -> :class:`ChannelResult`.
+        """
+        if isinstance(texts, str):
+            texts = dict.fromkeys(self.channels, texts)
+        return self.map(lambda channel: self._get('/axis-cgi/dynamicoverlay.cgi', {
+            'action': 'settext', 'text': texts[channel], 'camera': channel}).text, texts)
+
+    def ptz_status(self, channels=None) -> dict:
+        """
+        Position of the PTZ heads connected to channels.
+
+        Returns:
+            Dictionary channel -> :class:`ChannelResult` with the dictionary of
+            :meth:`axis_vapix.Camera.get_status`.
+        """
+        return self.map(self.camera.get_status, channels)
+
+    def ptz(self, commands) -> dict:
+        """
+        Send PTZ commands to channels at the same time.
+
+        Args:
+            commands: dictionary channel -> ``ptz.cgi`` arguments, like
+                ``{1: {'pan': 10, 'tilt': 0}, 2: {'move': 'home'}}``
+
+        Returns:
+            Dictionary channel -> :class:`ChannelResult` with the status code.
+        """
+        return self.map(lambda channel: self.camera._ptz_command(
+            dict(commands[channel]), channel).status_code, commands)
+
+    def stop(self, channels=None) -> dict:
+        """
+        Stop the movement of the PTZ heads of channels.
+        """
+        channels = self.channels if channels is None else list(channels)
+        return self.ptz(dict.fromkeys(channels, {'move': 'stop'}))
+
+    def close(self):
+        self._executor.shutdown()
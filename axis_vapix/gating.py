@@ -0,0 +1,180 @@
+"""
+Change gating of snapshots: drop frames that are nearly identical to the last accepted one.
+
+Each camera keeps a tiny grayscale reference of its last accepted frame. A new JPEG is decoded at
+1/8 scale straight from its DCT coefficients, reduced to the same grid and compared with the
+reference in one vectorized NumPy expression, which costs well under a millisecond per frame.
+Frames whose change score is below the threshold are dropped before they are written or uploaded.
+
+Requires ``numpy`` and ``Pillow`` (``pip install axis_vapix[decode]``).
+"""
+import io
+import time
+import logging
+import threading
+
+try:
+    import numpy as np
+    from PIL import Image
+except ImportError:  # optional dependencies
+    np = None
+    Image = None
+
+_log = logging.getLogger(__name__)
+
+
+class _Reference:
+    __slots__ = ('grid', 'accepted_at', 'seen', 'dropped', 'cost', 'last_score')
+
+    def __init__(self):
+        self.grid = None
+        self.accepted_at = 0.0
+        self.seen = 0
+        self.dropped = 0
+        self.cost = 0.0
+        self.last_score = None
+
+
+class ChangeGate:
+    """
+    Per camera frame-difference gate.
+
+    The change score of a frame is the fraction of cells of a ``grid`` sized grayscale thumbnail
+    whose brightness moved by more than ``pixel_delta`` since the last accepted frame, so sensor
+    noise and slow light changes do not count as change.
+
+    Args:
+        threshold: frames with a score below this fraction (0 … 1) are dropped
+        pixel_delta: brightness difference (0 … 255) for a cell to count as changed
+        grid: (width, height) of the thumbnail compared
+        max_interval: accept a frame anyway when none was accepted for this many seconds,
+            None to never force one
+
+    Example:
+        gate = ChangeGate(threshold=0.02)
+        camera.get_jpeg_request(resolution='1280x720', gate=gate)
+        if gate.accept('entrance', jpeg):
+            upload(jpeg)
+        print(gate.stats('entrance'))
+    """
+
+    def __init__(self, threshold: float = 0.02, *, pixel_delta: int = 12, grid: tuple = (64, 36),
+                 max_interval: float = None):
+        if np is None:
+            raise ImportError('ChangeGate requires numpy and Pillow, '
+                              'install them with "pip install axis_vapix[decode]"')
+        self.threshold = threshold
+        self.pixel_delta = pixel_delta
+        self.grid = grid
+        self.max_interval = max_interval
+        self._references = {}
+        self._lock = threading.Lock()
+
+    def _thumbnail(self, data):
+        if isinstance(data, np.ndarray):
+            image = Image.fromarray(data if data.dtype == np.uint8 else data.astype(np.uint8))
+        else:
+            image = Image.open(io.BytesIO(data))
+            image.draft('L', (image.width // 8, image.height // 8))
+        return np.asarray(image.convert('L').resize(self.grid, Image.BILINEAR), dtype=np.int16)
+
+    def score(self, key, data) -> float:
+        """
+        Change score of a frame against the reference of a camera, without updating anything.
+
+        Args:
+            key: camera identifier
+            data: encoded JPEG or decoded ndarray
+
+        Returns:
+            Fraction of changed cells, 1.0 when the camera has no reference yet.
+        """
+        reference = self._references.get(key)
+        if reference is None or reference.grid is None:
+            return 1.0
+        return self._score(reference.grid, self._thumbnail(data))
+
+    def _score(self, reference, grid) -> float:
+        return float(np.count_nonzero(np.abs(grid - reference) > self.pixel_delta)) / grid.size
+
+    def accept(self, key, data) -> bool:
+        """
+        Gate one frame. An accepted frame becomes the new reference of the camera.
+
+        Args:
+            key: camera identifier
+            data: encoded JPEG or decoded ndarray
+
+        Returns:
+            True if the frame changed enough to be kept, False if it should be dropped.
+        """
+        start = time.perf_counter()
+        grid = self._thumbnail(data)
+        with self._lock:
+            reference = self._references.get(key)
+            if reference is None:
+                reference = self._references[key] = _Reference()
+
+            now = time.monotonic()
+            if reference.grid is None:
+                score = 1.0
+            else:
+                score = self._score(reference.grid, grid)
+            keep = score >= self.threshold or \
+                (self.max_interval is not None and now - reference.accepted_at >= self.max_interval)
+            if keep:
+                reference.grid = grid
+                reference.accepted_at = now
+            else:
+                reference.dropped += 1
+            reference.seen += 1
+            reference.last_score = score
+            reference.cost += time.perf_counter() - start
+        return keep
+
+    def filter(self, frames, key):
+        """
+        Yield only the changed frames of an iterable of :class:`axis_vapix.Frame` or
+        :class:`axis_vapix.DecodedFrame` of one camera.
+        """
+        for frame in frames:
+            data = frame.array if hasattr(frame, 'array') else frame.data
+            if self.accept(key, data):
+                yield frame
+
+    def reset(self, key=None):
+        """
+        Forget the reference of one camera, or of all cameras when key is None.
+        """
+        with self._lock:
+            if key is None:
+                self._references.clear()
+            else:
+                self._references.pop(key, None)
+
+    def stats(self, key=None) -> dict:
+        """
+        Args:
+            key: camera identifier, None for the totals over all cameras
+
+        Returns:
+            Frames seen and dropped, drop ratio, mean gating cost in milliseconds and, for a
+            single camera, the last score.
+        """
+        with self._lock:
+            if key is not None:
+                references = [self._references[key]] if key in self._references else []
+            else:
+                references = list(self._references.values())
+            seen = sum(reference.seen for reference in references)
+            dropped = sum(reference.dropped for reference in references)
+            cost = sum(reference.cost for reference in references)
+            result = {
+                'seen': seen,
+                'dropped': dropped,
+                'drop_ratio': dropped / seen if seen else 0.0,
+                'mean_cost_ms': 1000 * cost / seen if seen else 0.0,
+            }
+            if key is not None:
+                result['last_score'] = references[0].last_score if references else None
+        return result
@@ -0,0 +1,492 @@
+"""
+Fleet health watchdog on one asyncio event loop.
+
+Every camera is probed with the cheapest authenticated VAPIX request, one small ``param.cgi``
+group. Probes are made by a minimal HTTP/1.1 client on asyncio streams, so thousands of cameras
+need one thread, and a semaphore bounds the probes running at the same time. The connection to
+each camera is kept alive between probes, and its digest challenge is kept and answered in
+advance, so a probe is a single round trip without TCP or TLS handshake until the camera closes
+the connection or asks for a new nonce. Probes and idle connections together never hold more
+than ``max_sockets`` sockets: the least recently used idle connection makes room for a new one.
+
+The first probes are spread evenly over the shortest interval, and every interval carries some
+jitter, so the probes never arrive in bursts. A camera that keeps its state is probed less and
+less often, up to ``max_interval``; any change brings it back to ``min_interval``. Transitions
+between 'up', 'degraded' and 'down' are published as :class:`HealthEvent`.
+"""
+import os
+import ssl
+import time
+import heapq
+import random
+import asyncio
+import hashlib
+import logging
+import threading
+import collections
+import urllib.parse
+import urllib.request
+from typing import NamedTuple, Optional
+
+_log = logging.getLogger(__name__)
+
+UP = 'up'
+DEGRADED = 'degraded'
+DOWN = 'down'
+UNKNOWN = 'unknown'
+
+_PROBE_PATH = '/axis-cgi/param.cgi?action=list&group=Brand.ProdType'
+
+
+class HealthEvent(NamedTuple):
+    """
+    A state transition of one camera.
+    """
+    camera: str
+    state: str
+    previous: str
+    timestamp: float
+    latency: Optional[float]
+    reason: Optional[str]
+
+
+class _Digest:
+    """
+    HTTP digest authentication answering a stored challenge in advance.
+    """
+
+    def __init__(self, user: str, password: str):
+        self.user = user
+        self.password = password
+        self.challenge = None
+        self.count = 0
+
+    def set_challenge(self, header: str):
+        fields = urllib.request.parse_keqv_list(urllib.request.parse_http_list(
+            header.split(' ', 1)[1] if ' ' in header else ''))
+        self.challenge = fields
+        self.count = 0
+
+    def header(self, method: str, uri: str) -> Optional[str]:
+        if self.challenge is None:
+            return None
+        name = self.challenge.get('algorithm', 'MD5')
+        algorithm = name.upper()
+        digest = hashlib.sha256 if algorithm.startswith('SHA-256') else hashlib.md5
+
+        def hash_(text):
+            return digest(text.encode('utf-8')).hexdigest()
+
+        realm = self.challenge.get('realm', '')
+        nonce = self.challenge.get('nonce', '')
+        self.count += 1
+        nc = f'{self.count:08x}'
+        cnonce = os.urandom(8).hex()
+        ha1 = hash_(f'{self.user}:{realm}:{self.password}')
+        if algorithm.endswith('-SESS'):
+            ha1 = hash_(f'{ha1}:{nonce}:{cnonce}')
+        ha2 = hash_(f'{method}:{uri}')
+        qop = self.challenge.get('qop')
+        if qop:
+            qop = 'auth'
+            response = hash_(f'{ha1}:{nonce}:{nc}:{cnonce}:{qop}:{ha2}')
+        else:
+            response = hash_(f'{ha1}:{nonce}:{ha2}')
+        header = f'Digest username="{self.user}", realm="{realm}", nonce="{nonce}", ' \
+                 f'uri="{uri}", response="{response}", algorithm={name}'
+        if 'opaque' in self.challenge:
+            header += f', opaque="{self.challenge["opaque"]}"'
+        if qop:
+            header += f', qop={qop}, nc={nc}, cnonce="{cnonce}"'
+        return header
+
+
+async def _read_response(reader) -> tuple:
+    """
+    Read one HTTP/1.1 response from an asyncio stream.
+
+    Returns:
+        Tuple of status code, dictionary of lowercase header names to values, and body.
+    """
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('connection closed without answer')
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding', '').lower() == 'chunked':
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            chunks.append((await reader.readexactly(size + 2))[:-2])
+            if size == 0:
+                break
+        body = b''.join(chunks)
+    else:
+        body = await reader.read()
+    return status, headers, body
+
+
+class CameraHealth:
+    """
+    Health state of one camera, updated by the monitor.
+    """
+
+    def __init__(self, camera, window: int):
+        self.camera = camera
+        self.state = UNKNOWN
+        self.since = time.time()
+        self.interval = None
+        self.stable = 0
+        self.failures = 0
+        self.probes = 0
+        self.errors = 0
+        self.last_probe = None
+        self.last_error = None
+        self.latencies = collections.deque(maxlen=window)
+
+        url = urllib.parse.urlsplit(camera.cam_url)
+        self.host = url.hostname
+        self.https = url.scheme == 'https'
+        self.port = url.port or (443 if self.https else 80)
+        self.uri = (url.path.rstrip('/') or '') + _PROBE_PATH
+        auth = camera._session.auth
+        self.digest = _Digest(getattr(auth, 'username', ''), getattr(auth, 'password', ''))
+        adapter = camera._session.get_adapter(camera.cam_url)
+        self.fingerprint = getattr(adapter, 'fingerprint', None)
+        self.verify = getattr(adapter, 'verify', False)
+        # kept-alive (reader, writer) of the previous probe
+        self.connection = None
+
+    def close(self):
+        if self.connection is not None:
+            self.connection[1].close()
+            self.connection = None
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def stats(self) -> dict:
+        return {'state': self.state, 'since': self.since, 'interval': self.interval,
+                'probes': self.probes, 'errors': self.errors, 'last_error': self.last_error,
+                'p50': self.percentile(0.5), 'p95': self.percentile(0.95),
+                'p99': self.percentile(0.99)}
+
+
+class HealthMonitor:
+    """
+    Probes many cameras and publishes their up, degraded and down transitions.
+
+    A camera is 'up' when it answers the probe with 200 in time, 'degraded' when it answers with
+    another status (wrong credentials, overloaded web server) or its median latency exceeds
+    ``degraded_latency``, and 'down' after ``failures`` probes in a row without an answer.
+
+    Args:
+        cameras: list of :class:`axis_vapix.Camera`
+        min_interval: probe interval after a change, in seconds
+        max_interval: longest probe interval of a stable camera, in seconds
+        down_interval: longest probe interval of a down or degraded camera, in seconds
+        growth: interval factor for every probe that finds the same state
+        timeout: time allowed for one probe, connecting included, in seconds
+        max_sockets: open sockets, of the probes running and the idle kept connections; the
+            least recently used idle connection is closed when a probe needs a new one
+        keep_alive: keep the connection to the cameras open between probes; cameras closing
+            idle connections early, or more cameras than ``max_sockets``, cost reconnections
+        degraded_latency: median latency above which a camera is degraded, in seconds
+        failures: probes in a row without answer before a camera is down
+        window: latencies kept per camera for the percentiles
+        on_event: optional callable receiving every :class:`HealthEvent`, called on the loop
+
+    Example:
+        monitor = HealthMonitor(cameras, on_event=print)
+        monitor.start()        # background thread, or: asyncio.run(monitor.run())
+        ...
+        monitor.stats()
+        monitor.stop()
+    """
+
+    def __init__(self, cameras, *, min_interval: float = 5.0, max_interval: float = 120.0,
+                 down_interval: float = 30.0, growth: float = 1.5, timeout: float = 3.0,
+                 max_sockets: int = 256, degraded_latency: float = 1.0, failures: int = 2,
+                 window: int = 100, keep_alive: bool = True, on_event=None):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.down_interval = down_interval
+        self.growth = growth
+        self.timeout = timeout
+        self.max_sockets = max_sockets
+        self.degraded_latency = degraded_latency
+        self.failures = failures
+        self.keep_alive = keep_alive
+        self.on_event = on_event
+        self._health = {camera.ip: CameraHealth(camera, window) for camera in cameras}
+        self._events = None
+        self._loop = None
+        self._stopping = None
+        self._thread = None
+        self._ssl_contexts = {}
+        # cameras with an idle kept connection, least recently used first
+        self._idle = collections.OrderedDict()
+        self._active = 0
+
+    def _ssl_context(self, health: CameraHealth) -> ssl.SSLContext:
+        key = health.verify
+        context = self._ssl_contexts.get(key)
+        if context is None:
+            if key is False:
+                context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            else:
+                context = ssl.create_default_context(cafile=None if key is True else key)
+            self._ssl_contexts[key] = context
+        return context
+
+    async def _connect(self, health: CameraHealth):
+        ssl_context = self._ssl_context(health) if health.https else None
+        reader, writer = await asyncio.open_connection(
+            health.host, health.port, ssl=ssl_context,
+            server_hostname=health.host if ssl_context else None)
+        if health.fingerprint:
+            der = writer.get_extra_info('ssl_object').getpeercert(binary_form=True)
+            if hashlib.sha256(der).hexdigest() != health.fingerprint:
+                writer.close()
+                raise ssl.SSLError('certificate does not match the pinned fingerprint')
+        return reader, writer
+
+    def _evict(self):
+        """
+        Close the least recently used idle connections until a new socket fits in
+        ``max_sockets``.
+        """
+        while self._idle and len(self._idle) + self._active > self.max_sockets:
+            oldest, _ = self._idle.popitem(last=False)
+            oldest.close()
+
+    async def _exchange(self, health: CameraHealth) -> tuple:
+        """
+        Send the probe once over the kept connection, or a new one, and read the answer.
+        """
+        connection = health.connection
+        health.connection = None
+        self._idle.pop(health, None)
+        reused = connection is not None and not connection[0].at_eof() and \
+            not connection[1].is_closing()
+        if not reused:
+            if connection is not None:
+                connection[1].close()
+            self._evict()
+            connection = await self._connect(health)
+        reader, writer = connection
+        request = f'GET {health.uri} HTTP/1.1\r\nHost: {health.host}\r\n'
+        if not self.keep_alive:
+            request += 'Connection: close\r\n'
+        authorization = health.digest.header('GET', health.uri)
+        if authorization:
+            request += f'Authorization: {authorization}\r\n'
+        try:
+            writer.write(request.encode('latin-1') + b'\r\n')
+            status, headers, _ = await _read_response(reader)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            writer.close()
+            if not reused:
+                raise
+            # the camera closed the idle connection meanwhile: once more on a new one
+            reader, writer = connection = await self._connect(health)
+            try:
+                writer.write(request.encode('latin-1') + b'\r\n')
+                status, headers, _ = await _read_response(reader)
+            except BaseException:
+                writer.close()
+                raise
+        except BaseException:
+            writer.close()
+            raise
+        if self.keep_alive and headers.get('connection', '').lower() != 'close' and \
+                ('content-length' in headers or 'transfer-encoding' in headers):
+            health.connection = connection
+            self._idle[health] = None
+        else:
+            writer.close()
+        return status, headers
+
+    async def _request(self, health: CameraHealth) -> int:
+        """
+        Send the probe and return the status code. A 401 with a challenge, for the first probe
+        or a stale nonce, is answered once.
+        """
+        for _ in range(2):
+            status, headers = await self._exchange(health)
+            if status != 401 or 'www-authenticate' not in headers:
+                break
+            health.digest.set_challenge(headers['www-authenticate'])
+        return status
+
+    async def probe(self, health: CameraHealth, semaphore: asyncio.Semaphore):
+        """
+        Probe one camera and update its state.
+        """
+        async with semaphore:
+            self._active += 1
+            start = time.monotonic()
+            try:
+                status = await asyncio.wait_for(self._request(health), self.timeout)
+                error = None if status == 200 else f'HTTP {status}'
+            except (OSError, asyncio.TimeoutError, ValueError, IndexError,
+                    asyncio.IncompleteReadError) as err:
+                status, error = None, str(err) or type(err).__name__
+            finally:
+                self._active -= 1
+            latency = time.monotonic() - start
+
+        health.probes += 1
+        health.last_probe = time.time()
+        if status is None:
+            health.errors += 1
+            health.failures += 1
+            health.last_error = error
+            state = DOWN if health.failures >= self.failures else health.state
+        else:
+            health.failures = 0
+            health.latencies.append(latency)
+            recent = sorted(list(health.latencies)[-5:])
+            slow = recent[len(recent) // 2] > self.degraded_latency
+            if error:
+                health.errors += 1
+                health.last_error = error
+            state = DEGRADED if error or slow else UP
+            if slow and not error:
+                error = f'median latency {recent[len(recent) // 2]:.3f} s'
+
+        if state != health.state:
+            event = HealthEvent(health.camera.ip, state, health.state, time.time(),
+                                latency if status is not None else None, error)
+            health.state = state
+            health.since = event.timestamp
+            health.stable = 0
+            self._publish(event)
+        else:
+            health.stable += 1
+
+        cap = self.max_interval if health.state == UP else self.down_interval
+        health.interval = min(cap, self.min_interval * self.growth ** health.stable)
+        return health.interval * random.uniform(0.9, 1.1)
+
+    def _publish(self, event: HealthEvent):
+        _log.info('%s is %s (was %s): %s', event.camera, event.state, event.previous,
+                  event.reason)
+        if self._events is not None:
+            if self._events.full():
+                self._events.get_nowait()
+            self._events.put_nowait(event)
+        if self.on_event is not None:
+            try:
+                self.on_event(event)
+            except Exception:  # pylint: disable=broad-except
+                _log.exception('Health event handler failed')
+
+    async def events(self):
+        """
+        Asynchronous iterator of the :class:`HealthEvent`, while :meth:`run` runs.
+        """
+        while self._events is None:
+            await asyncio.sleep(0.05)
+        while True:
+            yield await self._events.get()
+
+    async def run(self):
+        """
+        Probe until :meth:`stop` is called.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        self._events = asyncio.Queue(maxsize=10000)
+        semaphore = asyncio.Semaphore(self.max_sockets)
+        healths = list(self._health.values())
+        now = time.monotonic()
+        # spread the first probes evenly over the shortest interval
+        due = [(now + index * self.min_interval / max(1, len(healths)), index)
+               for index in range(len(healths))]
+        heapq.heapify(due)
+        running = set()
+
+        async def probe(index):
+            delay = await self.probe(healths[index], semaphore)
+            heapq.heappush(due, (time.monotonic() + delay, index))
+
+        try:
+            while not self._stopping.is_set():
+                wait = due[0][0] - time.monotonic() if due else self.min_interval
+                if wait > 0:
+                    try:
+                        await asyncio.wait_for(self._stopping.wait(), min(wait, 1.0))
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                _, index = heapq.heappop(due)
+                task = asyncio.ensure_future(probe(index))
+                running.add(task)
+                task.add_done_callback(running.discard)
+        finally:
+            for task in list(running):
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+            for health in healths:
+                health.close()
+            self._idle.clear()
+
+    def start(self):
+        """
+        Run the monitor on its own event loop in a background thread.
+        """
+        ready = threading.Event()
+
+        def main():
+            async def run():
+                ready.set()
+                await self.run()
+            asyncio.run(run())
+
+        self._thread = threading.Thread(target=main, name='health-monitor', daemon=True)
+        self._thread.start()
+        ready.wait()
+
+    def stop(self, timeout: float = None):
+        """
+        Stop probing, from any thread.
+        """
+        while self._stopping is None and self._thread is not None and self._thread.is_alive():
+            time.sleep(0.01)
+        if self._loop is not None and self._stopping is not None:
+            self._loop.call_soon_threadsafe(self._stopping.set)
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def state(self, camera) -> str:
+        return self._health[camera.ip].state
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            Dictionary camera address -> state, interval, probe and error counts, last error and
+            p50, p95 and p99 latency in seconds.
+        """
+        return {ip: health.stats() for ip, health in self._health.items()}
+
+    def summary(self) -> dict:
+        """
+        Returns:
+            Dictionary state -> number of cameras.
+        """
+        return dict(collections.Counter(health.state for health in self._health.values()))
@@ -0,0 +1,368 @@
+"""
+Command-to-motion latency profiles of PTZ cameras.
+
+A PTZ command returns when the camera has accepted it, not when the head moves. How long the
+head then takes to start, to arrive and how far it swings past the target differs between models
+and firmware versions, and control code aiming at moving objects has to lead by that much.
+
+:class:`LatencyProfiler` runs a script of moves on a camera and samples the position after each
+command as fast as the camera answers, through the one kept-alive connection of the camera.
+Every sample is stamped at the middle of its request, the best estimate of when the camera read
+its position. Per move and axis it measures:
+
+* ack: time for the command request to return
+* onset: from the command returning to the first sample off the start position
+* settle: from the command returning to the first sample after which the position stays within
+  the tolerance of where it comes to rest
+* overshoot: how far the head went past where it came to rest, in the direction of the move;
+  for continuous moves how far it coasted after the stop command returned
+
+The medians per axis form a :class:`LatencyProfile`, written as one JSON file per model and
+firmware, which control code loads with :meth:`LatencyProfile.for_camera` to compensate.
+"""
+import os
+import re
+import json
+import time
+import logging
+import statistics
+from typing import NamedTuple, Optional
+
+_log = logging.getLogger(__name__)
+
+AXES = ('pan', 'tilt', 'zoom')
+
+# smallest change counted as motion, in degrees for pan and tilt and in zoom units
+_THRESHOLDS = {'pan': 0.05, 'tilt': 0.05, 'zoom': 5.0}
+
+# default script: absolute steps of growing size per axis, then continuous moves with a stop
+DEFAULT_SCRIPT = (
+    ('absolute', 'pan', 10.0), ('absolute', 'pan', 45.0), ('absolute', 'pan', 90.0),
+    ('absolute', 'tilt', 10.0), ('absolute', 'tilt', 30.0),
+    ('absolute', 'zoom', 1000.0), ('absolute', 'zoom', 5000.0),
+    ('continuous', 'pan', 50), ('continuous', 'tilt', 50), ('continuous', 'zoom', 50),
+)
+
+
+def _difference(axis: str, a: float, b: float) -> float:
+    if axis == 'pan':
+        return (a - b + 180) % 360 - 180
+    return a - b
+
+
+def _target(axis: str, current: float, step: float) -> float:
+    """
+    Position ``step`` away from ``current``, the other way when that is out of range.
+    """
+    if axis == 'pan':
+        return (current + step + 180) % 360 - 180
+    low, high = (-90.0, 0.0) if axis == 'tilt' else (1.0, 9999.0)
+    target = current + step
+    if not low <= target <= high:
+        target = current - step
+    return min(high, max(low, target))
+
+
+class MoveResult(NamedTuple):
+    """
+    Latencies of one scripted move, in seconds, and overshoot in degrees or zoom units.
+    ``onset`` and ``settle`` are None when the head did not move.
+    """
+    kind: str
+    axis: str
+    start: float
+    target: Optional[float]
+    end: float
+    ack: float
+    onset: Optional[float]
+    settle: Optional[float]
+    overshoot: float
+    samples: int
+
+
+class AxisLatency(NamedTuple):
+    """
+    Median latencies of one axis and kind of move over the moves of a profile run.
+    """
+    ack: float
+    onset: Optional[float]
+    settle: Optional[float]
+    overshoot: float
+    moves: int
+
+
+def _median(values):
+    values = [value for value in values if value is not None]
+    return statistics.median(values) if values else None
+
+
+class LatencyProfile:
+    """
+    Latencies of one camera model and firmware.
+
+    Args:
+        model: product name, like 'AXIS Q6155-E'
+        firmware: firmware version
+        latencies: dictionary '<kind>.<axis>', like 'absolute.pan', -> :class:`AxisLatency`
+        moves: the :class:`MoveResult` measured
+    """
+
+    def __init__(self, model: str, firmware: str, latencies: dict, moves=()):
+        self.model = model
+        self.firmware = firmware
+        self.latencies = latencies
+        self.moves = list(moves)
+
+    @classmethod
+    def from_moves(cls, model: str, firmware: str, moves):
+        moves = list(moves)
+        groups = {}
+        for move in moves:
+            groups.setdefault(f'{move.kind}.{move.axis}', []).append(move)
+        latencies = {key: AxisLatency(_median(m.ack for m in group),
+                                      _median(m.onset for m in group),
+                                      _median(m.settle for m in group),
+                                      _median(m.overshoot for m in group), len(group))
+                     for key, group in groups.items()}
+        return cls(model, firmware, latencies, moves)
+
+    def get(self, axis: str, kind: str = 'absolute') -> Optional[AxisLatency]:
+        return self.latencies.get(f'{kind}.{axis}')
+
+    def lead(self, axis: str, kind: str = 'continuous') -> float:
+        """
+        Time from sending a command until the head moves: what a tracker has to aim ahead by.
+        """
+        latency = self.get(axis, kind)
+        if latency is None:
+            return 0.0
+        return latency.ack + (latency.onset or 0.0)
+
+    @staticmethod
+    def filename(model: str, firmware: str) -> str:
+        return re.sub(r'[^\w.-]+', '_', f'{model}_{firmware}').strip('_') + '.json'
+
+    def save(self, directory: str) -> str:
+        """
+        Write the profile into a directory of profiles.
+
+        Returns:
+            Path of the file.
+        """
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, self.filename(self.model, self.firmware))
+        content = {'model': self.model, 'firmware': self.firmware, 'created': time.time(),
+                   'latencies': {key: value._asdict() for key, value in self.latencies.items()},
+                   'moves': [move._asdict() for move in self.moves]}
+        with open(path + '.part', 'w') as var:
+            json.dump(content, var, indent=1)
+        os.replace(path + '.part', path)
+        return path
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path) as var:
+            content = json.load(var)
+        return cls(content['model'], content['firmware'],
+                   {key: AxisLatency(**value) for key, value in content['latencies'].items()},
+                   [MoveResult(**move) for move in content.get('moves', ())])
+
+    @classmethod
+    def for_camera(cls, camera, directory: str):
+        """
+        The profile of the model and firmware of a camera from a directory of profiles, or None.
+        """
+        model, firmware = _identity(camera)
+        path = os.path.join(directory, cls.filename(model, firmware))
+        return cls.load(path) if os.path.exists(path) else None
+
+
+def _identity(camera) -> tuple:
+    return (camera.get_parameters('Brand.ProdFullName', only_value=True).strip(),
+            camera.get_parameters('Properties.Firmware.Version', only_value=True).strip())
+
+
+class LatencyProfiler:
+    """
+    Measures the command-to-motion latencies of a PTZ camera.
+
+    Args:
+        camera: :class:`axis_vapix.Camera` with PTZ
+        rate: highest position sampling rate, in readings per second
+        quiet: a move has ended when the position did not change for this long, in seconds
+        timeout: longest observation of one move, in seconds
+        continuous_time: duration of the continuous moves, in seconds
+
+    Example:
+        profile = LatencyProfiler(camera).run()
+        profile.save('/etc/ptz-latency')
+        ...
+        profile = LatencyProfile.for_camera(camera, '/etc/ptz-latency')
+        lead = profile.lead('pan')
+    """
+
+    def __init__(self, camera, *, rate: float = 50.0, quiet: float = 0.5,
+                 timeout: float = 20.0, continuous_time: float = 1.0):
+        self.camera = camera
+        self.interval = 1.0 / rate
+        self.quiet = quiet
+        self.timeout = timeout
+        self.continuous_time = continuous_time
+
+    def _sample(self):
+        """
+        Returns:
+            Time the camera read its position, estimated as the middle of the request, and the
+            position as dictionary axis -> value, or None.
+        """
+        sent = time.monotonic()
+        status = self.camera.get_status()
+        received = time.monotonic()
+        try:
+            return (sent + received) / 2, {axis: float(status[axis]) for axis in AXES}
+        except (TypeError, KeyError, ValueError):
+            return (sent + received) / 2, None
+
+    def _observe(self, until: float = None, origin: dict = None) -> list:
+        """
+        Sample the position until ``until``, or without it until the position stopped changing
+        for ``quiet`` seconds. With ``origin``, the position before a commanded move, the quiet
+        time only counts once the position has left it, so a head starting later than
+        ``quiet`` is still observed, up to ``timeout``.
+        """
+        samples = []
+        changed = time.monotonic()
+        deadline = changed + self.timeout
+        left = origin is None
+        while True:
+            start = time.monotonic()
+            stamp, position = self._sample()
+            if position is not None:
+                if samples and position != samples[-1][1]:
+                    changed = stamp
+                if not left and any(abs(_difference(axis, position[axis], origin[axis])) >
+                                    _THRESHOLDS[axis] for axis in AXES):
+                    left = True
+                    changed = stamp
+                samples.append((stamp, position))
+            now = time.monotonic()
+            if now > deadline:
+                _log.warning('%s still moving after %.1f s', self.camera.ip, self.timeout)
+                break
+            if until is not None and now > until:
+                break
+            if until is None and left and now - changed > self.quiet and samples:
+                break
+            time.sleep(max(0.0, self.interval - (now - start)))
+        return samples
+
+    @staticmethod
+    def _analyze(axis: str, samples: list, origin: float, reference: float, start: float):
+        """
+        Onset, settle time and overshoot of one axis, relative to the time ``origin``.
+        """
+        threshold = _THRESHOLDS[axis]
+        values = [(stamp, position[axis]) for stamp, position in samples]
+        end = values[-1][1]
+        onset = next((stamp - origin for stamp, value in values
+                      if abs(_difference(axis, value, start)) > threshold), None)
+        settle = None
+        if onset is not None:
+            settle = values[-1][0] - origin
+            for stamp, value in reversed(values):
+                if abs(_difference(axis, value, end)) > threshold:
+                    break
+                settle = stamp - origin
+        direction = 1 if _difference(axis, end, reference) >= 0 else -1
+        overshoot = max([0.0] + [direction * _difference(axis, value, end)
+                                 for _, value in values])
+        return end, onset, settle, overshoot
+
+    def _position(self) -> dict:
+        _, position = self._sample()
+        if position is None:
+            raise RuntimeError(f'no PTZ position from {self.camera.ip}')
+        return position
+
+    def absolute(self, axis: str, step: float) -> MoveResult:
+        """
+        Move one axis by ``step`` with ``absolute_move`` and measure the move.
+        """
+        before = self._position()
+        target = _target(axis, before[axis], step)
+        arguments = {'pan': None, 'tilt': None, 'zoom': None,
+                     axis: int(round(target)) if axis == 'zoom' else target}
+        sent = time.monotonic()
+        self.camera.absolute_move(**arguments)
+        acknowledged = time.monotonic()
+        samples = self._observe(origin=before)
+        end, onset, settle, overshoot = self._analyze(axis, samples, acknowledged, before[axis],
+                                                      before[axis])
+        return MoveResult('absolute', axis, before[axis], target, end, acknowledged - sent,
+                          onset, settle, overshoot, len(samples))
+
+    def continuous(self, axis: str, speed: int) -> MoveResult:
+        """
+        Move one axis with ``continuous_move`` for ``continuous_time``, stop it, and measure the
+        start of the motion and the coasting after the stop.
+        """
+        before = self._position()
+        if axis == 'tilt' and before['tilt'] > -45:
+            speed = -speed
+        if axis == 'zoom' and before['zoom'] > 5000:
+            speed = -speed
+        arguments = {'pan': 0, 'tilt': 0, 'zoom': 0, axis: speed}
+
+        sent = time.monotonic()
+        self.camera.continuous_move(**arguments)
+        acknowledged = time.monotonic()
+        ack = acknowledged - sent
+        running = self._observe(until=acknowledged + self.continuous_time)
+        stopping = time.monotonic()
+        self.camera.stop_move()
+        stopped = time.monotonic()
+        coasting = self._observe()
+
+        onset = self._analyze(axis, running, acknowledged, before[axis], before[axis])[1]
+        at_stop = running[-1][1][axis] if running else before[axis]
+        end, _, settle, _ = self._analyze(axis, coasting, stopped, at_stop, at_stop)
+        # coasting is the way from the last position read before the stop to the resting place
+        overshoot = abs(_difference(axis, end, at_stop))
+        # ack is the mean of the move and the stop command
+        return MoveResult('continuous', axis, before[axis], None, end,
+                          (ack + stopped - stopping) / 2, onset, settle, overshoot,
+                          len(running) + len(coasting))
+
+    def run(self, script=DEFAULT_SCRIPT, *, repeat: int = 3, progress=None) -> LatencyProfile:
+        """
+        Run a script of moves and build the profile. The camera returns to its position
+        afterwards.
+
+        Args:
+            script: iterable of ('absolute', axis, step) and ('continuous', axis, speed)
+            repeat: runs of the script; each absolute step is made forth and back
+            progress: optional callable receiving every :class:`MoveResult`
+
+        Returns:
+            :class:`LatencyProfile` of the model and firmware of the camera.
+        """
+        model, firmware = _identity(self.camera)
+        home = self._position()
+        moves = []
+        try:
+            for _ in range(repeat):
+                for kind, axis, value in script:
+                    if kind == 'absolute':
+                        results = [self.absolute(axis, value), self.absolute(axis, -value)]
+                    elif kind == 'continuous':
+                        results = [self.continuous(axis, value)]
+                    else:
+                        raise ValueError(f'unknown move {kind!r}')
+                    for result in results:
+                        _log.debug('%s: %s', self.camera.ip, result)
+                        if progress is not None:
+                            progress(result)
+                    moves += results
+        finally:
+            self.camera.absolute_move(home['pan'], home['tilt'], int(home['zoom']))
+        return LatencyProfile.from_moves(model, firmware, moves)
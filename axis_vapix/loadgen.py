@@ -0,0 +1,352 @@
+"""
+Load generation against cameras, real or replayed.
+
+:class:`LoadGenerator` drives a mix of workloads through the sessions of many cameras with a
+fixed number of workers, for a duration, optionally paced to a target rate:
+
+* status: :meth:`Camera.get_status`, as a status poller calls it
+* snapshot: bursts of :meth:`Camera.get_jpeg_request` on one camera, the images not saved
+* ptz: :meth:`Camera.continuous_move` at joystick rate, the speed following a slow sine
+* config: ``param.cgi`` updates of one parameter through ``Camera._command``, the path of the
+  ``set_`` methods
+
+The workloads go through the camera methods, so the overhead of the library and the filtering of
+a PTZ state cache count in the latency. Every request is measured on its own. With a target rate the requests are scheduled at fixed
+times and the latency counts from the scheduled time, so a saturated camera or client shows as
+latency instead of silently lowering the rate. The report gives throughput, latency percentiles
+and errors by kind per workload, to size control servers before a deployment.
+
+Installed as the ``axis-vapix-load`` command:
+
+    axis-vapix-load --hosts 10.0.0.5 10.0.0.6 --user root --password pass \\
+        --workload status:4 snapshot:1 ptz:2 --concurrency 32 --rate 200 --duration 60
+
+Against a traffic recording of :mod:`axis_vapix.traffic` instead of the cameras, add
+``--replay site12.vapix.gz --speed 1``.
+"""
+import sys
+import json
+import math
+import time
+import re
+import random
+import logging
+import argparse
+import itertools
+import threading
+import collections
+from typing import NamedTuple, Optional
+
+import requests
+
+_log = logging.getLogger(__name__)
+
+WORKLOADS = ('status', 'snapshot', 'ptz', 'config')
+# the camera methods answer a failure with the string of the response and its body
+_FAILURE = re.compile(r'<Response \[(\d+)\]>')
+
+
+class WorkloadReport(NamedTuple):
+    """
+    Results of one workload. Latencies in seconds, throughput in requests per second.
+    """
+    workload: str
+    requests: int
+    ok: int
+    throughput: float
+    p50: float
+    p90: float
+    p99: float
+    max: float
+    errors: dict
+
+
+class _Discard:
+    """
+    Gate of :meth:`Camera.get_jpeg_request` refusing every image, so snapshots are not saved.
+    """
+
+    @staticmethod
+    def accept(ip, content) -> bool:
+        return False
+
+
+def _error(result) -> Optional[str]:
+    """
+    Kind of error of the value returned by a camera method, None for a success.
+    """
+    if result is None:
+        return 'no answer'
+    if isinstance(result, requests.Response):
+        if result.status_code not in (200, 204):
+            return f'HTTP {result.status_code}'
+        if result.headers.get('Content-Type', '').startswith('text/') and \
+                'error' in result.text[:200].lower():
+            return 'error answer'
+    elif isinstance(result, str):
+        match = _FAILURE.match(result)
+        if match:
+            return f'HTTP {match.group(1)}'
+    return None
+
+
+def _percentile(ordered: list, fraction: float) -> float:
+    if not ordered:
+        return float('nan')
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class LoadGenerator:
+    """
+    Runs a mix of workloads against cameras and measures every request.
+
+    Args:
+        cameras: list of :class:`axis_vapix.Camera`
+        workloads: dictionary workload name -> weight, e.g. {'status': 4, 'ptz': 1}
+        concurrency: requests running at the same time
+        rate: target operations per second over all cameras, None for as fast as possible
+        burst: snapshots per snapshot operation
+        resolution: resolution of the snapshots, the default of the camera when None
+        parameter: parameter written by the config workload
+        seed: seed of the workload and camera choice, for repeatable runs
+
+    Example:
+        generator = LoadGenerator(cameras, {'status': 4, 'ptz': 1}, concurrency=32, rate=100)
+        reports = generator.run(60)
+        print(format_report(reports, 60))
+    """
+
+    def __init__(self, cameras, workloads: dict, *, concurrency: int = 16, rate: float = None,
+                 burst: int = 5, resolution: str = None,
+                 parameter: str = 'Image.I0.Text.String', seed: int = None):
+        unknown = set(workloads) - set(WORKLOADS)
+        if unknown:
+            raise ValueError(f'unknown workloads {sorted(unknown)}, choose from {WORKLOADS}')
+        self.cameras = list(cameras)
+        if not self.cameras:
+            raise ValueError('no cameras')
+        self.workloads = dict(workloads)
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst
+        self.resolution = resolution
+        self.parameter = parameter
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._latencies = collections.defaultdict(list)
+        self._errors = collections.defaultdict(collections.Counter)
+        self._counter = itertools.count()
+        self._moving = set()
+        self.operations = 0
+
+    def _requests(self, workload: str, camera, step: int):
+        """
+        The requests of one operation, as callables returning what the camera method returns.
+        """
+        if workload == 'status':
+            return [camera.get_status]
+        if workload == 'snapshot':
+            return [lambda: camera.get_jpeg_request(self.resolution, gate=_Discard)] * self.burst
+        if workload == 'ptz':
+            phase = time.monotonic() / 4
+            pan, tilt = int(50 * math.sin(phase)), int(30 * math.cos(phase))
+            with self._lock:
+                self._moving.add(camera)
+            return [lambda: camera.continuous_move(pan, tilt)]
+        return [lambda: camera._command(camera.cam_url + '/axis-cgi/param.cgi', {
+            'action': 'update', self.parameter: f'load {step}'})]
+
+    def _measure(self, workload: str, request, scheduled: float):
+        start = time.monotonic() if scheduled is None else scheduled
+        try:
+            error = _error(request())
+        except requests.RequestException as err:
+            error = type(err).__name__
+        except SystemExit:
+            # Camera._command exits when the credentials are refused
+            error = 'HTTP 401'
+        latency = time.monotonic() - start
+        with self._lock:
+            self._latencies[workload].append(latency)
+            if error:
+                self._errors[workload][error] += 1
+
+    def _worker(self, deadline: float, names: list, weights: list, begin: float):
+        while True:
+            with self._lock:
+                step = next(self._counter)
+                workload = self._random.choices(names, weights)[0]
+            scheduled = None
+            if self.rate:
+                scheduled = begin + step / self.rate
+                if scheduled >= deadline:
+                    return
+                time.sleep(max(0.0, scheduled - time.monotonic()))
+            elif time.monotonic() >= deadline:
+                return
+            camera = self.cameras[step % len(self.cameras)]
+            for index, request in enumerate(self._requests(workload, camera, step)):
+                # only the first request of a burst waited for its schedule
+                self._measure(workload, request, scheduled if index == 0 else None)
+            with self._lock:
+                self.operations += 1
+
+    def run(self, duration: float, *, progress=None, interval: float = 5.0) -> dict:
+        """
+        Run the workloads.
+
+        Args:
+            duration: seconds
+            progress: optional callable receiving the number of requests and the seconds
+                elapsed every ``interval`` seconds
+            interval: seconds between progress calls
+
+        Returns:
+            Dictionary workload -> :class:`WorkloadReport`.
+        """
+        names = list(self.workloads)
+        weights = [self.workloads[name] for name in names]
+        begin = time.monotonic()
+        deadline = begin + duration
+        threads = [threading.Thread(target=self._worker, args=(deadline, names, weights, begin),
+                                    name=f'load-{index}', daemon=True)
+                   for index in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        while any(thread.is_alive() for thread in threads):
+            time.sleep(min(interval, max(0.01, deadline - time.monotonic())))
+            if progress is not None and time.monotonic() < deadline:
+                with self._lock:
+                    count = sum(len(values) for values in self._latencies.values())
+                progress(count, time.monotonic() - begin)
+        elapsed = time.monotonic() - begin
+        self._stop_moving()
+        return self.report(elapsed)
+
+    def _stop_moving(self):
+        for camera in self._moving:
+            try:
+                camera.stop_move()
+            except requests.RequestException as err:
+                _log.warning('Could not stop %s: %s', camera.ip, err)
+            except SystemExit:
+                _log.warning('Could not stop %s: credentials refused', camera.ip)
+        self._moving.clear()
+
+    def report(self, elapsed: float) -> dict:
+        """
+        Dictionary workload -> :class:`WorkloadReport` of the requests measured so far.
+        """
+        reports = {}
+        with self._lock:
+            for workload in self.workloads:
+                latencies = sorted(self._latencies.get(workload, ()))
+                errors = dict(self._errors.get(workload, {}))
+                reports[workload] = WorkloadReport(
+                    workload, len(latencies), len(latencies) - sum(errors.values()),
+                    len(latencies) / elapsed if elapsed else 0.0, _percentile(latencies, 0.5),
+                    _percentile(latencies, 0.9), _percentile(latencies, 0.99),
+                    latencies[-1] if latencies else float('nan'), errors)
+        return reports
+
+
+def format_report(reports: dict, elapsed: float) -> str:
+    """
+    The reports as a table, latencies in milliseconds.
+    """
+    lines = [f'{"workload":10} {"requests":>9} {"ok":>9} {"req/s":>9} {"p50":>8} {"p90":>8} '
+             f'{"p99":>8} {"max":>8}  errors']
+    for report in reports.values():
+        errors = ', '.join(f'{kind}: {count}' for kind, count in
+                           sorted(report.errors.items(), key=lambda item: -item[1]))
+        lines.append(f'{report.workload:10} {report.requests:9d} {report.ok:9d} '
+                     f'{report.throughput:9.1f} {report.p50 * 1000:8.1f} '
+                     f'{report.p90 * 1000:8.1f} {report.p99 * 1000:8.1f} '
+                     f'{report.max * 1000:8.1f}  {errors or "-"}')
+    total = sum(report.requests for report in reports.values())
+    lines.append(f'{total} requests in {elapsed:.1f} s, {total / elapsed:.1f} req/s')
+    return '\n'.join(lines)
+
+
+def _workloads(specs) -> dict:
+    workloads = {}
+    for spec in specs:
+        name, _, weight = spec.partition(':')
+        workloads[name] = float(weight) if weight else 1.0
+    return workloads
+
+
+def main(argv=None):
+    """
+    Entry point of the ``axis-vapix-load`` command.
+    """
+    parser = argparse.ArgumentParser(
+        prog='axis-vapix-load', description='Generate VAPIX load against cameras and report '
+                                            'throughput, latency percentiles and errors')
+    targets = parser.add_mutually_exclusive_group(required=True)
+    targets.add_argument('--hosts', nargs='+', help='camera addresses')
+    targets.add_argument('--inventory', help='inventory file of axis_vapix.discovery')
+    parser.add_argument('--user', default='root')
+    parser.add_argument('--password', default='')
+    parser.add_argument('--scheme', default='http', choices=('http', 'https'))
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--workload', nargs='+', default=['status'],
+                        help=f'workloads with optional weights, like status:4 ptz:1; '
+                             f'choose from {", ".join(WORKLOADS)}')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--rate', type=float, help='target operations per second, all cameras')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds')
+    parser.add_argument('--burst', type=int, default=5, help='snapshots per snapshot operation')
+    parser.add_argument('--resolution')
+    parser.add_argument('--parameter', default='Image.I0.Text.String',
+                        help='parameter written by the config workload')
+    parser.add_argument('--timeout', type=float, default=10.0)
+    parser.add_argument('--replay', help='serve the cameras from a traffic recording')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='replay speed, 0 answers without the recorded latency')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    parser.add_argument('--quiet', action='store_true', help='no progress lines')
+    args = parser.parse_args(argv)
+
+    from .axis_camera import Camera
+    from .discovery import AXIS, UNAUTHORIZED, load_inventory
+    from .traffic import replay
+    from .transport import resize_pool
+
+    if args.inventory:
+        cameras = [device.camera(args.user, args.password, timeout=args.timeout)
+                   for device in load_inventory(args.inventory) if device.status in (AXIS, UNAUTHORIZED)]
+    else:
+        cameras = [Camera(host, args.user, args.password, scheme=args.scheme, port=args.port,
+                          timeout=args.timeout) for host in args.hosts]
+    for camera in cameras:
+        # one kept-alive connection per worker that may use the camera at the same time
+        resize_pool(camera._session, camera.cam_url, min(args.concurrency, 64))
+    if args.replay:
+        replay(cameras, args.replay, speed=args.speed)
+
+    generator = LoadGenerator(cameras, _workloads(args.workload),
+                              concurrency=args.concurrency, rate=args.rate, burst=args.burst,
+                              resolution=args.resolution, parameter=args.parameter,
+                              seed=args.seed)
+
+    def progress(count, elapsed):
+        print(f'{elapsed:6.1f} s  {count} requests  {count / elapsed:.1f} req/s',
+              file=sys.stderr)
+
+    start = time.monotonic()
+    reports = generator.run(args.duration, progress=None if args.quiet else progress)
+    elapsed = time.monotonic() - start
+    if args.json:
+        print(json.dumps({'elapsed': elapsed,
+                          'workloads': {name: report._asdict()
+                                        for name, report in reports.items()}}, indent=1))
+    else:
+        print(format_report(reports, elapsed))
+    failed = sum(report.requests - report.ok for report in reports.values())
+    return 1 if failed and failed == sum(report.requests for report in reports.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
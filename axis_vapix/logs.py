@@ -0,0 +1,321 @@
+"""
+Incremental tail of the system and access logs of cameras.
+
+``systemlog.cgi`` and ``accesslog.cgi`` always return the whole log. :class:`LogTailer` streams the
+body line by line and keeps a cursor per camera and log: the timestamp of the newest line seen and,
+per hash, how many identical lines carry that timestamp. A line is new when it is younger than the
+cursor, or has the cursor timestamp and occurs more often in the log than the cursor counted, so
+an event repeated within one second is emitted once per occurrence. This needs no buffering,
+survives log rotation (rotated lines are simply older) and never emits a line twice.
+"""
+import re
+import os
+import json
+import zlib
+import logging
+import datetime
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional
+
+import requests
+
+_log = logging.getLogger(__name__)
+
+SYSTEM_LOG = 'system'
+ACCESS_LOG = 'access'
+_LOG_PATHS = {SYSTEM_LOG: '/axis-cgi/systemlog.cgi', ACCESS_LOG: '/axis-cgi/accesslog.cgi'}
+
+# 2024-03-01T10:00:01.123+01:00 axis-accc8e012345 [ INFO    ] httpd[123]: message
+_ISO_LINE = re.compile(
+    r'^(?P<ts>\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d(?:\.\d+)?(?:Z|[+-]\d\d:?\d\d)?)\s+(?P<host>\S+)\s+'
+    r'(?:\[\s*(?P<level>\w+)\s*\]\s+)?(?P<process>[^\s\[:]+)(?:\[(?P<pid>\d+)\])?:\s?(?P<msg>.*)$')
+# Mar  1 10:00:01 axis-accc8e012345 httpd[123]: message
+_SYSLOG_LINE = re.compile(
+    r'^(?P<ts>[A-Z][a-z]{2}\s+\d+\s\d\d:\d\d:\d\d)\s+(?P<host>\S+)\s+'
+    r'(?:\[\s*(?P<level>\w+)\s*\]\s+)?(?P<process>[^\s\[:]+)(?:\[(?P<pid>\d+)\])?:\s?(?P<msg>.*)$')
+
+
+class LogRecord(NamedTuple):
+    """
+    One parsed log line. Fields the line does not carry are None.
+    """
+    camera: str
+    source: str
+    timestamp: Optional[float]
+    host: Optional[str]
+    level: Optional[str]
+    process: Optional[str]
+    pid: Optional[int]
+    message: str
+    line: str
+
+
+def _iso_timestamp(text: str) -> float:
+    if text.endswith('Z'):
+        text = text[:-1] + '+00:00'
+    elif len(text) > 5 and text[-5] in '+-' and text[-3] != ':':
+        text = text[:-2] + ':' + text[-2:]
+    if '.' in text:
+        # fromisoformat of Python < 3.11 wants exactly 3 or 6 fraction digits
+        head, _, tail = text.partition('.')
+        digits = re.match(r'\d+', tail).group()
+        text = head + '.' + digits[:6].ljust(6, '0') + tail[len(digits):]
+    return datetime.datetime.fromisoformat(text).timestamp()
+
+
+def _syslog_timestamp(text: str) -> float:
+    now = datetime.datetime.now()
+    stamp = datetime.datetime.strptime(f'{now.year} {text}', '%Y %b %d %H:%M:%S')
+    if stamp - now > datetime.timedelta(days=1):
+        # the line is from last year
+        stamp = stamp.replace(year=now.year - 1)
+    return stamp.timestamp()
+
+
+def parse_log_line(line: str, camera: str = None, source: str = SYSTEM_LOG) -> LogRecord:
+    """
+    Parse one line of a system or access log.
+
+    Args:
+        line: log line without line break
+        camera: camera address stored in the record
+        source: 'system' or 'access'
+
+    Returns:
+        A :class:`LogRecord`, with only ``message`` and ``line`` set when the line has no known
+        format.
+    """
+    for pattern, to_timestamp in ((_ISO_LINE, _iso_timestamp), (_SYSLOG_LINE, _syslog_timestamp)):
+        match = pattern.match(line)
+        if match is None:
+            continue
+        try:
+            timestamp = to_timestamp(match.group('ts'))
+        except ValueError:
+            continue
+        pid = match.group('pid')
+        return LogRecord(camera, source, timestamp, match.group('host'), match.group('level'),
+                         match.group('process'), int(pid) if pid else None, match.group('msg'),
+                         line)
+    return LogRecord(camera, source, None, None, None, None, None, line, line)
+
+
+def _line_hash(line: str) -> int:
+    return zlib.crc32(line.encode('utf-8', 'replace'))
+
+
+class _Cursor:
+    __slots__ = ('timestamp', 'counts')
+
+    def __init__(self, timestamp: float = None, counts: dict = None):
+        self.timestamp = timestamp
+        # hash -> number of identical lines with the cursor timestamp already emitted
+        self.counts = dict(counts or {})
+
+    def copy(self):
+        return _Cursor(self.timestamp, self.counts)
+
+    def is_new(self, timestamp: float, digest: int, occurrence: int) -> bool:
+        """
+        ``occurrence`` numbers the identical lines with the same timestamp in one log, from 1.
+        """
+        if self.timestamp is None or timestamp > self.timestamp:
+            return True
+        return timestamp == self.timestamp and occurrence > self.counts.get(digest, 0)
+
+    def advance(self, timestamp: float, digest: int, occurrence: int):
+        if self.timestamp is None or timestamp > self.timestamp:
+            self.timestamp = timestamp
+            self.counts = {digest: occurrence}
+        elif timestamp == self.timestamp:
+            self.counts[digest] = max(self.counts.get(digest, 0), occurrence)
+
+
+class LogTailer:
+    """
+    Emits only the log lines of cameras that were not emitted before.
+
+    Args:
+        state_path: JSON file keeping the cursors between runs, None keeps them in memory only
+        source: 'system' for ``systemlog.cgi`` or 'access' for ``accesslog.cgi``
+        timeout: timeout of the log requests, in seconds
+
+    Example:
+        tailer = LogTailer('/var/lib/axis/log-cursors.json', source='access')
+        for record in tailer.tail(camera):
+            ship(record)
+        tailer.save()
+    """
+
+    def __init__(self, state_path: str = None, *, source: str = SYSTEM_LOG, timeout: float = 30.0):
+        if source not in _LOG_PATHS:
+            raise ValueError(f'source must be one of {tuple(_LOG_PATHS)}, not {source!r}')
+        self.state_path = state_path
+        self.source = source
+        self.timeout = timeout
+        self._cursors = {}
+        self._lock = threading.Lock()
+        if state_path is not None:
+            self.load()
+
+    def load(self):
+        """
+        Read the cursors from the state file, if it exists.
+        """
+        try:
+            with open(self.state_path, encoding='utf-8') as var:
+                content = json.load(var)
+        except FileNotFoundError:
+            return
+        cursors = {}
+        for key, value in content.get(self.source, {}).items():
+            if 'counts' in value:
+                counts = {int(digest): count for digest, count in value['counts'].items()}
+            else:
+                # state files of earlier versions kept each hash once
+                counts = dict.fromkeys(value.get('hashes', ()), 1)
+            cursors[key] = _Cursor(value['timestamp'], counts)
+        with self._lock:
+            self._cursors = cursors
+
+    def save(self):
+        """
+        Write the cursors to the state file, keeping the cursors of the other log source.
+        """
+        if self.state_path is None:
+            return
+        try:
+            with open(self.state_path, encoding='utf-8') as var:
+                content = json.load(var)
+        except FileNotFoundError:
+            content = {}
+        with self._lock:
+            content[self.source] = {key: {'timestamp': cursor.timestamp,
+                                          'counts': {str(digest): count for digest, count
+                                                     in sorted(cursor.counts.items())}}
+                                    for key, cursor in self._cursors.items()}
+        tmp = self.state_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as var:
+            json.dump(content, var)
+        os.replace(tmp, self.state_path)
+
+    def reset(self, camera=None):
+        """
+        Forget the cursor of one camera, or of all cameras, so the whole log is emitted again.
+        """
+        with self._lock:
+            if camera is None:
+                self._cursors.clear()
+            else:
+                self._cursors.pop(camera.ip, None)
+
+    def cursor(self, camera) -> Optional[float]:
+        """
+        Returns:
+            Timestamp of the newest line emitted for the camera, None if nothing was emitted.
+        """
+        cursor = self._cursors.get(camera.ip)
+        return None if cursor is None else cursor.timestamp
+
+    def tail(self, camera):
+        """
+        Download the log of a camera as a stream and yield the lines not emitted before. Lines
+        are compared with the cursor as it was before the download, so the order of the log does
+        not matter. The cursor moves with every yielded record, so with the oldest-first order of
+        the camera logs stopping early loses nothing.
+
+        Args:
+            camera: :class:`axis_vapix.Camera`
+
+        Returns:
+            Iterator of :class:`LogRecord`.
+        """
+        with self._lock:
+            cursor = self._cursors.setdefault(camera.ip, _Cursor())
+            start = cursor.copy()
+
+        resp = camera._session.get(camera.cam_url + _LOG_PATHS[self.source], stream=True,
+                                   timeout=self.timeout)
+        try:
+            if resp.status_code != 200:
+                _log.error('Could not read %s log of %s: %s', self.source, camera.ip,
+                           resp.status_code)
+                return
+
+            newest = None
+            # hash -> identical lines stamped ``newest``
+            at_newest = collections.Counter()
+            emitted = False
+            previous_new = False
+            occurrences = collections.Counter()
+            for raw in resp.iter_lines(chunk_size=16384):
+                if not raw:
+                    continue
+                line = raw.decode('utf-8', 'replace').rstrip('\r')
+                record = parse_log_line(line, camera.ip, self.source)
+                if record.timestamp is None:
+                    # continuation of a multi-line message goes with the line it continues
+                    if previous_new:
+                        yield record
+                    continue
+
+                digest = _line_hash(line)
+                if newest is None or record.timestamp > newest:
+                    newest = record.timestamp
+                    at_newest.clear()
+                if record.timestamp == newest:
+                    at_newest[digest] += 1
+                if start.timestamp is not None and record.timestamp < start.timestamp:
+                    previous_new = False
+                    continue
+                occurrences[record.timestamp, digest] += 1
+                occurrence = occurrences[record.timestamp, digest]
+                previous_new = start.is_new(record.timestamp, digest, occurrence)
+                if previous_new:
+                    with self._lock:
+                        cursor.advance(record.timestamp, digest, occurrence)
+                    emitted = True
+                    yield record
+
+            if not emitted and newest is not None and cursor.timestamp is not None and \
+                    newest < cursor.timestamp:
+                # the whole log is older than the cursor: the camera clock went back; the lines
+                # stamped with its newest time are taken as emitted, like on the normal path
+                _log.warning('%s log of %s is older than its cursor, the camera clock was '
+                             'probably set back; restarting after its newest line',
+                             self.source, camera.ip)
+                with self._lock:
+                    cursor.timestamp = newest
+                    cursor.counts = dict(at_newest)
+        finally:
+            resp.close()
+
+    def poll(self, camera) -> list:
+        """
+        Returns:
+            List of the new :class:`LogRecord` of a camera.
+        """
+        return list(self.tail(camera))
+
+    def poll_all(self, cameras, workers: int = 16) -> dict:
+        """
+        Poll many cameras concurrently.
+
+        Args:
+            cameras: list of :class:`axis_vapix.Camera`
+            workers: concurrent requests
+
+        Returns:
+            Dictionary camera -> list of new records, or the exception raised for that camera.
+        """
+        def poll(camera):
+            try:
+                return self.poll(camera)
+            except requests.RequestException as err:
+                _log.warning('Could not poll %s log of %s: %s', self.source, camera.ip, err)
+                return err
+
+        with ThreadPoolExecutor(workers) as executor:
+            return dict(zip(cameras, executor.map(poll, cameras)))
@@ -0,0 +1,270 @@
+"""
+High-frequency dynamic text overlay updates with coalescing.
+
+Telemetry burnt into the video changes faster than ``dynamicoverlay.cgi`` requests can follow.
+An :class:`OverlayUpdater` keeps only the latest pending text per video source of a camera and
+sends it from its own thread, never more often than ``max_rate`` requests per second; a text
+equal to the one the camera already shows is not sent at all. Producers never block on the
+network. A failed text is retried a few times with growing delays, then dropped until the next
+update of its source. An :class:`OverlayHub` runs one updater per camera so many cameras update concurrently.
+"""
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+import requests
+
+_log = logging.getLogger(__name__)
+
+_OVERLAY_PATH = '/axis-cgi/dynamicoverlay.cgi'
+
+
+class OverlayUpdater:
+    """
+    Sends the dynamic text overlays of one camera, coalescing updates to the latest value.
+
+    Args:
+        camera: :class:`axis_vapix.Camera`
+        max_rate: largest number of requests per second to the camera, for all sources together
+        timeout: timeout of the overlay requests, in seconds
+        retries: times a failed text is sent again before it is dropped
+        backoff: delay before the first retry, in seconds, doubled after every further failure
+            of the camera up to ``max_backoff``
+        max_backoff: longest delay between two failed requests, in seconds
+
+    Example:
+        with OverlayUpdater(camera, max_rate=4) as overlay:
+            for fix in gps:
+                overlay.update(f'{fix.speed:.0f} km/h')
+    """
+
+    def __init__(self, camera, *, max_rate: float = 5.0, timeout: float = 2.0, retries: int = 3,
+                 backoff: float = 0.5, max_backoff: float = 10.0):
+        self.camera = camera
+        self.max_rate = max_rate
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._pending = OrderedDict()
+        self._attempts = {}
+        self._failures = 0
+        self._shown = {}
+        self._inflight = None
+        self._cond = threading.Condition()
+        self._closed = False
+        self._next_send = 0.0
+        self.submitted = 0
+        self.coalesced = 0
+        self.skipped = 0
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name=f'overlay-{camera.ip}',
+                                        daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _current(self, source):
+        if self._inflight is not None and self._inflight[0] == source:
+            return self._inflight[1]
+        return self._shown.get(source)
+
+    def update(self, text: str, source: str = None):
+        """
+        Set the overlay text of a video source. Returns at once; the text replaces any text of the
+        same source that was not sent yet.
+
+        Args:
+            text: overlay text
+            source: video source as for :meth:`axis_vapix.Camera.set_dynamic_text_overlay`,
+                None for the default one
+        """
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('the overlay updater is closed')
+            self.submitted += 1
+            if source in self._pending:
+                self.coalesced += 1
+            if text == self._current(source):
+                self._pending.pop(source, None)
+                self.skipped += 1
+                self._cond.notify_all()
+                return
+            self._pending[source] = text
+            self._attempts.pop(source, None)
+            self._cond.notify_all()
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """
+        Wait until every pending text was sent or dropped after its retries.
+
+        Args:
+            timeout: longest wait in seconds, None to wait as long as the retries take
+
+        Returns:
+            False if the timeout expired first.
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and self._inflight is None,
+                                       timeout)
+
+    def _send(self, source, text: str) -> bool:
+        payload = {'action': 'settext', 'text': text, 'camera': source}
+        try:
+            resp = self.camera._session.get(self.camera.cam_url + _OVERLAY_PATH, params=payload,
+                                            timeout=self.timeout)
+        except requests.RequestException as err:
+            _log.warning('Overlay update of %s failed: %s', self.camera.ip, err)
+            return False
+        if resp.status_code != 200:
+            _log.warning('Overlay update of %s failed: %s', self.camera.ip, resp.status_code)
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                # wait for work, then for the rate limit, collecting newer texts meanwhile
+                self._cond.wait_for(lambda: self._pending or self._closed)
+                if not self._pending:
+                    return
+                delay = self._next_send - time.monotonic()
+                if delay > 0 and not self._closed:
+                    self._cond.wait(delay)
+                    continue
+                source, text = self._pending.popitem(last=False)
+                self._inflight = (source, text)
+
+            self._next_send = time.monotonic() + 1.0 / self.max_rate
+            ok = self._send(source, text)
+
+            with self._cond:
+                self._inflight = None
+                if ok:
+                    self.sent += 1
+                    self._shown[source] = text
+                    self._attempts.pop(source, None)
+                    self._failures = 0
+                else:
+                    self.failed += 1
+                    self._shown.pop(source, None)
+                    # back off while the camera keeps failing
+                    self._next_send = time.monotonic() + min(
+                        self.max_backoff, self.backoff * 2 ** self._failures)
+                    self._failures += 1
+                    attempts = self._attempts.get(source, 0) + 1
+                    if source in self._pending:
+                        # a newer text arrived meanwhile, it gets its own retries
+                        self.coalesced += 1
+                    elif attempts > self.retries or self._closed:
+                        self.dropped += 1
+                        self._attempts.pop(source, None)
+                        _log.error('Dropped overlay text of %s after %d attempts',
+                                   self.camera.ip, attempts)
+                    else:
+                        self._attempts[source] = attempts
+                        self._pending[source] = text
+                self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {'submitted': self.submitted, 'coalesced': self.coalesced,
+                    'skipped': self.skipped, 'sent': self.sent, 'failed': self.failed,
+                    'dropped': self.dropped, 'pending': len(self._pending)}
+
+    def close(self, flush: bool = True, timeout: float = None):
+        """
+        Stop the updater.
+
+        Args:
+            flush: send the pending texts first, once each
+            timeout: longest wait for the sending thread, in seconds
+        """
+        with self._cond:
+            self._closed = True
+            if not flush:
+                self._pending.clear()
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+
+class OverlayHub:
+    """
+    Dynamic text overlays of many cameras, one :class:`OverlayUpdater` per camera.
+
+    Args:
+        max_rate: largest number of requests per second to each camera
+        timeout: timeout of the overlay requests, in seconds
+        retries: times a failed text is sent again, see :class:`OverlayUpdater`
+        backoff: delay before the first retry, in seconds
+
+    Example:
+        hub = OverlayHub(max_rate=4)
+        for camera, reading in readings:
+            hub.update(camera, f'{reading.temperature:.1f} C', source='1')
+        hub.close()
+    """
+
+    def __init__(self, *, max_rate: float = 5.0, timeout: float = 2.0, retries: int = 3,
+                 backoff: float = 0.5):
+        self.max_rate = max_rate
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._updaters = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def updater(self, camera) -> OverlayUpdater:
+        """
+        Returns:
+            The updater of a camera, created on first use.
+        """
+        with self._lock:
+            updater = self._updaters.get(camera.ip)
+            if updater is None:
+                updater = self._updaters[camera.ip] = OverlayUpdater(
+                    camera, max_rate=self.max_rate, timeout=self.timeout, retries=self.retries,
+                    backoff=self.backoff)
+            return updater
+
+    def update(self, camera, text: str, source: str = None):
+        self.updater(camera).update(text, source)
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            updaters = list(self._updaters.values())
+        for updater in updaters:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not updater.flush(remaining):
+                return False
+        return True
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            Dictionary camera address -> counters of its updater.
+        """
+        with self._lock:
+            return {ip: updater.stats() for ip, updater in self._updaters.items()}
+
+    def close(self, flush: bool = True):
+        with self._lock:
+            updaters, self._updaters = list(self._updaters.values()), {}
+        for updater in updaters:
+            updater.close(flush, timeout=0)
+        for updater in updaters:
+            updater.close(flush)
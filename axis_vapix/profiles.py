@@ -0,0 +1,334 @@
+"""
+Stream profile catalog with idempotent bulk create, update and remove.
+
+A :class:`ProfileCatalog` is the parsed ``root.StreamProfile`` group of one camera, with profiles
+looked up by name and their parameters compared as dictionaries, so that argument order does not
+count as a difference. :class:`ProfileManager` compares it to the desired profiles and only
+touches what differs, in as few ``param.cgi`` requests as the interface allows: all changed
+profiles in one ``update``, all obsolete profiles in one ``remove``, and one ``add`` per new
+profile, except that a new profile first takes over the group of a profile about to be removed
+through the same single ``update``.
+"""
+import re
+import logging
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional
+
+import requests
+
+_log = logging.getLogger(__name__)
+
+_PARAM_PATH = '/axis-cgi/param.cgi'
+_PROFILE_LINE = re.compile(r'^root\.StreamProfile\.(?P<group>S\d+)\.(?P<key>\w+)=(?P<value>.*)$')
+_ADDED_GROUP = re.compile(r'\b(S\d+)\s+OK\b')
+_TAGS = re.compile(r'<[^>]+>')
+
+
+def _normalize(parameters) -> dict:
+    if isinstance(parameters, str):
+        return dict(urllib.parse.parse_qsl(parameters, keep_blank_values=True))
+    return {key: str(value) for key, value in parameters.items() if value is not None}
+
+
+class StreamProfile(NamedTuple):
+    """
+    One stream profile. ``group`` is the parameter group holding it on a camera, like 'S0', and
+    None for a desired profile.
+    """
+    name: str
+    parameters: dict
+    description: str = ''
+    group: Optional[str] = None
+
+    @classmethod
+    def make(cls, name: str, description: str = '', **parameters):
+        """
+        Build a desired profile from ``param.cgi`` stream arguments, e.g.
+        ``StreamProfile.make('low', resolution='640x360', videocodec='h264', fps=5)``.
+        """
+        return cls(name, _normalize(parameters), description)
+
+    def same_as(self, other) -> bool:
+        return _normalize(self.parameters) == _normalize(other.parameters) and \
+            (self.description or '') == (other.description or '')
+
+    def encoded(self) -> str:
+        return urllib.parse.urlencode(_normalize(self.parameters))
+
+
+class ProfileCatalog:
+    """
+    The stream profiles of one camera, by name.
+
+    Args:
+        profiles: list of :class:`StreamProfile` with their groups
+    """
+
+    def __init__(self, profiles=()):
+        self._profiles = {profile.name: profile for profile in profiles}
+
+    @classmethod
+    def parse(cls, text: str):
+        """
+        Parse the answer of ``param.cgi?action=list&group=root.StreamProfile``.
+        """
+        groups = {}
+        for line in text.splitlines():
+            match = _PROFILE_LINE.match(line.strip())
+            if match:
+                groups.setdefault(match.group('group'), {})[match.group('key')] = \
+                    match.group('value')
+        return cls(StreamProfile(values['Name'], _normalize(values.get('Parameters', '')),
+                                 values.get('Description', ''), group)
+                   for group, values in groups.items() if values.get('Name'))
+
+    @classmethod
+    def fetch(cls, camera, timeout: float = 10.0):
+        """
+        Download the catalog of a camera.
+        """
+        resp = camera._session.get(camera.cam_url + _PARAM_PATH,
+                                   params={'action': 'list', 'group': 'root.StreamProfile'},
+                                   timeout=timeout)
+        if resp.status_code != 200:
+            raise requests.HTTPError(f'{resp.status_code} {resp.reason}', response=resp)
+        # a camera without profiles answers with an error line, which parses to nothing
+        return cls.parse(resp.text)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._profiles
+
+    def __iter__(self):
+        return iter(self._profiles.values())
+
+    def __len__(self):
+        return len(self._profiles)
+
+    def get(self, name: str) -> Optional[StreamProfile]:
+        return self._profiles.get(name)
+
+    def put(self, profile: StreamProfile):
+        self._profiles[profile.name] = profile
+
+    def discard(self, name: str):
+        self._profiles.pop(name, None)
+
+
+class ProfilePlan(NamedTuple):
+    """
+    Changes of one camera: ``update`` maps parameter names to values for one batched update,
+    ``add`` lists the profiles needing their own request, ``remove`` the groups to remove at once.
+    ``updated`` and ``reused`` name the profiles the update changes or creates, ``groups`` gives
+    their groups, ``replaced`` names the obsolete profiles whose groups are reused and ``removed``
+    the ones removed.
+    """
+    update: dict
+    add: list
+    remove: list
+    updated: list
+    reused: list
+    groups: dict
+    replaced: list
+    removed: list
+
+    @property
+    def empty(self) -> bool:
+        return not (self.update or self.add or self.remove)
+
+
+class ProfileReport(NamedTuple):
+    """
+    Result of synchronizing one camera.
+    """
+    camera: str
+    created: list
+    updated: list
+    removed: list
+    unchanged: int
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def plan(catalog: ProfileCatalog, desired, *, remove_unlisted: bool = False) -> ProfilePlan:
+    """
+    Compute the batched requests bringing a catalog to the desired profiles.
+
+    Args:
+        catalog: current :class:`ProfileCatalog` of the camera
+        desired: iterable of :class:`StreamProfile`
+        remove_unlisted: remove the profiles that are not desired
+
+    Returns:
+        :class:`ProfilePlan`
+    """
+    desired = {profile.name: profile for profile in desired}
+    obsolete = [profile for profile in catalog if profile.name not in desired] \
+        if remove_unlisted else []
+    update, updated, reused, add, groups, replaced = {}, [], [], [], {}, []
+
+    def assign(group, profile):
+        groups[profile.name] = group
+        prefix = f'root.StreamProfile.{group}.'
+        update[prefix + 'Name'] = profile.name
+        update[prefix + 'Description'] = profile.description or ''
+        update[prefix + 'Parameters'] = profile.encoded()
+
+    for name, profile in desired.items():
+        current = catalog.get(name)
+        if current is None:
+            if obsolete:
+                old = obsolete.pop(0)
+                assign(old.group, profile)
+                replaced.append(old.name)
+                reused.append(name)
+            else:
+                add.append(profile)
+        elif not current.same_as(profile):
+            assign(current.group, profile)
+            updated.append(name)
+
+    return ProfilePlan(update, add, [profile.group for profile in obsolete], updated, reused,
+                       groups, replaced, [profile.name for profile in obsolete])
+
+
+def _failure(resp) -> Optional[str]:
+    text = _TAGS.sub(' ', resp.text).strip()
+    if resp.status_code != 200:
+        return f'{resp.status_code} {text}'.strip()
+    if 'error' in text.lower():
+        return text
+    return None
+
+
+class ProfileManager:
+    """
+    Keeps the stream profiles of many cameras equal to a desired list.
+
+    Args:
+        desired: iterable of :class:`StreamProfile`
+        remove_unlisted: remove the profiles that are not desired
+        workers: cameras synchronized at the same time
+        timeout: timeout of every request, in seconds
+
+    Example:
+        manager = ProfileManager([StreamProfile.make('vms', resolution='1280x720', fps=15,
+                                                     videocodec='h264')])
+        reports = manager.run(cameras)
+    """
+
+    def __init__(self, desired, *, remove_unlisted: bool = False, workers: int = 32,
+                 timeout: float = 10.0):
+        self.desired = list(desired)
+        self.remove_unlisted = remove_unlisted
+        self.workers = workers
+        self.timeout = timeout
+        self._catalogs = {}
+        self._lock = threading.Lock()
+
+    def catalog(self, camera, refresh: bool = False) -> ProfileCatalog:
+        """
+        Returns:
+            The cached :class:`ProfileCatalog` of a camera, downloaded on first use.
+        """
+        with self._lock:
+            catalog = self._catalogs.get(camera.ip)
+        if catalog is None or refresh:
+            catalog = ProfileCatalog.fetch(camera, self.timeout)
+            with self._lock:
+                self._catalogs[camera.ip] = catalog
+        return catalog
+
+    def plan(self, camera, refresh: bool = False) -> ProfilePlan:
+        return plan(self.catalog(camera, refresh), self.desired,
+                    remove_unlisted=self.remove_unlisted)
+
+    def _param(self, camera, payload: dict) -> str:
+        resp = camera._session.get(camera.cam_url + _PARAM_PATH, params=payload,
+                                   timeout=self.timeout)
+        message = _failure(resp)
+        if message:
+            raise requests.HTTPError(message, response=resp)
+        return resp.text
+
+    def apply(self, camera, *, dry_run: bool = False, refresh: bool = False) -> ProfileReport:
+        """
+        Synchronize one camera.
+
+        Returns:
+            :class:`ProfileReport`; with ``dry_run`` it lists the planned changes.
+        """
+        created, updated, removed = [], [], []
+        try:
+            catalog = self.catalog(camera, refresh)
+            changes = plan(catalog, self.desired, remove_unlisted=self.remove_unlisted)
+            unchanged = len(self.desired) - len(changes.updated) - len(changes.reused) - \
+                len(changes.add)
+            if dry_run:
+                return ProfileReport(camera.ip, changes.reused + [p.name for p in changes.add],
+                                     changes.updated, changes.replaced + changes.removed,
+                                     unchanged)
+
+            desired = {profile.name: profile for profile in self.desired}
+            if changes.update:
+                self._param(camera, {'action': 'update', **changes.update})
+                for name in changes.replaced:
+                    catalog.discard(name)
+                for name, group in changes.groups.items():
+                    catalog.put(desired[name]._replace(group=group))
+                updated += changes.updated
+                created += changes.reused
+                removed += changes.replaced
+            if changes.remove:
+                self._param(camera, {'action': 'remove', 'group': ','.join(
+                    f'root.StreamProfile.{group}' for group in changes.remove)})
+                for name in changes.removed:
+                    catalog.discard(name)
+                removed += changes.removed
+            for profile in changes.add:
+                text = self._param(camera, {
+                    'action': 'add', 'template': 'streamprofile', 'group': 'StreamProfile',
+                    'StreamProfile.S.Name': profile.name,
+                    'StreamProfile.S.Description': profile.description or '',
+                    'StreamProfile.S.Parameters': profile.encoded()})
+                match = _ADDED_GROUP.search(_TAGS.sub(' ', text))
+                if match:
+                    catalog.put(profile._replace(group=match.group(1)))
+                else:
+                    # group unknown, read the catalog again next time
+                    with self._lock:
+                        self._catalogs.pop(camera.ip, None)
+                created.append(profile.name)
+        except requests.RequestException as err:
+            _log.warning('Could not synchronize the stream profiles of %s: %s', camera.ip, err)
+            with self._lock:
+                self._catalogs.pop(camera.ip, None)
+            return ProfileReport(camera.ip, created, updated, removed, 0, str(err))
+        return ProfileReport(camera.ip, created, updated, removed, unchanged)
+
+    def run(self, cameras, *, dry_run: bool = False, refresh: bool = False,
+            progress=None) -> dict:
+        """
+        Synchronize many cameras concurrently.
+
+        Args:
+            cameras: list of :class:`axis_vapix.Camera`
+            dry_run: only plan, change nothing
+            refresh: download the catalogs again instead of using the cached ones
+            progress: optional callable receiving every :class:`ProfileReport` as it is done
+
+        Returns:
+            Dictionary camera address -> :class:`ProfileReport`.
+        """
+        def apply(camera):
+            report = self.apply(camera, dry_run=dry_run, refresh=refresh)
+            if progress is not None:
+                progress(report)
+            return report
+
+        with ThreadPoolExecutor(self.workers) as executor:
+            return {report.camera: report for report in executor.map(apply, cameras)}
@@ -0,0 +1,167 @@
+"""
+Suppression of PTZ commands that would not change anything.
+
+Automation scripts tend to send the same ``absolute_move``, ``set_speed``, ``auto_focus`` or
+``auto_iris`` again and again, and every one costs a blocking ``ptz.cgi`` request. A
+:class:`PTZState` given to :class:`axis_vapix.Camera` mirrors the last known PTZ state of the
+camera, from the answers of ``get_status`` and ``get_speed`` and from the commands already sent,
+and drops the arguments of a command whose value the camera already has, within a tolerance.
+A command left without arguments is not sent at all.
+
+Any command the tracker cannot follow, like a continuous, relative or preset move, forgets the
+position, and so does :meth:`PTZState.expire`, to be called on every sign that something else
+moved the camera: an operator joystick, a guard tour, an event. Values also expire after
+``max_age`` seconds, so a missed signal costs at most one redundant request.
+"""
+import time
+import logging
+import threading
+
+import requests
+
+_log = logging.getLogger(__name__)
+
+# arguments of ptz.cgi that set a value the tracker follows
+_POSITION = ('pan', 'tilt', 'zoom')
+_LENS = ('focus', 'iris')
+_SETTINGS = ('speed', 'autofocus', 'autoiris')
+_TRACKED = _POSITION + _LENS + _SETTINGS
+# arguments that read without changing anything
+_READING = ('query', 'info')
+
+
+class PTZState:
+    """
+    Last known PTZ state of a camera, per channel, deciding which commands to send.
+
+    Args:
+        tolerances: dictionary argument -> largest difference treated as equal, updating the
+            defaults: 0.05 degrees for pan and tilt, 1 unit for zoom, focus, iris and speed
+        max_age: seconds after which a known value is no longer trusted, None to keep it until
+            :meth:`expire`
+
+    Example:
+        camera = Camera('192.168.0.90', 'root', 'pass', ptz_state=PTZState(max_age=30))
+        camera.absolute_move(10, -20, 1)
+        camera.absolute_move(10, -20, 1)     # not sent
+        camera.ptz_state.stats()             # {'sent': 1, 'suppressed': 1, 'trimmed': 0}
+    """
+
+    def __init__(self, *, tolerances: dict = None, max_age: float = 10.0):
+        self.tolerances = {'pan': 0.05, 'tilt': 0.05, 'zoom': 1, 'focus': 1, 'iris': 1,
+                           'speed': 0}
+        self.tolerances.update(tolerances or {})
+        self.max_age = max_age
+        self._values = {}
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.suppressed = 0
+        self.trimmed = 0
+
+    def _known(self, camera: int, name: str):
+        entry = self._values.get((camera, name))
+        if entry is None:
+            return None
+        value, stamp = entry
+        if self.max_age is not None and time.monotonic() - stamp > self.max_age:
+            return None
+        return value
+
+    def _same(self, name: str, known, wanted) -> bool:
+        if name in ('autofocus', 'autoiris'):
+            return str(known).lower() == str(wanted).lower()
+        try:
+            difference = float(wanted) - float(known)
+        except (TypeError, ValueError):
+            return False
+        if name == 'pan':
+            difference = (difference + 180) % 360 - 180
+        return abs(difference) <= self.tolerances.get(name, 0)
+
+    def filter(self, payload: dict, camera: int = 1):
+        """
+        Drop the arguments of a command that would not change anything.
+
+        Args:
+            payload: ``ptz.cgi`` arguments
+            camera: channel
+
+        Returns:
+            The arguments to send, or None when the whole command is redundant.
+        """
+        active = {name: value for name, value in payload.items() if value is not None}
+        if not active or any(name not in _TRACKED for name in active):
+            # readings and commands the tracker does not follow go out unchanged
+            return payload
+        with self._lock:
+            redundant = []
+            for name, value in active.items():
+                known = self._known(camera, name)
+                if known is not None and self._same(name, known, value):
+                    redundant.append(name)
+            if len(redundant) == len(active):
+                self.suppressed += 1
+                return None
+            if redundant:
+                self.trimmed += 1
+        return {name: value for name, value in payload.items() if name not in redundant}
+
+    def sent_command(self, payload: dict, camera: int = 1):
+        """
+        Take the values of a command the camera accepted.
+        """
+        active = {name: value for name, value in payload.items() if value is not None}
+        if any(name in _READING for name in active):
+            return
+        now = time.monotonic()
+        with self._lock:
+            self.sent += 1
+            if any(name not in _TRACKED for name in active):
+                # the camera moves to a place the tracker cannot know
+                self._forget(camera, _POSITION + _LENS)
+                return
+            for name, value in active.items():
+                self._values[(camera, name)] = (value, now)
+
+    def update(self, status: dict, camera: int = 1):
+        """
+        Take the state read from the camera, as returned by ``get_status``.
+        """
+        now = time.monotonic()
+        with self._lock:
+            for name in _TRACKED:
+                if status.get(name) is not None:
+                    self._values[(camera, name)] = (status[name], now)
+
+    def _forget(self, camera, names):
+        for key in [key for key in self._values
+                    if (camera is None or key[0] == camera) and key[1] in names]:
+            del self._values[key]
+
+    def expire(self, camera: int = None, *, settings: bool = False):
+        """
+        Forget the position of a channel, or of all channels, after something else moved the
+        camera. ``settings`` also forgets speed, autofocus and autoiris.
+        """
+        with self._lock:
+            self._forget(camera, _TRACKED if settings else _POSITION + _LENS)
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            Dictionary with the numbers of commands sent, suppressed and sent with fewer
+            arguments.
+        """
+        return {'sent': self.sent, 'suppressed': self.suppressed, 'trimmed': self.trimmed}
+
+
+def suppressed_response(url: str) -> requests.Response:
+    """
+    The answer given for a suppressed command: 204 without content, as the camera answers.
+    """
+    resp = requests.Response()
+    resp.status_code = 204
+    resp.reason = 'No Content (suppressed)'
+    resp.url = url
+    resp._content = b''
+    return resp
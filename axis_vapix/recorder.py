@@ -0,0 +1,324 @@
+"""
+Append-only segmented storage for the JPEG frames of one camera.
+
+Frames are appended to segment files of bounded size (``<start>.seg``) instead of one file per
+frame. Every segment has a compact sidecar index (``<start>.idx``) of fixed 20 byte records
+``(timestamp, offset, length)``, so a time range is located with a binary search and served
+straight out of a memory map of the segment.
+"""
+import os
+import mmap
+import time
+import bisect
+import struct
+import logging
+import threading
+
+from .restream import Frame
+
+_log = logging.getLogger(__name__)
+
+_INDEX_RECORD = struct.Struct('<dQI')
+_SEGMENT_SUFFIX = '.seg'
+_INDEX_SUFFIX = '.idx'
+
+FSYNC_NEVER = 'never'
+FSYNC_SEGMENT = 'segment'
+FSYNC_INTERVAL = 'interval'
+FSYNC_ALWAYS = 'always'
+_FSYNC_POLICIES = (FSYNC_NEVER, FSYNC_SEGMENT, FSYNC_INTERVAL, FSYNC_ALWAYS)
+
+
+def _segment_name(timestamp: float) -> str:
+    return f'{int(timestamp * 1e6):020d}'
+
+
+class SegmentRecorder:
+    """
+    Writer of JPEG frames into fixed-size, append-only segment files.
+
+    Args:
+        directory: folder holding the segments of one camera, created if missing
+        segment_size: a new segment is started before a frame would make the current one larger
+            than this many bytes
+        fsync: durability policy. ``never`` leaves flushing to the OS, ``segment`` syncs every
+            segment when it is closed, ``interval`` syncs at most every ``fsync_interval``
+            seconds and ``always`` syncs after every frame
+        fsync_interval: seconds between two syncs with the ``interval`` policy
+        buffer_size: size of the write buffer of the segment file, in bytes
+
+    Example:
+        with SegmentRecorder('/data/cam1') as recorder:
+            recorder.record(restreamer.subscribe())
+    """
+
+    def __init__(self, directory: str, *, segment_size: int = 64 * 1024 * 1024,
+                 fsync: str = FSYNC_SEGMENT, fsync_interval: float = 1.0,
+                 buffer_size: int = 1024 * 1024):
+        if fsync not in _FSYNC_POLICIES:
+            raise ValueError(f'fsync must be one of {_FSYNC_POLICIES}, not {fsync!r}')
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_size = segment_size
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.buffer_size = buffer_size
+
+        self._lock = threading.Lock()
+        self._data = None
+        self._index = None
+        self._pending = bytearray()
+        self._offset = 0
+        self._last_sync = time.monotonic()
+
+        self.frames = 0
+        self.bytes = 0
+        self.segments = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _open_segment(self, timestamp: float):
+        name = os.path.join(self.directory, _segment_name(timestamp))
+        # never append to a segment of a previous run: its tail may be torn
+        while os.path.exists(name + _SEGMENT_SUFFIX):
+            timestamp += 1e-6
+            name = os.path.join(self.directory, _segment_name(timestamp))
+        self._data = open(name + _SEGMENT_SUFFIX, 'xb', buffering=self.buffer_size)
+        # unbuffered: index records are collected in _pending and written by _flush only
+        self._index = open(name + _INDEX_SUFFIX, 'xb', buffering=0)
+        self._offset = 0
+        self.segments += 1
+
+    def _close_segment(self):
+        if self._data is None:
+            return
+        self._flush(sync=self.fsync != FSYNC_NEVER)
+        self._data.close()
+        self._index.close()
+        self._data = None
+        self._index = None
+
+    def _flush(self, sync: bool):
+        # data before index, so that an index record never points past the data on disk
+        self._data.flush()
+        if sync:
+            os.fsync(self._data.fileno())
+        if self._pending:
+            self._index.write(self._pending)
+            self._pending.clear()
+        if sync:
+            os.fsync(self._index.fileno())
+            self._last_sync = time.monotonic()
+
+    def write(self, data: bytes, timestamp: float = None):
+        """
+        Append one frame.
+
+        Args:
+            data: encoded JPEG
+            timestamp: capture time in seconds since the epoch, defaults to now
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            if self._data is not None and self._offset and \
+                    self._offset + len(data) > self.segment_size:
+                self._close_segment()
+            if self._data is None:
+                self._open_segment(timestamp)
+
+            self._data.write(data)
+            self._pending += _INDEX_RECORD.pack(timestamp, self._offset, len(data))
+            self._offset += len(data)
+            self.frames += 1
+            self.bytes += len(data)
+
+            if self.fsync == FSYNC_ALWAYS:
+                self._flush(sync=True)
+            elif self.fsync == FSYNC_INTERVAL and \
+                    time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._flush(sync=True)
+            elif len(self._pending) >= 64 * _INDEX_RECORD.size:
+                # publish the frames to readers every 64 frames
+                self._flush(sync=False)
+
+    def record(self, frames, limit: int = None) -> int:
+        """
+        Append frames from an iterable of :class:`axis_vapix.Frame` until it is exhausted, for
+        example a :class:`axis_vapix.Subscription` of a restreamer.
+
+        Args:
+            frames: iterable of frames
+            limit: stop after this many frames
+
+        Returns:
+            Number of frames written.
+        """
+        count = 0
+        for frame in frames:
+            self.write(frame.data, frame.timestamp)
+            count += 1
+            if limit is not None and count >= limit:
+                break
+        return count
+
+    def flush(self):
+        """
+        Push buffered frames to the OS, so that readers see them.
+        """
+        with self._lock:
+            if self._data is not None:
+                self._flush(sync=False)
+
+    def close(self):
+        """
+        Close the current segment, syncing it unless the policy is ``never``.
+        """
+        with self._lock:
+            self._close_segment()
+
+
+class _Segment:
+    def __init__(self, base: str, start: float):
+        self.base = base
+        self.start = start
+        self.timestamps = []
+        self.offsets = []
+        self.lengths = []
+        self._index_size = 0
+        self._file = None
+        self._mmap = None
+
+    def refresh(self):
+        """
+        Load the index records appended since the last refresh.
+        """
+        try:
+            with open(self.base + _INDEX_SUFFIX, 'rb') as var:
+                var.seek(self._index_size)
+                raw = var.read()
+        except FileNotFoundError:
+            return
+        # ignore a torn last record
+        raw = raw[:len(raw) - len(raw) % _INDEX_RECORD.size]
+        for timestamp, offset, length in _INDEX_RECORD.iter_unpack(raw):
+            self.timestamps.append(timestamp)
+            self.offsets.append(offset)
+            self.lengths.append(length)
+        self._index_size += len(raw)
+
+    def view(self) -> memoryview:
+        size = os.path.getsize(self.base + _SEGMENT_SUFFIX)
+        if self._mmap is None or len(self._mmap) < size:
+            self.close()
+            if size == 0:
+                return memoryview(b'')
+            self._file = open(self.base + _SEGMENT_SUFFIX, 'rb')
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self._mmap)
+
+    def close(self):
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # a caller still holds a view of it, the map is released with that view
+                pass
+            self._file.close()
+        self._mmap = None
+        self._file = None
+
+
+class SegmentReader:
+    """
+    Time range reader over the segments written by :class:`SegmentRecorder`.
+
+    Frames are returned as memoryviews into a read-only memory map of the segment, without
+    copying. They stay valid until :meth:`close` is called.
+
+    Args:
+        directory: folder holding the segments of one camera
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._segments = []
+        self.refresh()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def refresh(self):
+        """
+        Pick up segments and frames written since the reader was opened.
+        """
+        known = {segment.base for segment in self._segments}
+        # closed segments never change, only the newest known one may still be growing
+        growing = self._segments[-1].base if self._segments else None
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(_SEGMENT_SUFFIX):
+                continue
+            base = os.path.join(self.directory, name[:-len(_SEGMENT_SUFFIX)])
+            if base not in known:
+                start = int(name[:-len(_SEGMENT_SUFFIX)]) / 1e6
+                self._segments.append(_Segment(base, start))
+        self._segments.sort(key=lambda segment: segment.start)
+        for segment in self._segments:
+            if segment.base not in known or segment.base == growing:
+                segment.refresh()
+
+    def segments(self) -> list:
+        """
+        Returns:
+            List of (first timestamp, last timestamp, frame count) of every segment.
+        """
+        return [(segment.timestamps[0], segment.timestamps[-1], len(segment.timestamps))
+                for segment in self._segments if segment.timestamps]
+
+    def frames(self, start: float = None, end: float = None):
+        """
+        Iterate over the recorded frames with ``start <= timestamp < end``.
+
+        Args:
+            start: first timestamp, None for the beginning of the recording
+            end: end timestamp (excluded), None for the end of the recording
+
+        Returns:
+            Iterator of :class:`axis_vapix.Frame`, ``seq`` is the position in the range and
+            ``data`` a memoryview into the segment.
+        """
+        starts = [segment.start for segment in self._segments]
+        first = 0 if start is None else max(0, bisect.bisect_right(starts, start) - 1)
+        seq = 0
+        for segment in self._segments[first:]:
+            if end is not None and segment.start >= end:
+                break
+            if not segment.timestamps:
+                continue
+            low = 0 if start is None else bisect.bisect_left(segment.timestamps, start)
+            high = len(segment.timestamps) if end is None else \
+                bisect.bisect_left(segment.timestamps, end)
+            if low >= high:
+                continue
+            view = segment.view()
+            for i in range(low, high):
+                offset, length = segment.offsets[i], segment.lengths[i]
+                if offset + length > len(view):
+                    # indexed but not yet flushed by the writer
+                    break
+                yield Frame(seq, segment.timestamps[i], view[offset:offset + length])
+                seq += 1
+
+    def close(self):
+        """
+        Release the memory maps.
+        """
+        for segment in self._segments:
+            segment.close()
@@ -0,0 +1,201 @@
+"""
+Parallel collection of server reports into compressed files.
+
+Each ``serverreport.cgi`` answer is streamed in chunks through a gzip or zstd compressor straight to
+disk, so memory stays flat whatever the report size and fleet size. Every finished camera appends
+one line to ``manifest.jsonl`` with sizes, duration and the SHA-256 of the written file; a rerun
+skips the cameras already in the manifest, which makes interrupted collections resumable.
+"""
+import os
+import gzip
+import json
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+_log = logging.getLogger(__name__)
+
+_REPORT_PATH = '/axis-cgi/serverreport.cgi'
+_MANIFEST = 'manifest.jsonl'
+_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst', 'none': ''}
+
+
+class _HashingFile:
+    """
+    Write-only file wrapper counting and hashing what goes to disk.
+    """
+
+    def __init__(self, raw):
+        self._raw = raw
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data) -> int:
+        self.sha256.update(data)
+        self.size += len(data)
+        return self._raw.write(data)
+
+    def flush(self):
+        self._raw.flush()
+
+    def close(self):
+        pass
+
+
+class ReportCollector:
+    """
+    Downloads server reports of many cameras concurrently into compressed files.
+
+    Args:
+        directory: destination folder, holds one file per camera and the manifest
+        compression: 'gzip', 'zstd' (needs the ``zstandard`` package) or 'none'
+        level: compression level
+        workers: cameras downloaded at the same time
+        timeout: connect and read timeout of every request, in seconds
+        chunk_size: bytes read from the socket at a time
+        params: extra arguments of ``serverreport.cgi``, e.g. ``{'mode': 'text'}``
+
+    Example:
+        collector = ReportCollector('/srv/support/site-12', compression='zstd', workers=16)
+        manifest = collector.collect(cameras)
+    """
+
+    def __init__(self, directory: str, *, compression: str = 'gzip', level: int = None,
+                 workers: int = 8, timeout: float = 120.0, chunk_size: int = 64 * 1024,
+                 params: dict = None):
+        if compression not in _SUFFIXES:
+            raise ValueError(f'compression must be one of {tuple(_SUFFIXES)}, not {compression!r}')
+        if compression == 'zstd' and zstandard is None:
+            raise ImportError('zstd compression requires the zstandard package, '
+                              'install it with "pip install axis_vapix[zstd]"')
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.compression = compression
+        self.level = level
+        self.workers = workers
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.params = params or {}
+        self._lock = threading.Lock()
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.directory, _MANIFEST)
+
+    def manifest(self) -> dict:
+        """
+        Returns:
+            Dictionary camera address -> latest manifest entry.
+        """
+        entries = {}
+        try:
+            with open(self.manifest_path, encoding='utf-8') as var:
+                for line in var:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # torn last line of an interrupted run
+                        continue
+                    entries[entry['camera']] = entry
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def _record(self, entry: dict):
+        with self._lock:
+            with open(self.manifest_path, 'a', encoding='utf-8') as var:
+                var.write(json.dumps(entry) + '\n')
+
+    def _file_name(self, camera) -> str:
+        return camera.ip.replace(':', '_') + '.txt' + _SUFFIXES[self.compression]
+
+    def _open_compressor(self, target: _HashingFile):
+        if self.compression == 'gzip':
+            return gzip.GzipFile(fileobj=target, mode='wb',
+                                 compresslevel=6 if self.level is None else self.level)
+        if self.compression == 'zstd':
+            compressor = zstandard.ZstdCompressor(level=3 if self.level is None else self.level)
+            return compressor.stream_writer(target, closefd=False)
+        return target
+
+    def fetch(self, camera) -> dict:
+        """
+        Download the report of one camera and record it in the manifest.
+
+        Returns:
+            The manifest entry of the camera.
+        """
+        name = self._file_name(camera)
+        path = os.path.join(self.directory, name)
+        partial = path + '.part'
+        entry = {'camera': camera.ip, 'file': name, 'compression': self.compression}
+        start = time.monotonic()
+        size = 0
+        try:
+            resp = camera._session.get(camera.cam_url + _REPORT_PATH, params=self.params,
+                                       stream=True, timeout=self.timeout)
+            with resp:
+                if resp.status_code != 200:
+                    raise requests.HTTPError(f'{resp.status_code} {resp.reason}', response=resp)
+                with open(partial, 'wb') as raw:
+                    target = _HashingFile(raw)
+                    compressor = self._open_compressor(target)
+                    for chunk in resp.iter_content(self.chunk_size):
+                        compressor.write(chunk)
+                        size += len(chunk)
+                    if compressor is not target:
+                        compressor.close()
+                    raw.flush()
+                    os.fsync(raw.fileno())
+            os.replace(partial, path)
+            entry.update(status='ok', bytes=size, compressed_bytes=target.size,
+                         sha256=target.sha256.hexdigest())
+        except (requests.RequestException, OSError) as err:
+            _log.warning('Server report of %s failed: %s', camera.ip, err)
+            if os.path.exists(partial):
+                os.remove(partial)
+            entry.update(status='error', error=str(err), bytes=size)
+        entry.update(duration=round(time.monotonic() - start, 3), finished=time.time())
+        self._record(entry)
+        return entry
+
+    def collect(self, cameras, *, resume: bool = True, progress=None) -> dict:
+        """
+        Download the reports of many cameras, at most ``workers`` at a time.
+
+        Args:
+            cameras: list of :class:`axis_vapix.Camera`
+            resume: skip cameras already collected successfully according to the manifest
+            progress: optional callable receiving every manifest entry as it is written
+
+        Returns:
+            Dictionary camera address -> manifest entry, for all the given cameras.
+        """
+        done = {ip: entry for ip, entry in self.manifest().items()
+                if entry.get('status') == 'ok' and
+                os.path.exists(os.path.join(self.directory, entry['file']))} if resume else {}
+        todo = [camera for camera in cameras if camera.ip not in done]
+        if done:
+            _log.info('Resuming: %d of %d cameras already collected', len(cameras) - len(todo),
+                      len(cameras))
+
+        def fetch(camera):
+            entry = self.fetch(camera)
+            if progress is not None:
+                progress(entry)
+            return entry
+
+        results = {camera.ip: done[camera.ip] for camera in cameras if camera.ip in done}
+        with ThreadPoolExecutor(self.workers) as executor:
+            for entry in executor.map(fetch, todo):
+                results[entry['camera']] = entry
+        return results
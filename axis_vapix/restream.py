@@ -0,0 +1,432 @@
+"""
+Fan-out of one upstream MJPEG connection to many local consumers.
+
+A :class:`MjpegRestreamer` holds a single ``mjpg/video.cgi`` connection to a camera and hands each
+received JPEG to every subscriber. The frame bytes are read once and shared by reference, so adding
+a subscriber costs a queue slot, not a copy. Each subscriber owns a small bounded queue that drops
+its oldest frame when full: a slow reader only loses frames itself and never stalls the upstream.
+:class:`RestreamServer` exposes restreamers to local HTTP clients as regular MJPEG streams.
+"""
+import time
+import logging
+import threading
+import collections
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import NamedTuple, Optional
+
+import requests
+
+_log = logging.getLogger(__name__)
+
+_MJPEG_PATH = '/axis-cgi/mjpg/video.cgi'
+_BOUNDARY = b'axisvapixframe'
+
+
+class Frame(NamedTuple):
+    """
+    One JPEG received from the upstream stream.
+
+    ``data`` is shared between all subscribers and must not be modified.
+    """
+    seq: int
+    timestamp: float
+    data: bytes
+
+
+class Subscription:
+    """
+    Bounded frame queue of one consumer. When the queue is full the oldest frame is dropped.
+
+    Args:
+        maxsize: number of frames the subscriber may lag behind before frames are dropped
+    """
+
+    def __init__(self, maxsize: int = 4):
+        self._frames = collections.deque(maxlen=maxsize)
+        self._cond = threading.Condition()
+        self._closed = False
+        self._detach = None
+        self.received = 0
+        self.dropped = 0
+
+    def _push(self, frame: Frame):
+        with self._cond:
+            if len(self._frames) == self._frames.maxlen:
+                self.dropped += 1
+            self._frames.append(frame)
+            self.received += 1
+            self._cond.notify()
+
+    def get(self, timeout: float = None) -> Optional[Frame]:
+        """
+        Wait for the next frame.
+
+        Args:
+            timeout: seconds to wait, None waits forever
+
+        Returns:
+            The oldest queued frame, or None on timeout or once the subscription is closed.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._frames or self._closed, timeout):
+                return None
+            if self._frames:
+                return self._frames.popleft()
+            return None
+
+    def __iter__(self):
+        while True:
+            frame = self.get()
+            if frame is None:
+                return
+            yield frame
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def close(self):
+        """
+        Detach from the restreamer and wake up any reader.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._detach is not None:
+            self._detach(self)
+            self._detach = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _MultipartReader:
+    """
+    Incremental parser of a ``multipart/x-mixed-replace`` body.
+
+    Axis devices send a Content-Length header with every part, which lets the body be read with a
+    single exact read. Parts without it are delimited by searching for the next boundary.
+    """
+
+    def __init__(self, raw, boundary: bytes, chunk_size: int = 4096):
+        self._raw = raw
+        self._delimiter = b'--' + boundary
+        self._chunk_size = chunk_size
+        self._buf = bytearray()
+
+    def _fill(self, size: int):
+        data = self._raw.read(size)
+        if not data:
+            raise EOFError('upstream stream closed')
+        self._buf += data
+
+    def _readline(self) -> bytes:
+        while True:
+            end = self._buf.find(b'\n')
+            if end >= 0:
+                line = bytes(self._buf[:end + 1])
+                del self._buf[:end + 1]
+                return line
+            self._fill(256)
+
+    def _read_exact(self, size: int) -> bytes:
+        while len(self._buf) < size:
+            self._fill(size - len(self._buf))
+        data = bytes(self._buf[:size])
+        del self._buf[:size]
+        return data
+
+    def _read_until_delimiter(self) -> bytes:
+        start = 0
+        while True:
+            end = self._buf.find(self._delimiter, start)
+            if end >= 0:
+                data = bytes(self._buf[:end]).rstrip(b'\r\n')
+                del self._buf[:end]
+                return data
+            start = max(0, len(self._buf) - len(self._delimiter))
+            self._fill(self._chunk_size)
+
+    def read_part(self) -> bytes:
+        """
+        Returns:
+            The body of the next part.
+        """
+        while not self._readline().startswith(self._delimiter):
+            pass
+
+        length = None
+        while True:
+            line = self._readline().strip()
+            if not line:
+                break
+            key, _, value = line.partition(b':')
+            if key.strip().lower() == b'content-length':
+                length = int(value.strip())
+
+        if length is not None:
+            return self._read_exact(length)
+        return self._read_until_delimiter()
+
+
+def _boundary(content_type: str) -> bytes:
+    for item in content_type.split(';'):
+        key, _, value = item.strip().partition('=')
+        if key.lower() == 'boundary':
+            value = value.strip().strip('"')
+            return (value[2:] if value.startswith('--') else value).encode()
+    raise ValueError('no boundary in content type ' + repr(content_type))
+
+
+class MjpegRestreamer:
+    """
+    Single upstream MJPEG connection to one camera, fanned out to any number of subscribers.
+
+    Args:
+        camera: :class:`axis_vapix.Camera` to stream from
+        timeout: connect and read timeout of the upstream connection, in seconds
+        max_backoff: maximal wait between two reconnection attempts, in seconds
+        **params: arguments of ``mjpg/video.cgi`` (resolution, fps, compression, camera ...)
+
+    Example:
+        restreamer = MjpegRestreamer(camera, resolution='640x480', fps=10)
+        restreamer.start()
+        with restreamer.subscribe() as frames:
+            for frame in frames:
+                process(frame.data)
+    """
+
+    def __init__(self, camera, *, timeout: float = 10.0, max_backoff: float = 30.0, **params):
+        self.camera = camera
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.params = {key: value for (key, value) in params.items() if value is not None}
+
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._running = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._response = None
+        self._reopen = False
+
+        self.latest = None
+        self.frames = 0
+        self.bytes = 0
+        self.reconnects = 0
+
+    @property
+    def running(self) -> bool:
+        return self._running.is_set()
+
+    def start(self):
+        """
+        Open the upstream connection in a background thread. Does nothing if already running.
+        """
+        if self._running.is_set():
+            return
+        self._running.set()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name=f'restream-{getattr(self.camera, "ip", "?")}')
+        self._thread.start()
+
+    def stop(self):
+        """
+        Close the upstream connection and all subscriptions.
+        """
+        self._running.clear()
+        self._stopped.set()
+        resp = self._response
+        if resp is not None:
+            resp.close()
+        if self._thread is not None:
+            self._thread.join(self.timeout)
+            self._thread = None
+        with self._lock:
+            subscribers, self._subscribers = self._subscribers, []
+        for subscriber in subscribers:
+            subscriber._detach = None
+            subscriber.close()
+
+    def update_params(self, **params):
+        """
+        Change arguments of ``mjpg/video.cgi`` and reopen the upstream connection with them.
+        Subscribers stay attached and only miss the frames of the reconnection.
+
+        Args:
+            **params: arguments to change, None removes an argument
+        """
+        for key, value in params.items():
+            if value is None:
+                self.params.pop(key, None)
+            else:
+                self.params[key] = value
+        resp = self._response
+        if resp is not None:
+            self._reopen = True
+            resp.close()
+
+    def subscribe(self, maxsize: int = 4) -> Subscription:
+        """
+        Register a new consumer, starting the upstream connection if needed.
+
+        Args:
+            maxsize: frames the consumer may lag behind before its oldest frames are dropped
+
+        Returns:
+            A :class:`Subscription` receiving every frame from now on.
+        """
+        subscription = Subscription(maxsize)
+        subscription._detach = self._unsubscribe
+        with self._lock:
+            self._subscribers.append(subscription)
+        self.start()
+        return subscription
+
+    def _unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            Upstream counters and the drop count of every subscriber.
+        """
+        with self._lock:
+            subscribers = list(self._subscribers)
+        return {
+            'frames': self.frames,
+            'bytes': self.bytes,
+            'reconnects': self.reconnects,
+            'subscribers': len(subscribers),
+            'dropped': [subscriber.dropped for subscriber in subscribers],
+        }
+
+    def _publish(self, data: bytes):
+        frame = Frame(self.frames, time.time(), data)
+        self.latest = frame
+        self.frames += 1
+        self.bytes += len(data)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber._push(frame)
+
+    def _run(self):
+        backoff = 1.0
+        url = self.camera.cam_url + _MJPEG_PATH
+        while self._running.is_set():
+            try:
+                resp = self.camera._session.get(url, params=self.params, stream=True,
+                                                timeout=self.timeout)
+                self._response = resp
+                if resp.status_code != 200:
+                    _log.error('MJPEG stream of %s refused: %s %s', url, resp.status_code,
+                               resp.text[:200])
+                else:
+                    reader = _MultipartReader(resp.raw, _boundary(resp.headers.get('Content-Type', '')))
+                    backoff = 1.0
+                    while self._running.is_set():
+                        self._publish(reader.read_part())
+            except (requests.RequestException, EOFError, ValueError, OSError) as err:
+                if self._running.is_set() and not self._reopen:
+                    _log.warning('MJPEG stream of %s interrupted: %s', url, err)
+            finally:
+                if self._response is not None:
+                    self._response.close()
+                    self._response = None
+
+            if self._reopen:
+                self._reopen = False
+            elif self._running.is_set():
+                self.reconnects += 1
+                self._stopped.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+
+class _RestreamHandler(BaseHTTPRequestHandler):
+    server_version = 'axis-vapix-restream'
+
+    def log_message(self, format, *args):  # pylint: disable=W0622
+        _log.debug('%s - ' + format, self.address_string(), *args)
+
+    def do_GET(self):  # pylint: disable=C0103
+        name, _, tail = self.path.strip('/').partition('/')
+        restreamer = self.server.restreamers.get(name)
+        if restreamer is None:
+            self.send_error(404, 'unknown stream')
+            return
+
+        if tail.split('?')[0] == 'snapshot.jpg':
+            frame = restreamer.latest
+            if frame is None:
+                self.send_error(503, 'no frame received yet')
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Length', str(len(frame.data)))
+            self.end_headers()
+            self.wfile.write(frame.data)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=' + _BOUNDARY.decode())
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        with restreamer.subscribe(self.server.client_queue) as subscription:
+            try:
+                for frame in subscription:
+                    self.wfile.write(b'--' + _BOUNDARY + b'\r\nContent-Type: image/jpeg\r\n'
+                                     b'Content-Length: %d\r\n\r\n' % len(frame.data))
+                    self.wfile.write(frame.data)
+                    self.wfile.write(b'\r\n')
+                    self.wfile.flush()
+            except OSError:
+                pass
+
+
+class RestreamServer(ThreadingHTTPServer):
+    """
+    Local HTTP server re-publishing restreamers.
+
+    ``GET /<name>`` returns the MJPEG stream and ``GET /<name>/snapshot.jpg`` the latest frame of
+    the restreamer registered under ``name``.
+
+    Args:
+        restreamers: dictionary name -> :class:`MjpegRestreamer`
+        host: listening address
+        port: listening port, 0 picks a free one
+        client_queue: frames a HTTP client may lag behind before frames are dropped for it
+    """
+    daemon_threads = True
+
+    def __init__(self, restreamers: dict, host: str = '127.0.0.1', port: int = 8090,
+                 client_queue: int = 2):
+        super().__init__((host, port), _RestreamHandler)
+        self.restreamers = restreamers
+        self.client_queue = client_queue
+        self._thread = None
+
+    def start(self):
+        """
+        Serve in a background thread.
+        """
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True,
+                                        name='restream-server')
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop serving. The restreamers are left running.
+        """
+        self.shutdown()
+        self.server_close()
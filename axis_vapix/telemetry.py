@@ -0,0 +1,395 @@
+"""
+Compact time series store of PTZ telemetry.
+
+``get_status`` answers with a dictionary of strings, about a kilobyte per sample once kept in a
+list; days of 10 Hz positions from hundreds of cameras do not fit that way. :class:`TelemetryStore`
+keeps per camera typed contiguous columns, timestamp as float64 and pan, tilt, zoom, focus and
+iris as float32, 28 bytes per sample, in append-only chunks of a fixed number of samples.
+
+Time range queries find the chunks by binary search over their first timestamps, then the rows
+with ``searchsorted`` on the timestamp column, and return NumPy views without copying when the
+range lies in one chunk. Downsampling reduces buckets of a fixed interval with ``reduceat``.
+
+Memory stays bounded: the chunk a camera is writing grows by doubling up to ``chunk_size``
+samples, and when the chunks held in memory, the ones being written included, exceed
+``memory_limit``, the oldest full ones are written to files and mapped back read-only, so queries
+keep working on them unchanged while the operating system pages them in and out. When that is
+not enough, the largest chunks being written are sealed early and spilled the same way, and
+their cameras start new chunks. A chunk being written is only sealed once it holds 1024 samples,
+so every camera needs about 28 KB of memory whatever the limit.
+
+Requires ``numpy`` (``pip install axis_vapix[analytics]``).
+"""
+import os
+import time
+import bisect
+import shutil
+import logging
+import tempfile
+import threading
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+_log = logging.getLogger(__name__)
+
+COLUMNS = ('timestamp', 'pan', 'tilt', 'zoom', 'focus', 'iris')
+_NAN = float('nan')
+# samples of a new chunk, the least a chunk being written holds before it may be sealed early
+_INITIAL_CAPACITY = 1024
+_DTYPES = {'timestamp': 'float64', 'pan': 'float32', 'tilt': 'float32', 'zoom': 'float32',
+           'focus': 'float32', 'iris': 'float32'}
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError('the telemetry store requires numpy, '
+                          'install it with "pip install axis_vapix[analytics]"')
+
+
+class _Chunk:
+    """
+    Columns of up to ``limit`` samples, in memory or mapped from a file. The columns start small
+    and double when full, so a camera that just started costs little.
+    """
+
+    def __init__(self, limit: int, capacity: int = _INITIAL_CAPACITY):
+        self.limit = limit
+        self.columns = {name: np.empty(min(capacity, limit), dtype=_DTYPES[name])
+                        for name in COLUMNS}
+        self.size = 0
+        self.path = None
+
+    @property
+    def capacity(self) -> int:
+        return len(self.columns['timestamp'])
+
+    @property
+    def full(self) -> bool:
+        return self.size == self.limit
+
+    def grow(self):
+        # views handed out before keep the old arrays, which hold the same samples
+        capacity = min(self.limit, 2 * self.capacity)
+        for name, column in self.columns.items():
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            self.columns[name] = grown
+
+    @property
+    def first(self) -> float:
+        return float(self.columns['timestamp'][0])
+
+    @property
+    def last(self) -> float:
+        return float(self.columns['timestamp'][self.size - 1])
+
+    @property
+    def nbytes(self) -> int:
+        return sum(column.nbytes for column in self.columns.values()) if self.path is None else 0
+
+    def view(self, begin: int = 0, end: int = None) -> dict:
+        end = self.size if end is None else end
+        return {name: column[begin:end] for name, column in self.columns.items()}
+
+    def spill(self, path: str):
+        """
+        Write the columns one after the other into a file and map them back read-only, with
+        one mapping for all columns.
+        """
+        with open(path, 'wb') as var:
+            for name in COLUMNS:
+                var.write(self.columns[name][:self.size].tobytes())
+        mapped = np.memmap(path, dtype=np.uint8, mode='r')
+        offset, columns = 0, {}
+        for name in COLUMNS:
+            dtype = np.dtype(_DTYPES[name])
+            end = offset + dtype.itemsize * self.size
+            columns[name] = mapped[offset:end].view(dtype)
+            offset = end
+        self.columns = columns
+        self.path = path
+
+
+class _Series:
+    """
+    The chunks of one camera and the binary search index over their first timestamps.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.firsts = []
+        self.count = 0
+
+
+class TelemetryStore:
+    """
+    PTZ telemetry of many cameras in typed columns.
+
+    Args:
+        chunk_size: samples per chunk, 36000 is one hour at 10 Hz
+        memory_limit: bytes of chunks kept in memory, the ones being written included, before
+            the oldest full chunks are spilled, then the largest ones being written
+        spill_dir: directory of the spilled chunks, a temporary one when None; the files are
+            removed by :meth:`close`
+
+    Example:
+        store = TelemetryStore(memory_limit=512 * 2 ** 20)
+        store.record(camera)                              # one get_status
+        store.append('10.0.0.5', time.time(), pan=12.5, tilt=-30, zoom=1)
+        data = store.range('10.0.0.5', start, end)        # dictionary of NumPy arrays
+        per_minute = store.downsample('10.0.0.5', start, end, 60)
+    """
+
+    def __init__(self, *, chunk_size: int = 36000, memory_limit: int = 256 * 2 ** 20,
+                 spill_dir: str = None):
+        _require_numpy()
+        self.chunk_size = chunk_size
+        self.memory_limit = memory_limit
+        self._own_dir = spill_dir is None
+        self.spill_dir = spill_dir or tempfile.mkdtemp(prefix='axis-telemetry-')
+        os.makedirs(self.spill_dir, exist_ok=True)
+        self._series = {}
+        # full chunks still in memory, oldest first
+        self._resident = []
+        self._spilled = 0
+        # bytes of all chunks in memory, the ones being written included
+        self._memory = 0
+        self._lock = threading.RLock()
+        self.dropped = 0
+
+    def _chunk(self, camera: str) -> _Chunk:
+        series = self._series.get(camera)
+        if series is None:
+            series = self._series[camera] = _Series()
+        if not series.chunks or series.chunks[-1].full:
+            if series.chunks and series.chunks[-1].path is None:
+                self._resident.append(series.chunks[-1])
+            chunk = _Chunk(self.chunk_size)
+            self._memory += chunk.nbytes
+            series.chunks.append(chunk)
+            series.firsts.append(None)
+        elif series.chunks[-1].size == series.chunks[-1].capacity:
+            chunk = series.chunks[-1]
+            before = chunk.nbytes
+            chunk.grow()
+            self._memory += chunk.nbytes - before
+        return series.chunks[-1]
+
+    def _spill(self, chunk: _Chunk):
+        self._memory -= chunk.nbytes
+        self._spilled += 1
+        chunk.spill(os.path.join(self.spill_dir, f'{self._spilled:08d}.col'))
+
+    def _enforce_limit(self):
+        while self._resident and self._memory > self.memory_limit:
+            self._spill(self._resident.pop(0))
+        if self._memory <= self.memory_limit:
+            return
+        # the chunks being written are sealed early, the largest first, down to three quarters
+        # of the limit so that the next samples do not seal another one right away
+        growing = sorted((series.chunks[-1] for series in self._series.values()
+                          if series.chunks and series.chunks[-1].path is None and
+                          series.chunks[-1].size >= _INITIAL_CAPACITY),
+                         key=lambda chunk: chunk.nbytes, reverse=True)
+        for chunk in growing:
+            if self._memory <= self.memory_limit * 3 // 4:
+                break
+            chunk.limit = chunk.size
+            self._spill(chunk)
+
+    def append(self, camera: str, timestamp: float, pan: float = _NAN, tilt: float = _NAN,
+               zoom: float = _NAN, focus: float = _NAN, iris: float = _NAN):
+        """
+        Add one sample. Samples of a camera must come in time order; older ones are dropped
+        and counted in ``dropped``.
+
+        Args:
+            camera: camera address or any name of the series
+            timestamp: seconds since the epoch
+            pan, tilt, zoom, focus, iris: values, NaN when unknown
+        """
+        with self._lock:
+            series = self._series.get(camera)
+            if series is not None and series.count and timestamp < series.chunks[-1].last:
+                self.dropped += 1
+                return
+            chunk = self._chunk(camera)
+            series = self._series[camera]
+            row = chunk.size
+            columns = chunk.columns
+            columns['timestamp'][row] = timestamp
+            columns['pan'][row] = pan
+            columns['tilt'][row] = tilt
+            columns['zoom'][row] = zoom
+            columns['focus'][row] = focus
+            columns['iris'][row] = iris
+            if row == 0:
+                series.firsts[-1] = timestamp
+            chunk.size += 1
+            series.count += 1
+            if self._memory > self.memory_limit:
+                self._enforce_limit()
+
+    def append_status(self, camera: str, status: dict, timestamp: float = None):
+        """
+        Add the dictionary returned by :meth:`axis_vapix.Camera.get_status`.
+        """
+        if not status:
+            return
+
+        def value(name):
+            try:
+                return float(status[name])
+            except (KeyError, TypeError, ValueError):
+                return np.nan
+
+        self.append(camera, time.time() if timestamp is None else timestamp, value('pan'),
+                    value('tilt'), value('zoom'), value('focus'), value('iris'))
+
+    def record(self, camera):
+        """
+        Read the status of a camera and add it, stamped at the middle of the request.
+        """
+        sent = time.time()
+        status = camera.get_status()
+        self.append_status(camera.ip, status, (sent + time.time()) / 2)
+
+    def range(self, camera: str, start: float = None, end: float = None,
+              columns=COLUMNS) -> dict:
+        """
+        Samples with ``start <= timestamp < end``.
+
+        Args:
+            camera: series name
+            start: first time, from the beginning when None
+            end: end time, to the end when None
+            columns: names of the columns wanted
+
+        Returns:
+            Dictionary column -> NumPy array; views into the store when the range lies in one
+            chunk, read-only for spilled chunks and not to be modified.
+        """
+        with self._lock:
+            series = self._series.get(camera)
+            if series is None or not series.count:
+                return {name: np.empty(0, dtype=_DTYPES[name]) for name in columns}
+            firsts = series.firsts
+            low = 0 if start is None else max(0, bisect.bisect_right(firsts, start) - 1)
+            high = len(firsts) if end is None else bisect.bisect_left(firsts, end)
+            parts = []
+            for chunk in series.chunks[low:max(low + 1, high)]:
+                stamps = chunk.columns['timestamp'][:chunk.size]
+                begin = 0 if start is None else int(np.searchsorted(stamps, start, 'left'))
+                stop = chunk.size if end is None else int(np.searchsorted(stamps, end, 'left'))
+                if stop > begin:
+                    view = chunk.view(begin, stop)
+                    parts.append({name: view[name] for name in columns})
+        if not parts:
+            return {name: np.empty(0, dtype=_DTYPES[name]) for name in columns}
+        if len(parts) == 1:
+            return parts[0]
+        return {name: np.concatenate([part[name] for part in parts]) for name in columns}
+
+    def chunks(self, camera: str):
+        """
+        Iterate over all samples of a camera chunk by chunk, as dictionaries of NumPy views,
+        without copying.
+        """
+        with self._lock:
+            chunks = list(self._series.get(camera, _Series()).chunks)
+        for chunk in chunks:
+            if chunk.size:
+                yield chunk.view()
+
+    def latest(self, camera: str) -> dict:
+        """
+        The newest sample of a camera as dictionary column -> value, or None.
+        """
+        with self._lock:
+            series = self._series.get(camera)
+            if series is None or not series.count:
+                return None
+            chunk = series.chunks[-1]
+            return {name: column[chunk.size - 1].item() for name, column in chunk.columns.items()}
+
+    def downsample(self, camera: str, start: float, end: float, interval: float,
+                   how: str = 'mean', columns=COLUMNS[1:]) -> dict:
+        """
+        Reduce the samples of a time range to one value per bucket of ``interval`` seconds.
+
+        Args:
+            camera: series name
+            start: first time
+            end: end time
+            interval: bucket length, in seconds
+            how: 'mean', 'min', 'max', 'first' or 'last'
+            columns: value columns to reduce
+
+        Returns:
+            Dictionary with 'timestamp', the start of every non-empty bucket, and the reduced
+            columns.
+        """
+        names = ('timestamp',) + tuple(columns)
+        data = self.range(camera, start, end, names)
+        stamps = data['timestamp']
+        if not len(stamps):
+            return {name: np.empty(0, dtype=_DTYPES[name]) for name in names}
+        buckets = np.floor((stamps - start) / interval).astype(np.int64)
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        result = {'timestamp': start + buckets[starts] * interval}
+        for name in columns:
+            values = data[name]
+            if how == 'mean':
+                counts = np.diff(np.r_[starts, len(values)])
+                result[name] = (np.add.reduceat(values.astype(np.float64), starts) /
+                                counts).astype(values.dtype)
+            elif how == 'min':
+                result[name] = np.minimum.reduceat(values, starts)
+            elif how == 'max':
+                result[name] = np.maximum.reduceat(values, starts)
+            elif how == 'first':
+                result[name] = values[starts]
+            elif how == 'last':
+                result[name] = values[np.r_[starts[1:], len(values)] - 1]
+            else:
+                raise ValueError(f'unknown reduction {how!r}')
+        return result
+
+    def cameras(self) -> list:
+        return list(self._series)
+
+    def __len__(self):
+        return sum(series.count for series in self._series.values())
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            Dictionary with the numbers of cameras, samples, chunks and spilled chunks, the
+            bytes held in memory and the samples dropped for coming out of order.
+        """
+        with self._lock:
+            chunks = [chunk for series in self._series.values() for chunk in series.chunks]
+            return {'cameras': len(self._series), 'samples': len(self), 'chunks': len(chunks),
+                    'spilled': sum(chunk.path is not None for chunk in chunks),
+                    'memory': sum(chunk.nbytes for chunk in chunks), 'dropped': self.dropped}
+
+    def close(self):
+        """
+        Drop all samples and remove the spilled chunks.
+        """
+        with self._lock:
+            paths = [chunk.path for series in self._series.values() for chunk in series.chunks
+                     if chunk.path is not None]
+            self._series.clear()
+            self._resident.clear()
+            self._memory = 0
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError as err:
+                _log.warning('Could not remove %s: %s', path, err)
+        if self._own_dir:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
@@ -0,0 +1,371 @@
+"""
+Recording and replay of VAPIX traffic.
+
+Field performance problems are only reproducible with the exact answers and timings of the real
+cameras. :func:`record` puts a :class:`RecordingAdapter` under the session of each camera, below
+``Camera._command`` and every other module using the session, which logs every exchange: method,
+URL, request body, status, headers, body and timing, digest challenges included. The exchanges
+go to one compact, append-only file: binary length-prefixed records, compressed in batches, each
+batch a complete gzip member or zstd frame appended to the file, so a crash loses at most the
+batch in memory and the file stays readable.
+
+:func:`replay` mounts a :class:`ReplayAdapter` instead, which serves the recorded exchanges back
+to the same cameras without network, in recorded order per request, at the original latency or
+faster, so regressions and benchmarks run offline. Volatile arguments, like the ``timestamp``
+of PTZ commands, are left out of the matching.
+
+    writer = record(cameras, 'site12.vapix.gz')
+    ... run the workload ...
+    writer.close()
+
+    replay(cameras, 'site12.vapix.gz', speed=10)
+"""
+import json
+import gzip
+import zlib
+import time
+import struct
+import atexit
+import logging
+import datetime
+import threading
+import collections
+import urllib.parse
+from typing import NamedTuple, Optional
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+_log = logging.getLogger(__name__)
+
+# started, elapsed, status, flags; then six length-prefixed fields
+_RECORD = struct.Struct('<dfHB')
+_LENGTH = struct.Struct('<I')
+_ERROR = 1
+_COMPRESSIONS = ('gzip', 'zstd')
+# content type of the streams without end, never recorded
+_ENDLESS = 'multipart/x-mixed-replace'
+# what the decompressors raise at a batch cut short
+_TORN_ERRORS = (EOFError, struct.error, zlib.error, gzip.BadGzipFile) + \
+    ((zstandard.ZstdError,) if zstandard is not None else ())
+
+
+class Exchange(NamedTuple):
+    """
+    One recorded request and its answer. ``status`` is 0 and ``reason`` the error message when
+    the request failed without answer.
+    """
+    started: float
+    elapsed: float
+    method: str
+    url: str
+    request_body: bytes
+    status: int
+    reason: str
+    headers: dict
+    body: bytes
+
+    @property
+    def error(self) -> Optional[str]:
+        return self.reason if self.status == 0 else None
+
+
+def _encode(exchange: Exchange) -> bytes:
+    fields = (exchange.method.encode(), exchange.url.encode(), exchange.reason.encode(),
+              exchange.request_body, json.dumps(exchange.headers).encode(), exchange.body)
+    parts = [_RECORD.pack(exchange.started, exchange.elapsed, exchange.status,
+                          _ERROR if exchange.status == 0 else 0)]
+    for field in fields:
+        parts.append(_LENGTH.pack(len(field)))
+        parts.append(field)
+    return b''.join(parts)
+
+
+class TrafficWriter:
+    """
+    Append-only, batch-compressed file of :class:`Exchange`.
+
+    Args:
+        path: file, appended to when it exists
+        compression: 'gzip' or 'zstd' (needs the ``zstandard`` package)
+        level: compression level
+        batch_bytes: uncompressed bytes collected before a batch is written
+        flush_interval: longest time an exchange waits in memory, in seconds; a background
+            thread writes the batch when no exchange comes in
+    """
+
+    def __init__(self, path: str, *, compression: str = 'gzip', level: int = None,
+                 batch_bytes: int = 1024 * 1024, flush_interval: float = 5.0):
+        if compression not in _COMPRESSIONS:
+            raise ValueError(f'compression must be one of {_COMPRESSIONS}, not {compression!r}')
+        if compression == 'zstd' and zstandard is None:
+            raise ImportError('zstd compression requires the zstandard package, '
+                              'install it with "pip install axis_vapix[zstd]"')
+        self.path = path
+        self.compression = compression
+        self.level = level
+        self.batch_bytes = batch_bytes
+        self.flush_interval = flush_interval
+        self._buffer = bytearray()
+        self._flushed = time.monotonic()
+        self._lock = threading.Lock()
+        self.exchanges = 0
+        self.written = 0
+        self._closed = threading.Event()
+        self._thread = None
+        atexit.register(self.close)
+
+    def _run(self):
+        while not self._closed.wait(self.flush_interval / 2):
+            with self._lock:
+                if self._buffer and time.monotonic() - self._flushed > self.flush_interval:
+                    self._flush()
+
+    def write(self, exchange: Exchange):
+        with self._lock:
+            if self._thread is None and not self._closed.is_set():
+                self._thread = threading.Thread(target=self._run, name='traffic-writer',
+                                                daemon=True)
+                self._thread.start()
+            self._buffer += _encode(exchange)
+            self.exchanges += 1
+            if len(self._buffer) >= self.batch_bytes or \
+                    time.monotonic() - self._flushed > self.flush_interval:
+                self._flush()
+
+    def _flush(self):
+        self._flushed = time.monotonic()
+        if not self._buffer:
+            return
+        if self.compression == 'gzip':
+            batch = gzip.compress(bytes(self._buffer), 6 if self.level is None else self.level)
+        else:
+            batch = zstandard.ZstdCompressor(level=3 if self.level is None else self.level) \
+                .compress(bytes(self._buffer))
+        with open(self.path, 'ab') as var:
+            var.write(batch)
+        self.written += len(batch)
+        self._buffer.clear()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+        atexit.unregister(self.close)
+
+
+def read_traffic(path: str):
+    """
+    Iterate over the exchanges of a file written by :class:`TrafficWriter`. A file whose last
+    batch was cut short, by a crash during the write, yields the exchanges before it.
+
+    Yields:
+        :class:`Exchange`
+    """
+    with open(path, 'rb') as raw:
+        magic = raw.read(4)
+        raw.seek(0)
+        if magic == b'\x28\xb5\x2f\xfd':
+            if zstandard is None:
+                raise ImportError('reading zstd traffic requires the zstandard package, '
+                                  'install it with "pip install axis_vapix[zstd]"')
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+        else:
+            stream = gzip.GzipFile(fileobj=raw, mode='rb')
+        with stream:
+            try:
+                yield from _read_records(stream, path)
+            except _TORN_ERRORS as err:
+                _log.warning('Traffic file %s ends in a damaged batch: %s', path, err)
+
+
+def _read_records(stream, path: str):
+    while True:
+        head = stream.read(_RECORD.size)
+        if len(head) < _RECORD.size:
+            if head:
+                _log.warning('Traffic file %s ends in a partial record', path)
+            return
+        started, elapsed, status, _ = _RECORD.unpack(head)
+        fields = []
+        for _ in range(6):
+            length = _LENGTH.unpack(stream.read(_LENGTH.size))[0]
+            field = stream.read(length)
+            if len(field) < length:
+                raise EOFError('record cut short')
+            fields.append(field)
+        method, url, reason, request_body, headers, body = fields
+        yield Exchange(started, elapsed, method.decode(), url.decode(), request_body,
+                       status, reason.decode(), json.loads(headers), body)
+
+
+class RecordingAdapter(BaseAdapter):
+    """
+    Adapter passing requests to another adapter and writing every exchange to a
+    :class:`TrafficWriter`. Streamed answers that end, like logs and server reports, are read
+    whole and recorded, and still iterate as streams; endless ``multipart/x-mixed-replace``
+    streams, like MJPEG video, pass unrecorded.
+    """
+
+    def __init__(self, adapter, writer: TrafficWriter):
+        super().__init__()
+        self.adapter = adapter
+        self.writer = writer
+
+    def send(self, request, stream=False, **kwargs):
+        started = time.time()
+        start = time.perf_counter()
+        body = request.body.encode() if isinstance(request.body, str) else request.body or b''
+        try:
+            resp = self.adapter.send(request, stream=stream, **kwargs)
+            if stream and resp.headers.get('Content-Type', '').lower().startswith(_ENDLESS):
+                return resp
+            # iter_content and iter_lines serve the content read here
+            content = resp.content
+        except requests.RequestException as err:
+            self.writer.write(Exchange(started, time.perf_counter() - start, request.method,
+                                       request.url, body, 0, f'{type(err).__name__}: {err}', {},
+                                       b''))
+            raise
+        self.writer.write(Exchange(started, time.perf_counter() - start, request.method,
+                                   request.url, body, resp.status_code, resp.reason or '',
+                                   dict(resp.headers), content))
+        # the digest authentication sends its retry through the connection of the answer
+        resp.connection = self
+        return resp
+
+    def close(self):
+        self.adapter.close()
+
+
+def _key(method: str, url: str, body: bytes, ignore) -> tuple:
+    parts = urllib.parse.urlsplit(url)
+    query = sorted((name, value) for name, value in urllib.parse.parse_qsl(
+        parts.query, keep_blank_values=True) if name not in ignore)
+    return method, parts.scheme, parts.netloc, parts.path, tuple(query), body
+
+
+class ReplayAdapter(BaseAdapter):
+    """
+    Adapter answering requests with recorded exchanges, without network.
+
+    Each request takes the next unused exchange recorded for the same method, URL and body; when
+    all are used the last one answers again, so polling loops can run longer than recorded.
+
+    Args:
+        exchanges: iterable of :class:`Exchange`
+        speed: 1 waits the recorded latency, 10 a tenth of it, None or 0 not at all
+        ignore: query arguments left out of the matching
+        strict: raise for a request never recorded instead of answering 404
+    """
+
+    def __init__(self, exchanges, *, speed: float = 1.0, ignore=('timestamp',),
+                 strict: bool = False):
+        super().__init__()
+        self.speed = speed
+        self.ignore = set(ignore)
+        self.strict = strict
+        self._exchanges = collections.defaultdict(collections.deque)
+        self._last = {}
+        self._lock = threading.Lock()
+        self.served = 0
+        self.missed = 0
+        for exchange in exchanges:
+            key = _key(exchange.method, exchange.url, exchange.request_body, self.ignore)
+            self._exchanges[key].append(exchange)
+
+    def _next(self, request) -> Optional[Exchange]:
+        body = request.body.encode() if isinstance(request.body, str) else request.body or b''
+        key = _key(request.method, request.url, body, self.ignore)
+        with self._lock:
+            queue = self._exchanges.get(key)
+            if queue:
+                self._last[key] = queue.popleft()
+            exchange = self._last.get(key)
+            if exchange is None:
+                self.missed += 1
+            else:
+                self.served += 1
+            return exchange
+
+    def send(self, request, stream=False, timeout=None, **kwargs):
+        exchange = self._next(request)
+        if exchange is None:
+            if self.strict:
+                raise requests.ConnectionError(f'not recorded: {request.method} {request.url}',
+                                               request=request)
+            exchange = Exchange(time.time(), 0.0, request.method, request.url, b'', 404,
+                                'Not recorded', {'Content-Type': 'text/plain'}, b'Not recorded')
+        if self.speed:
+            time.sleep(exchange.elapsed / self.speed)
+        if exchange.error:
+            raise requests.ConnectionError(f'recorded error: {exchange.error}', request=request)
+
+        resp = requests.Response()
+        resp.status_code = exchange.status
+        resp.reason = exchange.reason
+        resp.headers = CaseInsensitiveDict(exchange.headers)
+        resp.encoding = get_encoding_from_headers(resp.headers)
+        resp._content = exchange.body
+        resp._content_consumed = True
+        resp.url = request.url
+        resp.request = request
+        resp.connection = self
+        resp.elapsed = datetime.timedelta(seconds=exchange.elapsed / self.speed
+                                          if self.speed else 0)
+        return resp
+
+    def stats(self) -> dict:
+        return {'served': self.served, 'missed': self.missed}
+
+    def close(self):
+        pass
+
+
+def record(cameras, path: str, **options) -> TrafficWriter:
+    """
+    Record the traffic of cameras into one file, until the writer is closed.
+
+    Args:
+        cameras: list of :class:`axis_vapix.Camera`
+        path: traffic file
+        **options: options of :class:`TrafficWriter`
+
+    Returns:
+        The :class:`TrafficWriter`; closing it writes the last batch.
+    """
+    writer = TrafficWriter(path, **options)
+    for camera in cameras:
+        adapter = camera._session.get_adapter(camera.cam_url)
+        camera._session.mount(camera.cam_url + '/', RecordingAdapter(adapter, writer))
+    return writer
+
+
+def replay(cameras, path: str, **options) -> ReplayAdapter:
+    """
+    Serve cameras from a traffic file instead of the network.
+
+    Args:
+        cameras: list of :class:`axis_vapix.Camera`, with the addresses recorded
+        path: traffic file
+        **options: options of :class:`ReplayAdapter`
+
+    Returns:
+        The :class:`ReplayAdapter` shared by the cameras.
+    """
+    adapter = ReplayAdapter(read_traffic(path), **options)
+    for camera in cameras:
+        camera._session.mount(camera.cam_url + '/', adapter)
+    return adapter
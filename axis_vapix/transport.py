@@ -0,0 +1,303 @@
+"""
+HTTP and HTTPS transport of a camera.
+
+:func:`base_url` is the single place where scheme, host, port and path prefix become the base URL
+that every request of a :class:`axis_vapix.Camera` starts with.
+
+For HTTPS, :class:`TLSAdapter` keeps the handshake cost off the request path: connections are
+pooled and kept alive, so the digest nonce and the TLS session of one connection serve many
+requests, and when a connection has to be opened again the TLS session of the previous one is
+offered for resumption, which skips the certificate exchange. Cameras mostly carry self-signed
+certificates, so instead of a CA the adapter can pin the SHA-256 fingerprint of each camera
+certificate; :func:`certificate_fingerprint` reads it once for trust on first use.
+
+Running the module benchmarks the per-request overhead of the transports against one camera:
+
+    python -m axis_vapix.transport 192.168.0.90 root pass --count 50
+"""
+import ssl
+import time
+import socket
+import hashlib
+import weakref
+import logging
+import argparse
+import threading
+import statistics
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPDigestAuth
+
+_log = logging.getLogger(__name__)
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def base_url(scheme: str, host: str, port: int = None, base_path: str = '') -> str:
+    """
+    Build the base URL of a camera.
+
+    Args:
+        scheme: 'http' or 'https'
+        host: address or name of the camera, may already carry a port
+        port: port, None or the default port of the scheme leaves it out
+        base_path: path prefix, for cameras behind a reverse proxy
+
+    Returns:
+        The base URL without trailing slash, like ``https://10.0.0.5:8443/cam12``.
+    """
+    if scheme not in DEFAULT_PORTS:
+        raise ValueError(f"scheme must be 'http' or 'https', not {scheme!r}")
+    if ':' in host and not host.startswith('['):
+        if host.count(':') > 1:
+            host = f'[{host}]'
+        elif port is not None:
+            raise ValueError(f'port given twice: {host} and {port}')
+    url = f'{scheme}://{host}'
+    if port is not None and port != DEFAULT_PORTS[scheme]:
+        url += f':{port}'
+    return url + '/' + base_path.strip('/') if base_path.strip('/') else url
+
+
+def certificate_fingerprint(host: str, port: int = 443, timeout: float = 5.0) -> str:
+    """
+    Read the SHA-256 fingerprint of the certificate a camera presents, without verifying it.
+
+    Returns:
+        Fingerprint as lowercase hexadecimal, as :class:`TLSAdapter` takes it.
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    with socket.create_connection((host, port), timeout) as sock:
+        with context.wrap_socket(sock, server_hostname=host) as tls:
+            return hashlib.sha256(tls.getpeercert(binary_form=True)).hexdigest()
+
+
+class _ResumingContext(ssl.SSLContext):
+    """
+    Client context offering the TLS session of the latest connection to every new one.
+    """
+
+    def __new__(cls, *args, **kwargs):
+        return super().__new__(cls, ssl.PROTOCOL_TLS_CLIENT)
+
+    def __init__(self, verify_default_certs: bool = False):
+        # hostnames and fingerprints are checked by urllib3, which also sets verify_mode
+        self.check_hostname = False
+        if verify_default_certs:
+            self.load_default_certs()
+        self._tls_lock = threading.Lock()
+        self._tls_session = None
+        self._sockets = []
+        self.handshakes = 0
+        self.resumed = 0
+
+    def wrap_socket(self, sock, *args, **kwargs):
+        with self._tls_lock:
+            if kwargs.get('session') is None and self._tls_session is not None:
+                kwargs['session'] = self._tls_session
+        try:
+            tls = super().wrap_socket(sock, *args, **kwargs)
+        except ssl.SSLError:
+            # the next connection makes a full handshake
+            with self._tls_lock:
+                self._tls_session = None
+            raise
+        with self._tls_lock:
+            self.handshakes += 1
+            self.resumed += tls.session_reused
+            self._sockets = [ref for ref in self._sockets if ref() is not None]
+            self._sockets.append(weakref.ref(tls))
+        return tls
+
+    def remember(self):
+        """
+        Keep the session of the newest open connection. TLS 1.3 servers send the session ticket
+        after the handshake, so this is called after a response was read.
+        """
+        with self._tls_lock:
+            for ref in reversed(self._sockets):
+                tls = ref()
+                try:
+                    session = tls.session if tls is not None else None
+                except (OSError, ValueError):
+                    session = None
+                if session is not None:
+                    self._tls_session = session
+                    return
+
+
+class TLSAdapter(HTTPAdapter):
+    """
+    HTTPS adapter with connection pooling, TLS session resumption and certificate pinning.
+
+    The adapter owns the certificate policy: requests lets a ``REQUESTS_CA_BUNDLE`` environment
+    variable override ``Session.verify = False``, which would reject every self-signed camera, so
+    ``verify`` is applied here to every request instead.
+
+    Args:
+        fingerprint: SHA-256 fingerprint of the camera certificate, hexadecimal with or without
+            colons; when given the connection is only accepted with exactly this certificate
+        verify: False, True for the system CAs, or the path of a CA bundle
+        pool_maxsize: connections kept open per camera
+        context: TLS context of another adapter to share, with its session for resumption
+    """
+
+    __attrs__ = HTTPAdapter.__attrs__ + ['fingerprint', 'verify', 'pool_maxsize']
+
+    def __init__(self, fingerprint: str = None, *, verify=False, pool_maxsize: int = 10,
+                 context: _ResumingContext = None, **kwargs):
+        self.fingerprint = fingerprint.replace(':', '').lower() if fingerprint else None
+        self.verify = verify
+        self.pool_maxsize = pool_maxsize
+        self.context = context or _ResumingContext(verify is True)
+        super().__init__(pool_maxsize=pool_maxsize, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['ssl_context'] = self.context
+        if self.fingerprint:
+            kwargs['assert_fingerprint'] = self.fingerprint
+        super().init_poolmanager(*args, **kwargs)
+
+    def send(self, request, *args, **kwargs):
+        kwargs['verify'] = self.verify
+        resp = super().send(request, *args, **kwargs)
+        self.context.remember()
+        return resp
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            Dictionary with the number of TLS handshakes and how many of them were resumed.
+        """
+        return {'handshakes': self.context.handshakes, 'resumed': self.context.resumed}
+
+    def __setstate__(self, state):
+        self.context = _ResumingContext(state.get('verify') is True)
+        super().__setstate__(state)
+
+
+def make_session(user: str, password: str, *, verify=False, fingerprint: str = None,
+                 pool_maxsize: int = 10) -> requests.Session:
+    """
+    Build the authenticated session of a camera, with :class:`TLSAdapter` for HTTPS.
+
+    Args:
+        user: user name
+        password: password
+        verify: False, True for the system CAs, or the path of a CA bundle
+        fingerprint: pinned SHA-256 certificate fingerprint
+        pool_maxsize: connections kept open per camera
+    """
+    session = requests.Session()
+    session.auth = HTTPDigestAuth(user, password)
+    session.verify = verify
+    session.mount('https://', TLSAdapter(fingerprint, verify=verify, pool_maxsize=pool_maxsize))
+    return session
+
+
+def resize_pool(session: requests.Session, url: str, size: int):
+    """
+    Let a session keep at least ``size`` connections open to a camera, for that many requests
+    running at the same time. Smaller pools would open the extra connections for every request
+    and throw them away after it.
+
+    A new adapter with the larger pool is mounted for the base URL of the camera; an HTTPS
+    adapter keeps the certificate policy and the TLS context of the one it replaces. Call it
+    before :func:`axis_vapix.traffic.record` or ``replay``, which mount their own adapters.
+    """
+    prefix = url.rstrip('/') + '/'
+    adapter = session.get_adapter(prefix)
+    if getattr(adapter, 'pool_maxsize', requests.adapters.DEFAULT_POOLSIZE) >= size:
+        return
+    if isinstance(adapter, TLSAdapter):
+        larger = TLSAdapter(adapter.fingerprint, verify=adapter.verify, pool_maxsize=size,
+                            context=adapter.context, max_retries=adapter.max_retries)
+    else:
+        larger = HTTPAdapter(pool_maxsize=size, max_retries=adapter.max_retries)
+        larger.pool_maxsize = size
+    if session.adapters.get(prefix) is adapter:
+        # a pool of an earlier resize, used by this camera only
+        adapter.close()
+    session.mount(prefix, larger)
+
+
+def _timed(session: requests.Session, url: str, count: int, fresh) -> tuple:
+    latencies = []
+    for _ in range(count):
+        if fresh is not None:
+            session = fresh(session)
+        start = time.perf_counter()
+        resp = session.get(url, timeout=10)
+        resp.content
+        latencies.append((time.perf_counter() - start) * 1000)
+        if resp.status_code != 200:
+            raise requests.HTTPError(f'{resp.status_code} {resp.reason}', response=resp)
+    return latencies, session
+
+
+def benchmark(host: str, user: str, password: str, *, count: int = 50,
+              schemes=('http', 'https'), port: dict = None, fingerprint: str = None,
+              path: str = '/axis-cgi/param.cgi?action=list&group=Brand.ProdType') -> dict:
+    """
+    Measure the per-request latency of a camera for each scheme in three modes:
+    ``cold`` opens a new session per request (connection, TLS handshake and digest challenge),
+    ``reconnect`` keeps the session but opens a new connection per request, resuming the TLS
+    session, and ``pooled`` reuses one kept-alive connection.
+
+    Returns:
+        Dictionary scheme -> mode -> dictionary with median, p95 and mean in milliseconds.
+    """
+    port = port or {}
+    results = {}
+    for scheme in schemes:
+        url = base_url(scheme, host, port.get(scheme)) + path
+
+        def new_session(_):
+            return make_session(user, password, fingerprint=fingerprint)
+
+        def close_connections(session):
+            for adapter in session.adapters.values():
+                adapter.poolmanager.clear()
+            return session
+
+        modes = {}
+        for mode, fresh in (('cold', new_session), ('reconnect', close_connections),
+                            ('pooled', None)):
+            session = make_session(user, password, fingerprint=fingerprint)
+            session.get(url, timeout=10)
+            latencies, session = _timed(session, url, count, fresh)
+            latencies.sort()
+            modes[mode] = {'median': statistics.median(latencies),
+                           'p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+                           'mean': statistics.mean(latencies)}
+            if scheme == 'https':
+                modes[mode].update(session.get_adapter(url).stats())
+        results[scheme] = modes
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Per-request overhead of HTTP and HTTPS')
+    parser.add_argument('host')
+    parser.add_argument('user')
+    parser.add_argument('password')
+    parser.add_argument('--count', type=int, default=50)
+    parser.add_argument('--http-port', type=int)
+    parser.add_argument('--https-port', type=int)
+    parser.add_argument('--fingerprint')
+    parser.add_argument('--schemes', default='http,https')
+    args = parser.parse_args()
+
+    report = benchmark(args.host, args.user, args.password, count=args.count,
+                       schemes=args.schemes.split(','), fingerprint=args.fingerprint,
+                       port={'http': args.http_port, 'https': args.https_port})
+    for scheme, modes in report.items():
+        for mode, numbers in modes.items():
+            line = f'{scheme:5} {mode:9} median {numbers["median"]:7.2f} ms  ' \
+                   f'p95 {numbers["p95"]:7.2f} ms  mean {numbers["mean"]:7.2f} ms'
+            if 'handshakes' in numbers:
+                line += f'  handshakes {numbers["handshakes"]} resumed {numbers["resumed"]}'
+            print(line)
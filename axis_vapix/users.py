@@ -0,0 +1,333 @@
+"""
+Bulk user provisioning from one ``pwdgrp.cgi`` snapshot per camera.
+
+:meth:`axis_vapix.Camera.check_user` downloads the whole user and group table for every name it
+checks. :class:`UserProvisioner` downloads it once per camera into a :class:`UserTable`, computes
+the adds, updates and removes needed to reach a desired list locally, applies them, and keeps the
+snapshot up to date with what it changed. Cameras are processed concurrently.
+
+Passwords cannot be read back from a camera, so a desired user with a password is always updated
+(which is what a credential rotation wants), and one without a password is only updated when its
+role differs.
+"""
+import re
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional
+
+import requests
+from requests.auth import HTTPDigestAuth
+
+_log = logging.getLogger(__name__)
+
+_PWDGRP_PATH = '/axis-cgi/pwdgrp.cgi'
+_GROUP_LINE = re.compile(r'^\s*(?P<group>[\w-]+)\s*=\s*"(?P<members>[^"]*)"')
+_TAGS = re.compile(r'<[^>]+>')
+
+# role -> security groups, as create_user and update_user of Camera expand them
+ROLES = {
+    'admin': 'admin:operator:viewer:ptz',
+    'operator': 'operator:viewer:ptz',
+    'ptz': 'viewer:ptz',
+    'viewer': 'viewer',
+}
+
+
+class UserSpec(NamedTuple):
+    """
+    A user as it should exist on the cameras.
+
+    Args:
+        name: user name
+        role: 'admin', 'operator', 'ptz' or 'viewer'
+        password: password to set, None leaves the password of an existing user unchanged
+        group: primary group
+        comment: user description
+    """
+    name: str
+    role: str
+    password: Optional[str] = None
+    group: str = 'users'
+    comment: Optional[str] = None
+
+
+class UserChange(NamedTuple):
+    """
+    One ``pwdgrp.cgi`` request of a provisioning plan; ``action`` is 'add', 'update' or 'remove'.
+    """
+    action: str
+    user: str
+    spec: Optional[UserSpec] = None
+
+    def payload(self) -> dict:
+        if self.action == 'remove':
+            return {'action': 'remove', 'user': self.user}
+        return {'action': self.action, 'user': self.user, 'pwd': self.spec.password,
+                'grp': self.spec.group, 'sgrp': ROLES[self.spec.role],
+                'comment': self.spec.comment}
+
+
+class ProvisionReport(NamedTuple):
+    """
+    Result of provisioning one camera. ``error`` is set when the camera could not be read at all;
+    ``failed`` lists (user, message) for the single requests that failed.
+    """
+    camera: str
+    added: list
+    updated: list
+    removed: list
+    failed: list
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and not self.failed
+
+    @property
+    def changed(self) -> int:
+        return len(self.added) + len(self.updated) + len(self.removed)
+
+
+class UserTable:
+    """
+    Snapshot of the users and groups of one camera.
+
+    Args:
+        groups: dictionary group name -> set of member names
+    """
+
+    def __init__(self, groups: dict):
+        self.groups = groups
+
+    @classmethod
+    def parse(cls, text: str):
+        """
+        Parse the answer of ``pwdgrp.cgi?action=get``, lines like ``viewer="root,op1"``.
+        """
+        groups = {}
+        for line in text.splitlines():
+            match = _GROUP_LINE.match(line)
+            if match:
+                groups[match.group('group')] = {name for name in match.group('members').split(',')
+                                                if name}
+        return cls(groups)
+
+    @classmethod
+    def fetch(cls, camera, timeout: float = 10.0):
+        """
+        Download the table of a camera.
+        """
+        resp = camera._session.get(camera.cam_url + _PWDGRP_PATH, params={'action': 'get'},
+                                   timeout=timeout)
+        if resp.status_code != 200:
+            raise requests.HTTPError(f'{resp.status_code} {resp.reason}', response=resp)
+        return cls.parse(resp.text)
+
+    @property
+    def users(self) -> set:
+        """
+        Names of all accounts: members of the primary ``users`` group and of any security group.
+        """
+        names = set(self.groups.get('users', ()))
+        for role in ('admin', 'operator', 'viewer', 'ptz'):
+            names |= self.groups.get(role, set())
+        return names
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.users
+
+    def role(self, name: str) -> Optional[str]:
+        """
+        Returns:
+            Role of a user as in :data:`ROLES`, None if the user has no security group.
+        """
+        for role in ('admin', 'operator', 'ptz', 'viewer'):
+            if name in self.groups.get(role, ()):
+                return role
+        return None
+
+    def apply(self, change: UserChange):
+        """
+        Record a change that the camera accepted.
+        """
+        for members in self.groups.values():
+            members.discard(change.user)
+        if change.action != 'remove':
+            self.groups.setdefault(change.spec.group, set()).add(change.user)
+            for group in ROLES[change.spec.role].split(':'):
+                self.groups.setdefault(group, set()).add(change.user)
+
+
+def plan(table: UserTable, desired, *, remove_unlisted: bool = False,
+         protected=('root',)) -> list:
+    """
+    Compute the requests that bring a camera from its table to the desired users.
+
+    Args:
+        table: current :class:`UserTable` of the camera
+        desired: iterable of :class:`UserSpec`
+        remove_unlisted: remove the users that are not desired
+        protected: users never updated nor removed unless explicitly desired
+
+    Returns:
+        List of :class:`UserChange`: removes first, then adds, then updates.
+    """
+    desired = {spec.name: spec for spec in desired}
+    for spec in desired.values():
+        if spec.role not in ROLES:
+            raise ValueError(f'role of {spec.name} must be one of {tuple(ROLES)}, '
+                             f'not {spec.role!r}')
+    existing = table.users
+
+    removes = []
+    if remove_unlisted:
+        removes = [UserChange('remove', name) for name in sorted(existing)
+                   if name not in desired and name not in protected]
+    adds, updates = [], []
+    for name, spec in desired.items():
+        if name not in existing:
+            if spec.password is None:
+                raise ValueError(f'user {name} must be created, it needs a password')
+            adds.append(UserChange('add', name, spec))
+        elif spec.password is not None or table.role(name) != spec.role:
+            updates.append(UserChange('update', name, spec))
+    return removes + adds + updates
+
+
+def _failure(resp) -> Optional[str]:
+    text = _TAGS.sub(' ', resp.text).strip()
+    if resp.status_code != 200:
+        return f'{resp.status_code} {text}'.strip()
+    if 'error' in text.lower():
+        return text
+    return None
+
+
+class UserProvisioner:
+    """
+    Brings the accounts of many cameras to a desired list.
+
+    Args:
+        desired: iterable of :class:`UserSpec`
+        remove_unlisted: remove the users that are not desired
+        protected: users never updated nor removed unless explicitly desired
+        workers: cameras provisioned at the same time
+        timeout: timeout of every request, in seconds
+
+    Example:
+        provisioner = UserProvisioner([UserSpec('vms', 'operator', password=new_password)])
+        for ip, report in provisioner.run(cameras).items():
+            if not report.ok:
+                print(ip, report.error or report.failed)
+    """
+
+    def __init__(self, desired, *, remove_unlisted: bool = False, protected=('root',),
+                 workers: int = 32, timeout: float = 10.0):
+        self.desired = list(desired)
+        self.remove_unlisted = remove_unlisted
+        self.protected = tuple(protected)
+        self.workers = workers
+        self.timeout = timeout
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def table(self, camera, refresh: bool = False) -> UserTable:
+        """
+        Returns:
+            The cached :class:`UserTable` of a camera, downloaded on first use.
+        """
+        with self._lock:
+            table = self._tables.get(camera.ip)
+        if table is None or refresh:
+            table = UserTable.fetch(camera, self.timeout)
+            with self._lock:
+                self._tables[camera.ip] = table
+        return table
+
+    def plan(self, camera, refresh: bool = False) -> list:
+        """
+        Returns:
+            The :class:`UserChange` list a camera needs.
+        """
+        return plan(self.table(camera, refresh), self.desired,
+                    remove_unlisted=self.remove_unlisted, protected=self.protected)
+
+    def apply(self, camera, *, dry_run: bool = False, refresh: bool = False,
+              table: UserTable = None) -> ProvisionReport:
+        """
+        Provision one camera.
+
+        The account the camera logs in with is changed last, and the session switches to its new
+        password, so the remaining requests keep working.
+
+        Args:
+            camera: :class:`axis_vapix.Camera`
+            dry_run: only plan, change nothing
+            refresh: download the table again instead of using the cached one
+            table: :class:`UserTable` of the camera already downloaded, cached and used instead
+                of downloading it
+
+        Returns:
+            :class:`ProvisionReport` of the camera; with ``dry_run`` it lists the planned changes.
+        """
+        if table is not None:
+            with self._lock:
+                self._tables[camera.ip] = table
+            refresh = False
+        try:
+            changes = self.plan(camera, refresh)
+        except (requests.RequestException, ValueError) as err:
+            _log.warning('Could not plan the users of %s: %s', camera.ip, err)
+            return ProvisionReport(camera.ip, [], [], [], [], str(err))
+
+        login = getattr(camera._session.auth, 'username', None)
+        changes.sort(key=lambda change: change.user == login)
+        done = {'add': [], 'update': [], 'remove': []}
+        failed = []
+        table = self._tables[camera.ip]
+        for change in changes:
+            if dry_run:
+                done[change.action].append(change.user)
+                continue
+            try:
+                resp = camera._session.get(camera.cam_url + _PWDGRP_PATH,
+                                           params=change.payload(), timeout=self.timeout)
+            except requests.RequestException as err:
+                failed.append((change.user, str(err)))
+                continue
+            message = _failure(resp)
+            if message:
+                failed.append((change.user, message))
+                continue
+            table.apply(change)
+            done[change.action].append(change.user)
+            if change.user == login and change.spec is not None and change.spec.password:
+                camera._session.auth = HTTPDigestAuth(login, change.spec.password)
+
+        if failed:
+            _log.warning('%d user changes failed on %s', len(failed), camera.ip)
+        return ProvisionReport(camera.ip, done['add'], done['update'], done['remove'], failed)
+
+    def run(self, cameras, *, dry_run: bool = False, refresh: bool = False,
+            progress=None) -> dict:
+        """
+        Provision many cameras concurrently.
+
+        Args:
+            cameras: list of :class:`axis_vapix.Camera`
+            dry_run: only plan, change nothing
+            refresh: download the tables again instead of using the cached ones
+            progress: optional callable receiving every :class:`ProvisionReport` as it is done
+
+        Returns:
+            Dictionary camera address -> :class:`ProvisionReport`.
+        """
+        def apply(camera):
+            report = self.apply(camera, dry_run=dry_run, refresh=refresh)
+            if progress is not None:
+                progress(report)
+            return report
+
+        with ThreadPoolExecutor(self.workers) as executor:
+            return {report.camera: report for report in executor.map(apply, cameras)}
@@ -1,6 +1,11 @@
 import setuptools
 
 REQUIREMENTS = [line for line in open('requirements.txt').read().split('\n') if line != '']
+EXTRAS = {
+    'decode': ['numpy>=1.17', 'Pillow>=7.0'],
+    'analytics': ['numpy>=1.17'],
+    'zstd': ['zstandard>=0.15'],
+}
 
 VERSION = '0.2.0'
 AUTHOR = 'Igor Dias, Daniel Henning'
@@ -24,6 +29,10 @@ setuptools.setup(
         "Operating System :: OS Independent",
     ],
     keywords=['axis', 'vapix', 'camera'],
-    python_requires='>=3.6',
+    python_requires='>=3.8',
     install_requires=REQUIREMENTS,
+    extras_require=EXTRAS,
+    entry_points={
+        'console_scripts': ['axis-vapix-load = axis_vapix.loadgen:main'],
+    },
 )
@@ -0,0 +1,222 @@
+"""
+Farm of simulated Axis devices on loopback addresses, for tests of the fleet modules.
+
+Every :class:`SimulatedDevice` is an HTTP/1.1 server on its own address of 127.0.0.0/8, all on the
+same port, behind digest authentication with the realm ``AXIS_<serial>`` of Axis devices. It
+answers ``param.cgi`` lists and updates, ``pwdgrp.cgi?action=get`` with the groups of
+``accounts``, ``ptz.cgi`` with a head per channel in ``heads``, and ``systemlog.cgi`` and
+``accesslog.cgi`` with the lines of ``system_log`` and ``access_log``. Other devices of a network
+are simulated by ``kind``: 'other' answers without Brand parameters, 'router' asks for digest
+authentication with a foreign realm.
+
+    with DeviceFarm([SimulatedDevice('127.0.0.2'), SimulatedDevice('127.0.0.3', kind='other')]) \\
+            as farm:
+        devices = Discovery('root', 'pass', port={'http': farm.port}).run('127.0.0.0/29')
+"""
+import os
+import socket
+import hashlib
+import threading
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+AXIS = 'axis'
+OTHER = 'other'
+ROUTER = 'router'
+
+
+def _md5(text: str) -> str:
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+
+class SimulatedDevice:
+    """
+    One simulated device.
+
+    Args:
+        address: loopback address the device listens on
+        kind: 'axis', 'other' or 'router'
+        user: user accepted by the device
+        password: password of ``user``
+        serial: serial number, also in the digest realm
+        model, name, product_type, firmware: identification parameters
+    """
+
+    def __init__(self, address: str, *, kind: str = AXIS, user: str = 'root',
+                 password: str = 'pass', serial: str = None, model: str = 'M5525-E',
+                 name: str = 'AXIS M5525-E PTZ Network Camera',
+                 product_type: str = 'PTZ Network Camera', firmware: str = '10.12.114'):
+        self.address = address
+        self.kind = kind
+        self.user = user
+        self.password = password
+        self.serial = serial or 'ACCC8E' + os.urandom(3).hex().upper()
+        self.parameters = {
+            'root.Brand.Brand': 'AXIS',
+            'root.Brand.ProdNbr': model,
+            'root.Brand.ProdFullName': name,
+            'root.Brand.ProdType': product_type,
+            'root.Properties.System.SerialNumber': self.serial,
+            'root.Properties.Firmware.Version': firmware,
+        }
+        # account -> security group
+        self.accounts = {user: 'admin'}
+        # channel -> pan, tilt, zoom and speed of its PTZ head
+        self.heads = {1: {'pan': 0.0, 'tilt': 0.0, 'zoom': 1.0, 'speed': 100.0}}
+        self.ptz_requests = 0
+        self.system_log = []
+        self.access_log = []
+        self.nonce = os.urandom(8).hex()
+        self.requests = 0
+        self.unauthorized = 0
+
+    @property
+    def realm(self) -> str:
+        return f'AXIS_{self.serial}' if self.kind == AXIS else 'router'
+
+    def authorized(self, method: str, header: str) -> bool:
+        if not header.startswith('Digest '):
+            return False
+        fields = urllib.request.parse_keqv_list(urllib.request.parse_http_list(header[7:]))
+        if fields.get('nonce') != self.nonce or fields.get('username') != self.user:
+            return False
+        ha1 = _md5(f'{self.user}:{self.realm}:{self.password}')
+        ha2 = _md5(f'{method}:{fields.get("uri")}')
+        expected = _md5(f'{ha1}:{self.nonce}:{fields.get("nc")}:{fields.get("cnonce")}:'
+                        f'{fields.get("qop")}:{ha2}')
+        return fields.get('response') == expected
+
+    def answer(self, method: str, path: str, authorization: str, body: bytes = b'') -> tuple:
+        """
+        Answer a request; the form fields of a POST body count as query arguments.
+
+        Returns:
+            Tuple of status, extra headers and body.
+        """
+        self.requests += 1
+        if self.kind == OTHER:
+            return 200, {}, b'<html>Welcome</html>'
+        if not self.authorized(method, authorization):
+            self.unauthorized += 1
+            challenge = f'Digest realm="{self.realm}", nonce="{self.nonce}", algorithm=MD5, ' \
+                        f'qop="auth"'
+            return 401, {'WWW-Authenticate': challenge}, b'Unauthorized'
+        url = urllib.parse.urlsplit(path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        query.update(urllib.parse.parse_qsl(body.decode()))
+        if self.kind == ROUTER:
+            return 404, {}, b'Not found'
+        logs = {'/axis-cgi/systemlog.cgi': self.system_log,
+                '/axis-cgi/accesslog.cgi': self.access_log}
+        if url.path in logs:
+            return 200, {}, ''.join(line + '\n' for line in logs[url.path]).encode()
+        if url.path == '/axis-cgi/com/ptz.cgi':
+            return self.ptz(query)
+        if url.path == '/axis-cgi/pwdgrp.cgi' and query.get('action') == 'get':
+            groups = {'users': sorted(self.accounts)}
+            for name, group in sorted(self.accounts.items()):
+                groups.setdefault(group, []).append(name)
+            return 200, {}, ''.join(f'{group}="{",".join(names)}"\r\n'
+                                    for group, names in groups.items()).encode()
+        if url.path != '/axis-cgi/param.cgi':
+            return 404, {}, b'Not found'
+        if query.get('action') == 'update':
+            updates = {name if name.startswith('root.') else 'root.' + name: value
+                       for name, value in query.items() if name != 'action'}
+            unknown = [name for name in updates if name not in self.parameters]
+            if unknown:
+                return 200, {}, f'# Error: Error setting parameter {unknown[0]}\r\n'.encode()
+            self.parameters.update(updates)
+            return 200, {}, b'OK'
+        if query.get('action') != 'list':
+            return 404, {}, b'Not found'
+        prefixes = [group if group.startswith('root.') else 'root.' + group
+                    for group in query.get('group', '').split(',')]
+        lines = [f'{name}={value}' for name, value in self.parameters.items()
+                 if any(name.startswith(prefix) for prefix in prefixes)]
+        if not lines:
+            return 200, {}, b'# Error: Error -1 getting param in group\r\n'
+        return 200, {}, ('\r\n'.join(lines) + '\r\n').encode()
+
+
+    def ptz(self, query: dict) -> tuple:
+        self.ptz_requests += 1
+        head = self.heads.get(int(query.get('camera', 1)))
+        if head is None:
+            return 200, {}, b'Error: camera not found\r\n'
+        if query.get('query') == 'position':
+            return 200, {}, ''.join(f'{name}={head[name]:g}\r\n'
+                                    for name in ('pan', 'tilt', 'zoom')).encode()
+        if query.get('query') == 'speed':
+            return 200, {}, f'speed={head["speed"]:g}\r\n'.encode()
+        for name in head:
+            if name in query:
+                head[name] = float(query[name])
+        return 204, {}, b''
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._answer('GET', b'')
+
+    def do_POST(self):
+        self._answer('POST', self.rfile.read(int(self.headers.get('Content-Length') or 0)))
+
+    def _answer(self, method: str, request_body: bytes):
+        status, headers, body = self.server.device.answer(
+            method, self.path, self.headers.get('Authorization', ''), request_body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def free_port(address: str = '127.0.0.1') -> int:
+    with socket.socket() as sock:
+        sock.bind((address, 0))
+        return sock.getsockname()[1]
+
+
+class DeviceFarm:
+    """
+    Runs simulated devices, each on its own loopback address and the same port.
+
+    Args:
+        devices: list of :class:`SimulatedDevice`
+        port: port of all devices, a free one when None
+    """
+
+    def __init__(self, devices, port: int = None):
+        self.devices = list(devices)
+        self.port = port or free_port(self.devices[0].address if self.devices else '127.0.0.1')
+        self._servers = []
+
+    def start(self):
+        for device in self.devices:
+            server = ThreadingHTTPServer((device.address, self.port), _Handler)
+            server.daemon_threads = True
+            server.device = device
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self._servers.append(server)
+        return self
+
+    def stop(self):
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        self._servers = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,123 @@
+import datetime
+import unittest
+
+import numpy as np
+
+from axis_vapix import Camera
+from axis_vapix.accesslog import AccessLogParser
+
+from simulator import DeviceFarm, SimulatedDevice
+
+# 2024-03-01T10:00:00Z
+_BASE = 1709287200.0
+
+
+def _common(second: int, client: str, user: str, path: str, status: int,
+            zone: str = 'Z') -> str:
+    stamp = datetime.datetime.fromtimestamp(_BASE + second, datetime.timezone.utc)
+    if zone != 'Z':
+        # the same instant written in local time of the zone +01:00
+        stamp += datetime.timedelta(hours=1)
+    return f'{stamp:%Y-%m-%dT%H:%M:%S}.250{zone} axis-accc8e012345 [ INFO    ] httpd[99]: ' \
+           f'{client} - {user} [01/Mar/2024:10:00:00 +0000] "GET {path}?a=b HTTP/1.1" {status}'
+
+
+def _short(second: int, client: str, user: str, path: str, status: int) -> str:
+    stamp = datetime.datetime.fromtimestamp(_BASE + second, datetime.timezone.utc)
+    return f'{stamp:%Y-%m-%dT%H:%M:%S}Z axis-accc8e012345 httpd[99]: ' \
+           f'{client} {user} POST {path} {status}'
+
+
+class AccessLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.lines = [
+            _common(0, '10.0.0.2', 'root', '/axis-cgi/param.cgi', 200),
+            _common(10, '10.0.0.3', 'root', '/axis-cgi/com/ptz.cgi', 200, zone='+01:00'),
+            _short(20, '10.0.0.9', 'admin', '/axis-cgi/param.cgi', 401),
+            'a line in no known format',
+            _common(3600, '10.0.0.9', 'guest', '/axis-cgi/jpg/image.cgi', 401),
+            _common(3610, '10.0.0.9', '-', '/axis-cgi/jpg/image.cgi', 401),
+            _short(7300, '10.0.0.2', 'root', '/axis-cgi/com/ptz.cgi', 200),
+        ]
+
+    def parse(self, chunk_size: int = 8 * 1024 * 1024):
+        parser = AccessLogParser(chunk_size=chunk_size)
+        body = '\n'.join(self.lines) + '\n'
+        # delivered in small pieces cutting lines in the middle
+        parser.feed_stream('10.0.0.5', [body[i:i + 37].encode() for i in range(0, len(body), 37)])
+        return parser
+
+    def test_columns(self):
+        for chunk_size in (100, 8 * 1024 * 1024):
+            parser = self.parse(chunk_size)
+            self.assertEqual((parser.lines, parser.skipped), (7, 1))
+            log = parser.result()
+            self.assertEqual(len(log), 6)
+            np.testing.assert_allclose(log.time - _BASE, [0.25, 10.25, 20, 3600.25, 3610.25,
+                                                          7300])
+            self.assertEqual(log.status.tolist(), [200, 200, 401, 401, 401, 200])
+            self.assertEqual([log.method_values[code] for code in log.method],
+                             ['GET', 'GET', 'POST', 'GET', 'GET', 'POST'])
+            self.assertEqual([log.user_values[code] for code in log.user],
+                             ['root', 'root', 'admin', 'guest', '-', 'root'])
+
+    def test_aggregations(self):
+        log = self.parse().result()
+        self.assertEqual(log.top_clients(2), [('10.0.0.9', 3), ('10.0.0.2', 2)])
+        self.assertEqual(log.top_clients(status=401), [('10.0.0.9', 3)])
+        self.assertEqual(log.top('user', 1), [('root', 3)])
+        self.assertEqual(len(log.where(camera='10.0.0.5', status=401)), 3)
+        self.assertEqual(len(log.where(camera='10.0.0.6')), 0)
+        self.assertEqual(len(log.between(_BASE + 10, _BASE + 3610)), 3)
+
+        starts, totals, hits, rates = log.unauthorized_rate(3600)
+        self.assertEqual((starts - _BASE).tolist(), [0, 3600, 7200])
+        self.assertEqual(totals.tolist(), [3, 2, 1])
+        self.assertEqual(hits.tolist(), [1, 2, 0])
+        np.testing.assert_allclose(rates, [1 / 3, 1, 0])
+
+        starts, paths, counts = log.requests_per_path(3600)
+        image = paths.index('/axis-cgi/jpg/image.cgi')
+        self.assertEqual(counts.shape, (3, len(paths)))
+        self.assertEqual(counts[:, image].tolist(), [0, 2, 0])
+        self.assertEqual(counts.sum(), 6)
+
+    def test_sparse_windows(self):
+        self.lines.append(_common(-_BASE, '10.0.0.2', 'root', '/axis-cgi/param.cgi', 200))
+        starts, totals, _, _ = self.parse().result().status_rate(200, 60)
+        # the stray 1970 line costs one window, next to the three holding the other requests
+        self.assertEqual((starts[1:] - _BASE).tolist(), [0, 3600, 7260])
+        self.assertEqual(starts[0], 0)
+        self.assertEqual(totals.sum(), 7)
+
+    def test_syslog_year(self):
+        now = datetime.datetime.now()
+        lines = [f'{stamp:%b} {stamp.day:2d} {stamp:%H:%M:%S} axis-accc8e012345 httpd[99]: '
+                 f'10.0.0.2 root GET /axis-cgi/param.cgi 200'
+                 for stamp in (now - datetime.timedelta(days=3), now + datetime.timedelta(days=3))]
+        parser = AccessLogParser()
+        parser.feed('10.0.0.5', '\n'.join(lines))
+        years = sorted(datetime.datetime.fromtimestamp(stamp).year
+                       for stamp in parser.result().time)
+        # a line dated in the future is from last year
+        expected = sorted([(now - datetime.timedelta(days=3)).year,
+                           (now + datetime.timedelta(days=3)).year - 1])
+        self.assertEqual(years, expected)
+
+    def test_collect(self):
+        device = SimulatedDevice('127.0.0.2')
+        device.access_log = self.lines
+        with DeviceFarm([device, SimulatedDevice('127.0.0.3', password='other')]) as farm:
+            cameras = [Camera(address, 'root', 'pass', port=farm.port, timeout=5)
+                       for address in ('127.0.0.2', '127.0.0.3')]
+            parser = AccessLogParser()
+            errors = parser.collect(cameras, workers=2)
+        self.assertIsNone(errors[cameras[0]])
+        self.assertTrue(errors[cameras[1]].startswith('401'))
+        log = parser.result()
+        self.assertEqual(len(log.where(camera='127.0.0.2')), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
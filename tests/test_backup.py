@@ -0,0 +1,49 @@
+import tempfile
+import unittest
+
+from axis_vapix import Camera
+from axis_vapix.backup import FleetBackup
+
+from simulator import DeviceFarm, SimulatedDevice
+
+
+class FleetBackupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.devices = [SimulatedDevice('127.0.0.2'), SimulatedDevice('127.0.0.3')]
+        for device in self.devices:
+            device.parameters.update({'root.Image.I0.Text.String': 'Lobby',
+                                      'root.Image.I0.Text.TextEnabled': 'yes',
+                                      'root.Network.IPAddress': device.address})
+        self.farm = DeviceFarm(self.devices).start()
+        self.addCleanup(self.farm.stop)
+        self.cameras = [Camera(device.address, 'root', 'pass', port=self.farm.port, timeout=5)
+                        for device in self.devices]
+        self.fleet = FleetBackup(tempfile.mkdtemp(), workers=2)
+
+    def test_restore_with_timeout(self):
+        reports = self.fleet.backup(self.cameras)
+        self.assertTrue(all(report.ok for report in reports.values()))
+        for device in self.devices:
+            device.parameters['root.Image.I0.Text.String'] = 'changed'
+            device.parameters['root.Network.IPAddress'] = '10.0.0.1'
+
+        reports = self.fleet.restore(self.cameras, timeout=5)
+        for device in self.devices:
+            report = reports[device.address]
+            self.assertTrue(report.ok, report)
+            self.assertEqual(report.changed, 1)
+            self.assertEqual(device.parameters['root.Image.I0.Text.String'], 'Lobby')
+            # the network group is left alone unless asked for
+            self.assertEqual(device.parameters['root.Network.IPAddress'], '10.0.0.1')
+
+    def test_dry_run(self):
+        self.fleet.backup(self.cameras)
+        self.devices[0].parameters['root.Image.I0.Text.TextEnabled'] = 'no'
+        reports = self.fleet.restore(self.cameras[:1], dry_run=True, include_network=True)
+        self.assertEqual(reports['127.0.0.2'].changed, 1)
+        self.assertEqual(self.devices[0].parameters['root.Image.I0.Text.TextEnabled'], 'no')
+
+
+if __name__ == '__main__':
+    unittest.main()
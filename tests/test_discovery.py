@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+
+from axis_vapix.discovery import AXIS, UNAUTHORIZED, Discovery, addresses, load_inventory, \
+    save_inventory
+
+from simulator import DeviceFarm, SimulatedDevice
+
+
+class DiscoveryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.devices = [
+            SimulatedDevice('127.0.0.2', serial='ACCC8E000002'),
+            SimulatedDevice('127.0.0.3', serial='ACCC8E000003', model='P1455-LE',
+                            product_type='Network Camera'),
+            SimulatedDevice('127.0.0.4', serial='ACCC8E000004', password='other'),
+            SimulatedDevice('127.0.0.5', kind='other'),
+            SimulatedDevice('127.0.0.6', kind='router'),
+        ]
+        self.farm = DeviceFarm(self.devices).start()
+        self.addCleanup(self.farm.stop)
+        self.discovery = Discovery('root', 'pass', port={'http': self.farm.port},
+                                   connect_timeout=0.5, timeout=2, max_sockets=16)
+
+    def test_identification(self):
+        found = {device.address: device for device in self.discovery.run('127.0.0.0/28')}
+        camera = found['127.0.0.2']
+        self.assertEqual(camera.status, AXIS)
+        self.assertEqual(camera.model, 'M5525-E')
+        self.assertEqual(camera.serial, 'ACCC8E000002')
+        self.assertEqual(camera.firmware, '10.12.114')
+        self.assertEqual(camera.port, self.farm.port)
+        self.assertEqual(found['127.0.0.3'].product_type, 'Network Camera')
+        self.assertNotIn('127.0.0.5', found)
+        self.assertNotIn('127.0.0.6', found)
+        self.assertEqual(self.discovery.stats()['scanned'], 14)
+        self.assertEqual(self.discovery.stats()['reachable'], 5)
+
+    def test_unauthorized_realm(self):
+        found = {device.address: device for device in self.discovery.run('127.0.0.0/28')}
+        device = found['127.0.0.4']
+        self.assertEqual(device.status, UNAUTHORIZED)
+        self.assertEqual(device.serial, 'ACCC8E000004')
+        self.assertIsNone(device.model)
+        # a foreign realm is not taken for an Axis device, with or without credentials
+        anonymous = Discovery(port={'http': self.farm.port}).run(['127.0.0.2', '127.0.0.6'])
+        self.assertEqual([(device.address, device.status) for device in anonymous],
+                         [('127.0.0.2', UNAUTHORIZED)])
+
+    def test_inventory_round_trip(self):
+        found = self.discovery.run('127.0.0.0/28')
+        directory = tempfile.mkdtemp()
+        for name in ('inventory.json', 'inventory.csv'):
+            path = os.path.join(directory, name)
+            save_inventory(found, path)
+            self.assertEqual(load_inventory(path), found)
+        camera = found[0].camera('root', 'pass')
+        self.assertEqual(camera.cam_url, f'http://127.0.0.2:{self.farm.port}')
+
+    def test_addresses(self):
+        # overlapping ranges come once, a single address given is kept even as a range edge
+        self.assertEqual(list(addresses(['127.0.0.0/30', '127.0.0.0/29', '127.0.0.7'],
+                                        exclude=['127.0.0.2'])),
+                         ['127.0.0.1', '127.0.0.3', '127.0.0.4', '127.0.0.5', '127.0.0.6',
+                          '127.0.0.7'])
+        self.assertEqual(len(list(addresses(['10.0.0.0/24', '10.0.1.0/24']))), 508)
+
+
+if __name__ == '__main__':
+    unittest.main()
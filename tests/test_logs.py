@@ -0,0 +1,62 @@
+import os
+import tempfile
+import unittest
+
+from axis_vapix import Camera
+from axis_vapix.logs import LogTailer
+
+from simulator import DeviceFarm, SimulatedDevice
+
+
+def _line(second: int, message: str, day: int = 1) -> str:
+    return f'2024-03-{day:02d}T10:00:{second:02d}.000+00:00 axis-accc8e012345 [ INFO    ] ' \
+           f'httpd[123]: {message}'
+
+
+class LogTailerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.device = SimulatedDevice('127.0.0.2')
+        self.farm = DeviceFarm([self.device]).start()
+        self.addCleanup(self.farm.stop)
+        self.camera = Camera('127.0.0.2', 'root', 'pass', port=self.farm.port, timeout=5)
+
+    def test_new_lines_only(self):
+        self.device.system_log = [_line(1, 'start'), _line(2, 'repeated'), _line(2, 'repeated')]
+        tailer = LogTailer()
+        self.assertEqual([record.message for record in tailer.poll(self.camera)],
+                         ['start', 'repeated', 'repeated'])
+        self.assertEqual(tailer.poll(self.camera), [])
+        # one more occurrence of the same line in the same second is new
+        self.device.system_log.append(_line(2, 'repeated'))
+        self.device.system_log.append(_line(3, 'later'))
+        self.assertEqual([record.message for record in tailer.poll(self.camera)],
+                         ['repeated', 'later'])
+
+    def test_state_file(self):
+        path = os.path.join(tempfile.mkdtemp(), 'cursors.json')
+        self.device.system_log = [_line(1, 'start'), _line(2, 'repeated'), _line(2, 'repeated')]
+        tailer = LogTailer(path)
+        self.assertEqual(len(tailer.poll(self.camera)), 3)
+        tailer.save()
+        self.assertEqual(LogTailer(path).poll(self.camera), [])
+
+    def test_clock_set_back(self):
+        self.device.system_log = [_line(1, 'start', day=5), _line(2, 'running', day=5)]
+        tailer = LogTailer()
+        self.assertEqual(len(tailer.poll(self.camera)), 2)
+        # after the clock is set back the whole log is older than the cursor
+        self.device.system_log = [_line(1, 'reboot'), _line(2, 'ready'), _line(2, 'ready')]
+        with self.assertLogs('axis_vapix.logs', 'WARNING'):
+            self.assertEqual(tailer.poll(self.camera), [])
+        # the lines of the newest second count as emitted, later lines are new
+        self.assertEqual(tailer.poll(self.camera), [])
+        self.device.system_log.append(_line(2, 'ready'))
+        self.device.system_log.append(_line(3, 'serving'))
+        self.assertEqual([record.message for record in tailer.poll(self.camera)],
+                         ['ready', 'serving'])
+        self.assertEqual(tailer.poll(self.camera), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
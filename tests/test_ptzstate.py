@@ -0,0 +1,91 @@
+import time
+import unittest
+
+from axis_vapix import Camera, PTZState
+
+from simulator import DeviceFarm, SimulatedDevice
+
+
+class PTZStateTest(unittest.TestCase):
+
+    def test_filter(self):
+        state = PTZState()
+        state.sent_command({'pan': 10.0, 'tilt': -20.0, 'zoom': 1})
+        self.assertIsNone(state.filter({'pan': 10.02, 'tilt': -20.0, 'zoom': 1}))
+        self.assertEqual(state.filter({'pan': 10.0, 'tilt': -25.0, 'zoom': None}),
+                         {'tilt': -25.0, 'zoom': None})
+        # readings always go out
+        self.assertEqual(state.filter({'query': 'position'}), {'query': 'position'})
+        self.assertEqual(state.stats(), {'sent': 1, 'suppressed': 1, 'trimmed': 1})
+
+    def test_pan_wraps(self):
+        state = PTZState()
+        state.update({'pan': '179.99'})
+        self.assertIsNone(state.filter({'pan': -179.99}))
+
+    def test_untracked_move_forgets_position(self):
+        state = PTZState()
+        state.sent_command({'pan': 10.0, 'speed': 50})
+        state.sent_command({'continuouspantiltmove': '10,0'})
+        self.assertEqual(state.filter({'pan': 10.0}), {'pan': 10.0})
+        self.assertIsNone(state.filter({'speed': 50}))
+        state.expire(settings=True)
+        self.assertEqual(state.filter({'speed': 50}), {'speed': 50})
+
+    def test_max_age(self):
+        state = PTZState(max_age=0.05)
+        state.sent_command({'zoom': 1})
+        self.assertIsNone(state.filter({'zoom': 1}))
+        time.sleep(0.1)
+        self.assertEqual(state.filter({'zoom': 1}), {'zoom': 1})
+
+    def test_channels(self):
+        state = PTZState()
+        state.sent_command({'speed': 50}, camera=1)
+        self.assertIsNone(state.filter({'speed': 50}, camera=1))
+        self.assertEqual(state.filter({'speed': 50}, camera=2), {'speed': 50})
+        # expiring a channel keeps the position of the others
+        state.sent_command({'pan': 5.0}, camera=2)
+        state.expire(camera=1)
+        self.assertIsNone(state.filter({'pan': 5.0}, camera=2))
+
+
+class CameraPTZStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.device = SimulatedDevice('127.0.0.2')
+        self.device.heads[2] = {'pan': 0.0, 'tilt': 0.0, 'zoom': 1.0, 'speed': 20.0}
+        self.farm = DeviceFarm([self.device]).start()
+        self.addCleanup(self.farm.stop)
+        self.camera = Camera('127.0.0.2', 'root', 'pass', port=self.farm.port, timeout=5,
+                             ptz_state=PTZState())
+
+    def test_suppression(self):
+        self.assertEqual(self.camera.absolute_move(10, -20, 1).status_code, 204)
+        sent = self.device.ptz_requests
+        resp = self.camera.absolute_move(10, -20, 1)
+        self.assertEqual(resp.status_code, 204)
+        self.assertEqual(self.device.ptz_requests, sent)
+        self.assertEqual(self.camera.ptz_state.stats()['suppressed'], 1)
+        # the camera reports a position it was moved to by something else
+        self.device.heads[1]['pan'] = 30.0
+        self.camera.get_status()
+        self.camera.absolute_move(10, -20, 1)
+        self.assertEqual(self.device.heads[1]['pan'], 10.0)
+
+    def test_speed_per_channel(self):
+        self.assertEqual(self.camera.get_speed(), 100)
+        self.assertEqual(self.camera.get_speed(camera=2), 20)
+        sent = self.device.ptz_requests
+        self.camera.set_speed(100)
+        self.camera.set_speed(20, camera=2)
+        self.assertEqual(self.device.ptz_requests, sent)
+        self.camera.set_speed(100, camera=2)
+        self.assertEqual(self.device.ptz_requests, sent + 1)
+        self.assertEqual(self.device.heads, {
+            1: {'pan': 0.0, 'tilt': 0.0, 'zoom': 1.0, 'speed': 100.0},
+            2: {'pan': 0.0, 'tilt': 0.0, 'zoom': 1.0, 'speed': 100.0}})
+
+
+if __name__ == '__main__':
+    unittest.main()
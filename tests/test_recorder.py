@@ -0,0 +1,80 @@
+import os
+import tempfile
+import unittest
+
+from axis_vapix.recorder import SegmentReader, SegmentRecorder
+
+
+def _frame(index: int) -> bytes:
+    # JPEG markers around a body of a length varying with the index
+    return b'\xff\xd8' + bytes([index % 256]) * (100 + index * 7 % 50) + b'\xff\xd9'
+
+
+class SegmentRecorderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def record(self, count: int, segment_size: int = 1000) -> dict:
+        frames = {}
+        with SegmentRecorder(self.directory, segment_size=segment_size) as recorder:
+            for index in range(count):
+                frames[1000.0 + index / 10] = _frame(index)
+                recorder.write(frames[1000.0 + index / 10], 1000.0 + index / 10)
+        return frames
+
+    def test_segments(self):
+        frames = self.record(50)
+        with SegmentReader(self.directory) as reader:
+            segments = reader.segments()
+            self.assertGreater(len(segments), 5)
+            self.assertEqual(sum(count for _, _, count in segments), 50)
+            for (_, last, _), (first, _, _) in zip(segments, segments[1:]):
+                self.assertLess(last, first)
+        sizes = [os.path.getsize(os.path.join(self.directory, name))
+                 for name in os.listdir(self.directory) if name.endswith('.seg')]
+        self.assertTrue(all(size <= 1000 for size in sizes))
+
+    def test_range_across_segments(self):
+        frames = self.record(50)
+        with SegmentReader(self.directory) as reader:
+            everything = [(frame.timestamp, bytes(frame.data)) for frame in reader.frames()]
+            self.assertEqual(everything, sorted(frames.items()))
+            # a range starting and ending inside segments, bounds between frames
+            selected = list(reader.frames(1001.05, 1003.45))
+            self.assertEqual([frame.timestamp for frame in selected],
+                             [stamp for stamp in sorted(frames) if 1001.05 <= stamp < 1003.45])
+            self.assertEqual([frame.seq for frame in selected], list(range(len(selected))))
+            self.assertTrue(all(isinstance(frame.data, memoryview) for frame in selected))
+            self.assertEqual([bytes(frame.data) for frame in selected],
+                             [frames[frame.timestamp] for frame in selected])
+            self.assertEqual(list(reader.frames(2000.0)), [])
+            self.assertEqual(len(list(reader.frames(None, 1000.0))), 0)
+
+    def test_reader_follows_writer(self):
+        recorder = SegmentRecorder(self.directory, segment_size=1000)
+        self.addCleanup(recorder.close)
+        for index in range(5):
+            recorder.write(_frame(index), 1000.0 + index)
+        recorder.flush()
+        reader = SegmentReader(self.directory)
+        self.addCleanup(reader.close)
+        self.assertEqual(len(list(reader.frames())), 5)
+        for index in range(5, 20):
+            recorder.write(_frame(index), 1000.0 + index)
+        recorder.flush()
+        reader.refresh()
+        self.assertEqual([frame.timestamp for frame in reader.frames(1004.0)],
+                         [1000.0 + index for index in range(4, 20)])
+
+    def test_torn_index(self):
+        self.record(10, segment_size=10 ** 6)
+        index = [name for name in os.listdir(self.directory) if name.endswith('.idx')][0]
+        with open(os.path.join(self.directory, index), 'ab') as var:
+            var.write(b'\x00' * 7)
+        with SegmentReader(self.directory) as reader:
+            self.assertEqual(len(list(reader.frames())), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
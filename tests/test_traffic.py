@@ -0,0 +1,70 @@
+import os
+import tempfile
+import unittest
+
+from axis_vapix import Camera
+from axis_vapix.logs import LogTailer
+from axis_vapix.traffic import read_traffic, record, replay
+
+from simulator import DeviceFarm, SimulatedDevice
+
+
+class TrafficTest(unittest.TestCase):
+
+    def setUp(self):
+        self.device = SimulatedDevice('127.0.0.2', serial='ACCC8E000002')
+        self.device.system_log = ['2024-03-01T10:00:01.000+00:00 axis-accc8e000002 [ INFO    ] '
+                                  'httpd[123]: started']
+        self.farm = DeviceFarm([self.device]).start()
+        self.addCleanup(self.farm.stop)
+        self.path = os.path.join(tempfile.mkdtemp(), 'site.vapix.gz')
+
+    def camera(self) -> Camera:
+        return Camera('127.0.0.2', 'root', 'pass', port=self.farm.port, timeout=5)
+
+    def workload(self, camera) -> tuple:
+        serial = camera.get_parameters('Properties.System.SerialNumber', only_value=True).strip()
+        # the log is downloaded as a stream
+        lines = [record.message for record in LogTailer().poll(camera)]
+        return serial, lines
+
+    def test_round_trip(self):
+        camera = self.camera()
+        writer = record([camera], self.path)
+        recorded = self.workload(camera)
+        writer.close()
+        self.assertEqual(recorded, ('ACCC8E000002', ['started']))
+
+        exchanges = list(read_traffic(self.path))
+        # the digest challenge of the first request is recorded with its answer
+        self.assertEqual([exchange.status for exchange in exchanges], [401, 200, 200])
+        self.assertIn('/axis-cgi/systemlog.cgi', exchanges[-1].url)
+
+        self.farm.stop()
+        requests = self.device.requests
+        camera = self.camera()
+        adapter = replay([camera], self.path, speed=0, strict=True)
+        self.assertEqual(self.workload(camera), recorded)
+        self.assertEqual(adapter.stats(), {'served': 3, 'missed': 0})
+        self.assertEqual(self.device.requests, requests)
+
+    def test_torn_batch(self):
+        camera = self.camera()
+        writer = record([camera], self.path)
+        self.workload(camera)
+        writer.flush()
+        complete = os.path.getsize(self.path)
+        self.workload(camera)
+        writer.close()
+        self.assertEqual(len(list(read_traffic(self.path))), 5)
+
+        # a crash in the middle of writing the second batch
+        with open(self.path, 'r+b') as var:
+            var.truncate(complete + (os.path.getsize(self.path) - complete) // 2)
+        with self.assertLogs('axis_vapix.traffic', 'WARNING'):
+            exchanges = list(read_traffic(self.path))
+        self.assertEqual([exchange.status for exchange in exchanges], [401, 200, 200])
+
+
+if __name__ == '__main__':
+    unittest.main()